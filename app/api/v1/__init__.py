@@ -1,5 +1,6 @@
-from fastapi import APIRouter
-from . import health, analytics
+from fastapi import APIRouter, Depends
+from app.core.access import require_api_key
+from . import health, analytics, fingerprints
 
 # Import other endpoint modules as they are created
 # from . import users, etc.
@@ -8,7 +9,8 @@ api_router = APIRouter(prefix="/v1")
 
 # Include routers
 api_router.include_router(health.router)
-# api_router.include_router(fingerprints.router)
+# Visitor lookups by device: only for callers holding FINGERPRINT_API_KEY
+api_router.include_router(fingerprints.router, dependencies=[Depends(require_api_key)])
 api_router.include_router(analytics.router)
 
 # Add other routers as they are created
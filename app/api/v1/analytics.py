@@ -1,13 +1,20 @@
-from fastapi import APIRouter, Request, status
+from fastapi import APIRouter, Query, Request, status
 from app.core import create_response
 from app.core.rate_limiter import limiter
 import logging
-import httpx
 import ipaddress
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from datetime import datetime, timedelta
 from pydantic import BaseModel
 from app.core.services import log_visitor_profile
+from app.core.http_client import http_client
+from app.core.ip_geo import get_ip_location
+from app.core.public_ip import public_ip
 from app.core.location_utils import get_location_from_coordinates, combine_location_data
+from app.core.cardinality import unique_counters
+from app.core.rollups import rollups
+from app.core.visit_events import visit_events
+from app.core.dictionary import value_dictionary
 
 logger = logging.getLogger(__name__)
 
@@ -58,25 +65,8 @@ async def get_ip_info(request: Request):
         # If we got localhost/private IP, try to get real public IP
         real_public_ip = client_ip
         if client_ip in ["127.0.0.1", "localhost", "::1"] or client_ip.startswith("192.168.") or client_ip.startswith("10.") or client_ip.startswith("172."):
-            try:
-                # Get real public IP from external service
-                async with httpx.AsyncClient(timeout=5.0) as client:
-                    # Try multiple services for reliability
-                    for service in ["https://api.ipify.org?format=json", "https://ipinfo.io/json", "https://httpbin.org/ip"]:
-                        try:
-                            response = await client.get(service)
-                            if response.status_code == 200:
-                                data = response.json()
-                                if "ip" in data:
-                                    real_public_ip = data["ip"]
-                                    break
-                                elif "origin" in data:  # httpbin format
-                                    real_public_ip = data["origin"]
-                                    break
-                        except:
-                            continue
-            except Exception as e:
-                logger.warning(f"Failed to get public IP: {str(e)}")
+            # Resolved at startup and refreshed in the background, not per request
+            real_public_ip = await public_ip.get() or client_ip
         
         # Basic IP info
         ip_info = {
@@ -98,38 +88,8 @@ async def get_ip_info(request: Request):
         
         # Try to get geolocation data for the IP
         if ip_for_geo and ip_for_geo != "unknown" and not ip_for_geo.startswith("127.") and not ip_for_geo.startswith("192.168.") and not ip_for_geo.startswith("10."):
-            try:
-                # Use a free IP geolocation service
-                async with httpx.AsyncClient(timeout=5.0) as client:
-                    response = await client.get(f"http://ip-api.com/json/{ip_for_geo}?fields=status,message,continent,continentCode,country,countryCode,region,regionName,city,district,zip,lat,lon,timezone,offset,currency,isp,org,as,asname,mobile,proxy,hosting,query")
-                    
-                    if response.status_code == 200:
-                        geo_data = response.json()
-                        if geo_data.get("status") == "success":
-                            ip_info["location"] = {
-                                "country": geo_data.get("country"),
-                                "countryCode": geo_data.get("countryCode"),
-                                "region": geo_data.get("regionName"),
-                                "city": geo_data.get("city"),
-                                "latitude": geo_data.get("lat"),
-                                "longitude": geo_data.get("lon"),
-                                "timezone": geo_data.get("timezone"),
-                                "isp": geo_data.get("isp"),
-                                "organization": geo_data.get("org"),
-                                "continent": geo_data.get("continent"),
-                                "mobile": geo_data.get("mobile"),
-                                "proxy": geo_data.get("proxy"),
-                                "hosting": geo_data.get("hosting"),
-                                "query": geo_data.get("query")
-                            }
-                        else:
-                            ip_info["location"] = {"error": geo_data.get("message", "Location lookup failed")}
-                    else:
-                        ip_info["location"] = {"error": "Geolocation service unavailable"}
-                        
-            except Exception as e:
-                logger.warning(f"Geolocation lookup failed for IP {ip_for_geo}: {str(e)}")
-                ip_info["location"] = {"error": "Geolocation lookup failed"}
+            # Local range database first, remote provider only on a miss
+            ip_info["location"] = await get_ip_location(ip_for_geo)
         else:
             ip_info["location"] = {"error": "Private or local IP address", "note": "Using localhost - deploy to see real location"}
         
@@ -202,3 +162,190 @@ async def visitor_log(request: Request, profile: Dict[str, Any]):
     client_ip = get_client_ip(request)
     await log_visitor_profile(client_ip, profile, real_ip=real_ip)
     return {"ok": True}
+
+def _time_range(start: Optional[datetime], end: Optional[datetime]):
+    """Default to the last 24 hours."""
+    end = end or datetime.utcnow()
+    return start or end - timedelta(days=1), end
+
+def _invalid_query(error: ValueError):
+    return create_response(
+        success=False,
+        data={"error": str(error)},
+        message="Invalid analytics query",
+        status_code=400
+    )
+
+@router.get("/unique", response_model=dict, summary="Unique visitors, devices or IPs over a time range")
+@limiter.limit("60/minute")
+async def unique_count(
+    request: Request,
+    metric: str = Query("visitors", description="visitors, devices or ips"),
+    dimension: str = Query("all", description="all, site, country or browser"),
+    value: Optional[str] = Query(None, description="Dimension value, e.g. a site host or country code"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """HyperLogLog estimate merged over the range's hour/day buckets (standard error 0.81%)."""
+    start, end = _time_range(start, end)
+    try:
+        result = await unique_counters.count(metric, dimension, value, start, end)
+    except ValueError as e:
+        return _invalid_query(e)
+    return create_response(data=result, message="Unique count retrieved successfully")
+
+@router.get("/unique/series", response_model=dict, summary="Unique counts per hour or day")
+@limiter.limit("60/minute")
+async def unique_series(
+    request: Request,
+    metric: str = Query("visitors"),
+    dimension: str = Query("all"),
+    value: Optional[str] = None,
+    granularity: str = Query("hour", description="hour or day"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """One HyperLogLog estimate per bucket across the range."""
+    start, end = _time_range(start, end)
+    try:
+        series = await unique_counters.series(metric, dimension, value, start, end, granularity)
+    except ValueError as e:
+        return _invalid_query(e)
+    return create_response(
+        data={"metric": metric, "dimension": dimension, "value": value, "granularity": granularity, "series": series},
+        message="Unique count series retrieved successfully"
+    )
+
+@router.get("/unique/breakdown", response_model=dict, summary="Unique counts per site, country or browser")
+@limiter.limit("60/minute")
+async def unique_breakdown(
+    request: Request,
+    dimension: str = Query(..., description="site, country or browser"),
+    metric: str = Query("visitors"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(20, ge=1, le=500)
+):
+    """Top dimension values by distinct count over the range."""
+    start, end = _time_range(start, end)
+    try:
+        result = await unique_counters.breakdown(metric, dimension, start, end, limit)
+    except ValueError as e:
+        return _invalid_query(e)
+    return create_response(data=result, message="Unique count breakdown retrieved successfully")
+
+@router.get("/rollups", response_model=dict, summary="Visits per browser, OS, device type or country over a time range")
+@limiter.limit("60/minute")
+async def rollup_totals(
+    request: Request,
+    dimension: str = Query("all", description="all, browser, os, device_type or country"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Exact visit counts summed from the fewest pre-aggregated day/hour/minute buckets covering the range."""
+    start, end = _time_range(start, end)
+    try:
+        result = await rollups.totals(dimension, start, end)
+    except ValueError as e:
+        return _invalid_query(e)
+    return create_response(data=result, message="Rollup totals retrieved successfully")
+
+@router.get("/rollups/series", response_model=dict, summary="Visits per minute, hour or day")
+@limiter.limit("60/minute")
+async def rollup_series(
+    request: Request,
+    dimension: str = Query("all"),
+    granularity: Optional[str] = Query(None, description="minute, hour or day; finest that fits when omitted"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Per-bucket visit counts across the range."""
+    start, end = _time_range(start, end)
+    try:
+        result = await rollups.series(dimension, start, end, granularity)
+    except ValueError as e:
+        return _invalid_query(e)
+    return create_response(data=result, message="Rollup series retrieved successfully")
+
+@router.get("/visits", response_model=dict, summary="Visit events in a time range")
+@limiter.limit("60/minute")
+async def visit_scan(
+    request: Request,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    fingerprint_hash: Optional[str] = None,
+    cell: Optional[str] = Query(None, description="Geohash cell"),
+    browser: Optional[str] = None,
+    country: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """Per-visit events, oldest first, from the visit_events time-series collection."""
+    start, end = _time_range(start, end)
+    filters = {"fingerprint_hash": fingerprint_hash, "cell": cell, "browser": browser, "country": country}
+    try:
+        events = await visit_events.scan(start, end, filters, limit)
+    except ValueError as e:
+        return _invalid_query(e)
+    return create_response(
+        data={"start": start.isoformat(), "end": end.isoformat(), "count": len(events), "events": events},
+        message="Visit events retrieved successfully"
+    )
+
+@router.get("/visits/histogram", response_model=dict, summary="Visits per time unit from visit events")
+@limiter.limit("60/minute")
+async def visit_histogram(
+    request: Request,
+    unit: str = Query("hour", description="minute, hour, day, week or month"),
+    by: Optional[str] = Query(None, description="Also group by fingerprint_hash, cell, browser, os, device_type, country or visitor_id"),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    fingerprint_hash: Optional[str] = None,
+    cell: Optional[str] = None,
+    browser: Optional[str] = None,
+    country: Optional[str] = None
+):
+    """Visit counts aggregated over the range's time-series buckets."""
+    start, end = _time_range(start, end)
+    filters = {"fingerprint_hash": fingerprint_hash, "cell": cell, "browser": browser, "country": country}
+    try:
+        rows = await visit_events.histogram(start, end, unit, by, filters)
+    except ValueError as e:
+        return _invalid_query(e)
+    return create_response(
+        data={"unit": unit, "by": by, "start": start.isoformat(), "end": end.isoformat(), "histogram": rows},
+        message="Visit histogram retrieved successfully"
+    )
+
+@router.get("/profile-values/{kind}", response_model=dict, summary="Most common user agents, font lists or feature maps")
+@limiter.limit("30/minute")
+async def top_profile_values(
+    request: Request,
+    kind: str,
+    limit: int = Query(20, ge=1, le=200)
+):
+    """Visitors per distinct value, from the counts kept on each profile_dictionary entry."""
+    try:
+        values = await value_dictionary.top(kind, limit)
+    except ValueError as e:
+        return _invalid_query(e)
+    return create_response(
+        data={"kind": kind, "count": len(values), "values": values},
+        message="Profile values retrieved successfully"
+    )
+
+@router.get("/profile-values/{kind}/{value_id}", response_model=dict, summary="Resolve a profile dictionary id")
+@limiter.limit("60/minute")
+async def profile_value(request: Request, kind: str, value_id: int):
+    """The value behind a ua_id, fonts_id or features_id."""
+    try:
+        value = await value_dictionary.lookup(kind, value_id)
+    except ValueError as e:
+        return _invalid_query(e)
+    if value is None:
+        return create_response(
+            success=False,
+            data={"error": f"No {kind} value with id {value_id}"},
+            message="Profile value not found",
+            status_code=404
+        )
+    return create_response(data={"kind": kind, "id": value_id, "value": value}, message="Profile value retrieved successfully")
@@ -1 +1,179 @@
-# This module is intentionally left empty as fingerprints collection logging has been removed.
+from fastapi import APIRouter, Query, Request
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from app.core import create_response
+from app.core.fingerprint import canonical_components, compute_fingerprint_hash
+from app.core.frequency import attribute_frequencies
+from app.core.profile_store import profile_store
+from app.core.rate_limiter import limiter
+from app.core.similarity import similarity_index
+from app.core.visit_events import visit_events
+from app.core.views import VIEWS
+from app.database import get_collection
+from app.models import FingerprintAnalysis
+import logging
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/fingerprints", tags=["Fingerprints"])
+
+async def _visitors_with_hash(fingerprint_hash: str, limit: int):
+    collection = get_collection("visitor_logs")
+    cursor = collection.find({"fingerprint_hash": fingerprint_hash}, VIEWS["visitor_logs"]["summary"]).limit(limit)
+    return await cursor.to_list(length=limit)
+
+@router.get("/{fingerprint_hash}/visitors", response_model=dict, summary="Visitors sharing a fingerprint hash")
+@limiter.limit("30/minute")
+async def visitors_by_fingerprint(request: Request, fingerprint_hash: str, limit: int = Query(50, ge=1, le=500)):
+    """Exact-match lookup of visitor records by fingerprint hash."""
+    visitors = await _visitors_with_hash(fingerprint_hash, limit)
+    return create_response(
+        data={"fingerprint_hash": fingerprint_hash, "count": len(visitors), "visitors": visitors},
+        message="Matching visitors retrieved successfully"
+    )
+
+@router.post("/match", response_model=dict, summary="Find returning devices for a collected profile")
+@limiter.limit("30/minute")
+async def match_fingerprint(request: Request, profile: Dict[str, Any], limit: int = Query(50, ge=1, le=500)):
+    """Hash a collected profile and return visitors with the same device fingerprint."""
+    fingerprint_hash = compute_fingerprint_hash(profile)
+    if fingerprint_hash is None:
+        return create_response(
+            success=False,
+            data={"error": "Profile contains no fingerprint components"},
+            message="Nothing to match",
+            status_code=400
+        )
+    visitors = await _visitors_with_hash(fingerprint_hash, limit)
+    return create_response(
+        data={
+            "fingerprint_hash": fingerprint_hash,
+            "components": sorted(canonical_components(profile)),
+            "count": len(visitors),
+            "visitors": visitors
+        },
+        message="Matching visitors retrieved successfully"
+    )
+
+def _similar_payload(similar: List[Tuple[str, float]]) -> Dict[str, Any]:
+    return {
+        "similar_fingerprints": len(similar),
+        "similar": [{"visitor_id": visitor_id, "similarity": score} for visitor_id, score in similar]
+    }
+
+@router.get("/visitors/{visitor_id}/similar", response_model=dict, summary="Devices similar to a known visitor")
+@limiter.limit("30/minute")
+async def similar_to_visitor(
+    request: Request,
+    visitor_id: str,
+    k: int = Query(10, ge=1, le=100),
+    threshold: Optional[float] = Query(None, ge=0, le=1)
+):
+    """Top-k near-duplicate devices from the LSH index (estimated Jaccard similarity)."""
+    similar = await similarity_index.similar_to_visitor(visitor_id, k, threshold)
+    if similar is None:
+        return create_response(
+            success=False,
+            data={"error": "Visitor is not in the similarity index"},
+            message="Visitor not indexed",
+            status_code=404
+        )
+    return create_response(
+        data={"visitor_id": visitor_id, **_similar_payload(similar)},
+        message="Similar devices retrieved successfully"
+    )
+
+@router.post("/similar", response_model=dict, summary="Devices similar to a collected profile")
+@limiter.limit("30/minute")
+async def similar_to_profile(
+    request: Request,
+    profile: Dict[str, Any],
+    k: int = Query(10, ge=1, le=100),
+    threshold: Optional[float] = Query(None, ge=0, le=1)
+):
+    """Top-k near-duplicate devices for a profile that may not have been logged yet."""
+    similar = await similarity_index.similar_to_profile(profile, k, threshold)
+    return create_response(
+        data=_similar_payload(similar),
+        message="Similar devices retrieved successfully"
+    )
+
+async def _analyze(profile: Dict[str, Any]) -> Dict[str, Any]:
+    similar = await similarity_index.similar_to_profile(profile)
+    analysis = await attribute_frequencies.score(profile, similar_fingerprints=len(similar))
+    # Validate the FingerprintAnalysis fields; the per-attribute breakdown rides along
+    validated = FingerprintAnalysis(**{name: analysis[name] for name in FingerprintAnalysis.model_fields})
+    return {**analysis, **validated.model_dump()}
+
+@router.post("/score", response_model=dict, summary="Uniqueness and entropy of a collected profile")
+@limiter.limit("30/minute")
+async def score_profile(request: Request, profile: Dict[str, Any]):
+    """Score how identifying a profile is from streaming attribute frequencies."""
+    return create_response(
+        data=await _analyze(profile),
+        message="Fingerprint analysis completed successfully"
+    )
+
+@router.get("/visitors/{visitor_id}/score", response_model=dict, summary="Uniqueness and entropy of a logged visitor")
+@limiter.limit("30/minute")
+async def score_visitor(request: Request, visitor_id: str):
+    """Score a logged visitor's latest profile."""
+    profile = await _visitor_profile(visitor_id)
+    if not profile:
+        return create_response(
+            success=False,
+            data={"error": "Visitor not found"},
+            message="Visitor not found",
+            status_code=404
+        )
+    return create_response(
+        data={"visitor_id": visitor_id, **await _analyze(profile)},
+        message="Fingerprint analysis completed successfully"
+    )
+
+async def _visitor_profile(visitor_id: str) -> Optional[Dict[str, Any]]:
+    document = await get_collection("visitor_logs").find_one({"visitor_id": visitor_id}, {"visitor_id": 1, "profile": 1, "location.address": 1})
+    return await profile_store.load(document) if document else None
+
+@router.get("/visitors/{visitor_id}/profile", response_model=dict, summary="Full collected profile of a logged visitor")
+@limiter.limit("30/minute")
+async def visitor_profile(request: Request, visitor_id: str):
+    """The visitor's latest full profile, decompressed from cold storage."""
+    profile = await _visitor_profile(visitor_id)
+    if not profile:
+        return create_response(
+            success=False,
+            data={"error": "Visitor not found"},
+            message="Visitor not found",
+            status_code=404
+        )
+    return create_response(
+        data={"visitor_id": visitor_id, "profile": profile},
+        message="Visitor profile retrieved successfully"
+    )
+
+@router.get("/visitors/{visitor_id}/visits", response_model=dict, summary="Visit history of a logged visitor")
+@limiter.limit("30/minute")
+async def visitor_visits(
+    request: Request,
+    visitor_id: str,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """The visitor's visits (time, fingerprint hash, geo cell, browser), newest first."""
+    visits = await visit_events.timeline(visitor_id, start, end, limit)
+    return create_response(
+        data={"visitor_id": visitor_id, "count": len(visits), "visits": visits},
+        message="Visit history retrieved successfully"
+    )
+
+@router.get("/visitors/{visitor_id}/changes", response_model=dict, summary="Profile changes of a logged visitor")
+@limiter.limit("30/minute")
+async def visitor_changes(request: Request, visitor_id: str, limit: int = Query(50, ge=1, le=500)):
+    """Changed profile paths per visit, newest first (fingerprint drift)."""
+    changes = await profile_store.changes(visitor_id, limit)
+    return create_response(
+        data={"visitor_id": visitor_id, "count": len(changes), "changes": changes},
+        message="Profile changes retrieved successfully"
+    )
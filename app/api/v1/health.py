@@ -2,8 +2,27 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from typing import List, Optional
 from app.models import PaginationParams, PaginatedResponse, ErrorResponse
 from app.core import create_response, create_error_response, validate_object_id
-from app.database import get_collection
+from app.database import get_collection, redis_client
+from app.database.indexes import index_manager
 from app.config import settings
+from app.core.http_client import http_client
+from app.core.ingest import ingest_queue
+from app.core.profile_store import profile_store
+from app.core.dictionary import value_dictionary
+from app.core.visit_events import visit_events
+from app.core.geo_cache import geo_cache
+from app.core.ip_geo import ip_flight, ip_geo
+from app.core.location_utils import geocode_flight
+from app.core.provider_health import provider_health
+from app.core.public_ip import public_ip
+from app.core import user_agent
+from app.core.similarity import similarity_index
+from app.core.frequency import attribute_frequencies
+from app.core.cardinality import unique_counters
+from app.core.rollups import rollups
+from app.core.retention import retention_engine
+from app.core.reverse_geocoder import reverse_geocoder
+from app.core.enrichment import geocode_enrichment
 import logging
 
 logger = logging.getLogger(__name__)
@@ -55,3 +74,48 @@ async def database_health():
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=f"Database connection failed: {str(e)}"
         )
+
+@router.get("/indexes", summary="Index Registry Audit")
+async def index_audit():
+    """Missing, conflicting, unmanaged and unused indexes, plus builds in progress."""
+    try:
+        report = await index_manager.check()
+    except Exception as e:
+        logger.error(f"Index audit failed: {str(e)}")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=f"Index audit failed: {str(e)}"
+        )
+    return create_response(message="Index audit completed", data=report)
+
+@router.get("/metrics", summary="Internal Pipeline Metrics")
+async def pipeline_metrics():
+    """Queue depth and latency statistics for background pipelines."""
+    return create_response(
+        message="Pipeline metrics retrieved successfully",
+        data={
+            "ingest": ingest_queue.stats(),
+            "profiles": profile_store.stats(),
+            "profile_dictionary": value_dictionary.stats(),
+            "visit_events": visit_events.stats(),
+            "geocode_enrichment": geocode_enrichment.stats(),
+            "http": http_client.stats(),
+            "geo_cache": geo_cache.stats(),
+            "cache": redis_client.stats(),
+            "ip_geo": ip_geo.stats(),
+            "public_ip": public_ip.stats(),
+            "user_agent": user_agent.stats(),
+            "similarity": similarity_index.stats(),
+            "frequencies": attribute_frequencies.stats(),
+            "cardinality": unique_counters.stats(),
+            "rollups": rollups.stats(),
+            "indexes": index_manager.stats(),
+            "retention": retention_engine.stats(),
+            "reverse_geocoder": reverse_geocoder.stats(),
+            "providers": provider_health.stats(),
+            "singleflight": {
+                "geocode": geocode_flight.stats(),
+                "ip_geo": ip_flight.stats()
+            }
+        }
+    )
@@ -1,6 +1,6 @@
 from pydantic_settings import BaseSettings
 from pydantic import Field
-from typing import List, Optional
+from typing import Dict, List, Optional
 import os
 from pathlib import Path
 
@@ -12,6 +12,11 @@ class Settings(BaseSettings):
     # Redis Configuration
     redis_url: str = Field("redis://localhost:6379", env="REDIS_URL")
     redis_cache_ttl: int = Field(3600, env="REDIS_CACHE_TTL")  # 1 hour default
+    redis_l1_enabled: bool = Field(True, env="REDIS_L1_ENABLED")  # in-process cache in front of Redis
+    redis_l1_max_bytes: int = Field(16 * 1024 * 1024, env="REDIS_L1_MAX_BYTES")
+    redis_l1_max_entries: int = Field(10000, env="REDIS_L1_MAX_ENTRIES")
+    redis_l1_ttl: int = Field(300, env="REDIS_L1_TTL")  # upper bound; never exceeds the Redis TTL
+    redis_l1_invalidation_channel: str = Field("bfp:cache:invalidate", env="REDIS_L1_INVALIDATION_CHANNEL")
     
     # API Configuration
     api_base_url1: str = Field(..., env="API_BASE_URL1")
@@ -24,6 +29,7 @@ class Settings(BaseSettings):
     
     # Security Settings
     secret_key: str = Field(..., env="SECRET_KEY")
+    fingerprint_api_key: Optional[str] = Field(None, env="FINGERPRINT_API_KEY")  # X-API-Key for /fingerprints; unset = routes disabled
     allowed_hosts: List[str] = Field(
         ["localhost", "127.0.0.1", "0.0.0.0"], 
         env="ALLOWED_HOSTS"
@@ -40,7 +46,173 @@ class Settings(BaseSettings):
     # Data Retention
     data_retention_days: int = Field(30, env="DATA_RETENTION_DAYS")
     anonymize_after_days: int = Field(7, env="ANONYMIZE_AFTER_DAYS")
-    
+    # Unthrottled alternative to the retention engine's paced deletes
+    retention_ttl_index: bool = Field(False, env="RETENTION_TTL_INDEX")  # expire visitor_logs by created_at after data_retention_days
+    retention_enabled: bool = Field(True, env="RETENTION_ENABLED")  # background anonymization/deletion job
+    retention_interval: int = Field(3600, env="RETENTION_INTERVAL")  # seconds between runs
+    retention_initial_delay: int = Field(60, env="RETENTION_INITIAL_DELAY")  # seconds after startup before the first run
+    retention_batch_size: int = Field(500, env="RETENTION_BATCH_SIZE")  # documents per bulk update/delete
+    retention_batch_pause: float = Field(0.2, env="RETENTION_BATCH_PAUSE")  # seconds between batches (x10 while ingest is backed up)
+    retention_max_batches: Optional[int] = Field(None, env="RETENTION_MAX_BATCHES")  # per phase per run; unset = until done
+    retention_ingest_backoff_ratio: float = Field(0.5, env="RETENTION_INGEST_BACKOFF_RATIO")  # ingest queue fill that slows the job
+    retention_lock_ttl: int = Field(3600, env="RETENTION_LOCK_TTL")  # seconds; one worker runs the job at a time
+    anonymize_coordinate_precision: int = Field(1, env="ANONYMIZE_COORDINATE_PRECISION")  # GPS decimals kept (1 = ~11 km)
+
+    # Visitor Ingest Queue (write-behind batching for visitor-log)
+    ingest_queue_max_size: int = Field(10000, env="INGEST_QUEUE_MAX_SIZE")
+    ingest_batch_size: int = Field(500, env="INGEST_BATCH_SIZE")
+    ingest_flush_interval: float = Field(1.0, env="INGEST_FLUSH_INTERVAL")  # seconds
+    ingest_overflow_policy: str = Field("block", env="INGEST_OVERFLOW_POLICY")  # block, drop_newest, drop_oldest, inline
+    ingest_enqueue_timeout: float = Field(0.5, env="INGEST_ENQUEUE_TIMEOUT")  # seconds, "block" policy only
+    ingest_shutdown_timeout: float = Field(10.0, env="INGEST_SHUTDOWN_TIMEOUT")  # seconds
+
+    # GPS Address Enrichment (reverse geocoding off the ingest path)
+    geocode_enrichment_workers: int = Field(4, env="GEOCODE_ENRICHMENT_WORKERS")
+    geocode_enrichment_queue_size: int = Field(5000, env="GEOCODE_ENRICHMENT_QUEUE_SIZE")
+
+    # Geocode Cache (nearby coordinates share one entry)
+    geo_cache_mode: str = Field("geohash", env="GEO_CACHE_MODE")  # geohash or grid
+    geo_cache_precision: int = Field(7, env="GEO_CACHE_PRECISION")  # geohash length, 7 = ~153m cells
+    geo_cache_grid_size: float = Field(0.001, env="GEO_CACHE_GRID_SIZE")  # degrees, grid mode only
+    geo_cache_neighbor_lookup: bool = Field(False, env="GEO_CACHE_NEIGHBOR_LOOKUP")
+
+    # Upstream provider health (circuit breakers and adaptive timeouts)
+    provider_failure_threshold: int = Field(5, env="PROVIDER_FAILURE_THRESHOLD")  # consecutive failures before opening
+    provider_recovery_timeout: float = Field(30.0, env="PROVIDER_RECOVERY_TIMEOUT")  # seconds before a half-open probe
+    provider_latency_window: int = Field(200, env="PROVIDER_LATENCY_WINDOW")
+    provider_timeout_percentile: float = Field(0.95, env="PROVIDER_TIMEOUT_PERCENTILE")
+    provider_timeout_multiplier: float = Field(1.5, env="PROVIDER_TIMEOUT_MULTIPLIER")
+    provider_timeout_min: float = Field(0.5, env="PROVIDER_TIMEOUT_MIN")
+    provider_timeout_min_samples: int = Field(20, env="PROVIDER_TIMEOUT_MIN_SAMPLES")
+
+    # Server public IP discovery (used when clients arrive from private addresses)
+    public_ip: Optional[str] = Field(None, env="PUBLIC_IP")  # pin it and skip discovery entirely
+    public_ip_refresh_interval: int = Field(3600, env="PUBLIC_IP_REFRESH_INTERVAL")  # seconds, 0 disables
+    public_ip_retry_interval: int = Field(60, env="PUBLIC_IP_RETRY_INTERVAL")  # seconds between retries while unknown
+
+    # User-agent parsing
+    user_agent_cache_size: int = Field(4096, env="USER_AGENT_CACHE_SIZE")  # distinct UA strings kept parsed
+
+    # Server-side fingerprint hashing (bump the version when changing components)
+    fingerprint_hash_version: int = Field(1, env="FINGERPRINT_HASH_VERSION")
+    fingerprint_components: List[str] = Field(
+        ["canvas", "webgl", "webgl_fingerprint", "audio", "fonts", "hardware", "display", "timezone"],
+        env="FINGERPRINT_COMPONENTS"
+    )
+
+    # Near-duplicate device index (MinHash/LSH in Redis)
+    similarity_enabled: bool = Field(True, env="SIMILARITY_ENABLED")
+    similarity_num_perm: int = Field(128, env="SIMILARITY_NUM_PERM")
+    similarity_bands: int = Field(32, env="SIMILARITY_BANDS")  # rows per band = num_perm / bands
+    similarity_seed: int = Field(1, env="SIMILARITY_SEED")  # changing it invalidates every stored signature
+    similarity_threshold: float = Field(0.5, env="SIMILARITY_THRESHOLD")  # minimum estimated Jaccard to count as similar
+    similarity_top_k: int = Field(10, env="SIMILARITY_TOP_K")
+    similarity_max_bucket: int = Field(500, env="SIMILARITY_MAX_BUCKET")  # members sampled from one band bucket per query
+    similarity_max_candidates: int = Field(2000, env="SIMILARITY_MAX_CANDIDATES")  # signatures compared per query, most shared bands first
+    similarity_ttl: int = Field(2592000, env="SIMILARITY_TTL")  # 30 days
+    similarity_flush_interval: float = Field(2.0, env="SIMILARITY_FLUSH_INTERVAL")  # seconds between background similar-count updates
+    similarity_max_pending: int = Field(1000, env="SIMILARITY_MAX_PENDING")  # queued visitors that force an early update
+
+    # Streaming attribute frequencies (uniqueness / entropy scoring)
+    frequency_enabled: bool = Field(True, env="FREQUENCY_ENABLED")
+    frequency_sketch_width: int = Field(8192, env="FREQUENCY_SKETCH_WIDTH")  # counters per count-min row
+    frequency_sketch_depth: int = Field(4, env="FREQUENCY_SKETCH_DEPTH")  # rows (independent hashes), max 16
+    frequency_dedupe_ttl: int = Field(2592000, env="FREQUENCY_DEDUPE_TTL")  # don't recount an unchanged visitor for 30 days
+    frequency_dedupe_slots: int = Field(262144, env="FREQUENCY_DEDUPE_SLOTS")  # fixed-size table of last-counted vectors
+    frequency_exact_max_values: int = Field(512, env="FREQUENCY_EXACT_MAX_VALUES")  # distinct exact values per attribute; more go to the sketch
+
+    # Unique-visitor counters (HyperLogLog per time bucket and dimension)
+    cardinality_enabled: bool = Field(True, env="CARDINALITY_ENABLED")
+    cardinality_flush_interval: float = Field(5.0, env="CARDINALITY_FLUSH_INTERVAL")  # seconds between buffered PFADD flushes
+    cardinality_max_pending: int = Field(10000, env="CARDINALITY_MAX_PENDING")  # buffered elements that force an early flush
+    cardinality_hour_ttl: int = Field(1209600, env="CARDINALITY_HOUR_TTL")  # hourly buckets kept 14 days
+    cardinality_day_ttl: int = Field(34560000, env="CARDINALITY_DAY_TTL")  # daily buckets kept 400 days
+    cardinality_max_dimension_values: int = Field(1000, env="CARDINALITY_MAX_DIMENSION_VALUES")  # per breakdown query
+
+    # Visit rollups (pre-aggregated dashboard counters)
+    rollups_enabled: bool = Field(True, env="ROLLUPS_ENABLED")
+    rollup_minute_ttl: int = Field(172800, env="ROLLUP_MINUTE_TTL")  # minute buckets kept 2 days
+    rollup_hour_ttl: int = Field(7776000, env="ROLLUP_HOUR_TTL")  # hour buckets kept 90 days
+    rollup_day_ttl: int = Field(0, env="ROLLUP_DAY_TTL")  # 0 keeps day buckets forever
+    rollup_max_points: int = Field(1000, env="ROLLUP_MAX_POINTS")  # buckets returned by one series query
+
+    # Index management (app/database/indexes.py registry)
+    index_apply_on_startup: bool = Field(True, env="INDEX_APPLY_ON_STARTUP")
+    index_progress_interval: float = Field(10.0, env="INDEX_PROGRESS_INTERVAL")  # seconds between build progress logs
+
+    # Pagination
+    pagination_count_cache_ttl: int = Field(60, env="PAGINATION_COUNT_CACHE_TTL")  # seconds a "cached" total is reused
+
+    # Cold profile storage (full profiles compressed in visitor_profiles, see app/core/profile_store.py)
+    profile_cold_storage: bool = Field(True, env="PROFILE_COLD_STORAGE")  # false keeps the profile inline in visitor_logs
+    profile_compression: str = Field("zlib", env="PROFILE_COMPRESSION")  # zlib, or zstd with the zstandard package installed
+    profile_compression_level: int = Field(6, env="PROFILE_COMPRESSION_LEVEL")
+    # Change detection: returning visits whose profile digest (ignoring these per-visit paths) is unchanged skip the profile write
+    profile_change_detection: bool = Field(True, env="PROFILE_CHANGE_DETECTION")
+    profile_change_records: bool = Field(True, env="PROFILE_CHANGE_RECORDS")  # keep each visit's diff in profile_changes
+    profile_volatile_fields: List[str] = Field(
+        ["visit_count", "collectedAt", "collectDuration", "sessionKey", "network", "battery", "interaction",
+         "storage.usage", "session.url", "session.ref", "session.hist", "session.pageVisibility", "loc.gps.accuracy",
+         "loc.gps.address"],  # resolved server-side after the visit
+        env="PROFILE_VOLATILE_FIELDS"
+    )
+    # Dictionary encoding of repeated profile values (user agents, font lists, feature maps; see app/core/dictionary.py)
+    profile_dictionary_enabled: bool = Field(True, env="PROFILE_DICTIONARY_ENABLED")
+    profile_dictionary_cache_size: int = Field(20000, env="PROFILE_DICTIONARY_CACHE_SIZE")  # dictionary values cached per process
+
+    # Per-visit events (visit_events time-series collection)
+    visit_events_enabled: bool = Field(True, env="VISIT_EVENTS_ENABLED")
+    visit_events_granularity: str = Field("minutes", env="VISIT_EVENTS_GRANULARITY")  # seconds, minutes or hours (bucket span)
+    visit_events_ttl: Optional[int] = Field(None, env="VISIT_EVENTS_TTL")  # seconds; unset = ANONYMIZE_AFTER_DAYS (events hold raw IPs), 0 = forever
+    visit_events_flush_interval: float = Field(2.0, env="VISIT_EVENTS_FLUSH_INTERVAL")  # seconds between batched inserts
+    visit_events_max_pending: int = Field(5000, env="VISIT_EVENTS_MAX_PENDING")  # buffered events that force an early flush
+    visit_events_geo_precision: int = Field(5, env="VISIT_EVENTS_GEO_PRECISION")  # geohash length of the cell, 5 = ~5km
+    visit_events_max_results: int = Field(1000, env="VISIT_EVENTS_MAX_RESULTS")  # events or histogram rows per query
+
+    # Single-flight (collapse concurrent identical lookups)
+    singleflight_distributed: bool = Field(True, env="SINGLEFLIGHT_DISTRIBUTED")  # coordinate across workers via Redis
+    singleflight_lock_ttl_ms: int = Field(10000, env="SINGLEFLIGHT_LOCK_TTL_MS")
+    singleflight_wait_timeout: float = Field(8.0, env="SINGLEFLIGHT_WAIT_TIMEOUT")  # seconds before running it ourselves
+    singleflight_poll_interval: float = Field(0.05, env="SINGLEFLIGHT_POLL_INTERVAL")
+
+    # Outbound HTTP (shared connection pool)
+    http_max_connections: int = Field(100, env="HTTP_MAX_CONNECTIONS")
+    http_max_keepalive_connections: int = Field(20, env="HTTP_MAX_KEEPALIVE_CONNECTIONS")
+    http_keepalive_expiry: float = Field(30.0, env="HTTP_KEEPALIVE_EXPIRY")  # seconds
+    http_timeout: float = Field(5.0, env="HTTP_TIMEOUT")  # default seconds per request
+    http_connect_timeout: float = Field(3.0, env="HTTP_CONNECT_TIMEOUT")
+    http2_enabled: bool = Field(True, env="HTTP2_ENABLED")  # used when the h2 package is installed
+    http_host_timeouts: Dict[str, float] = Field(
+        {
+            "nominatim.openstreetmap.org": 5.0,
+            "api.bigdatacloud.net": 5.0,
+            "ip-api.com": 5.0,
+            "api.ipify.org": 3.0,
+            "ipinfo.io": 3.0,
+            "httpbin.org": 3.0
+        },
+        env="HTTP_HOST_TIMEOUTS"
+    )
+
+    # Offline IP Geolocation
+    ip_geo_db_path: Optional[str] = Field(None, env="IP_GEO_DB_PATH")  # built with `python -m app.core.ip_geo build`
+    ip_geo_reload_interval: int = Field(60, env="IP_GEO_RELOAD_INTERVAL")  # seconds between file change checks
+    ip_geo_remote_fallback: bool = Field(True, env="IP_GEO_REMOTE_FALLBACK")  # ip-api.com on a local miss
+
+    # Offline Reverse Geocoding (city-level answers from a local gazetteer)
+    gazetteer_path: Optional[str] = Field(None, env="GAZETTEER_PATH")  # CSV: city,latitude,longitude,state,country,...
+    gazetteer_max_distance_km: float = Field(50.0, env="GAZETTEER_MAX_DISTANCE_KM")  # farther = fall back to remote
+    geocode_street_level: bool = Field(True, env="GEOCODE_STREET_LEVEL")  # False: skip remote providers when possible
+
+    # Reverse Geocoding Providers
+    geocode_deadline: float = Field(6.0, env="GEOCODE_DEADLINE")  # overall seconds for the provider fan-out
+    geocode_early_exit: bool = Field(False, env="GEOCODE_EARLY_EXIT")
+    geocode_negative_ttl: int = Field(60, env="GEOCODE_NEGATIVE_TTL")  # seconds to cache results with failed providers
+    geocode_required_fields: List[str] = Field(
+        ["country", "country_code", "city"],
+        env="GEOCODE_REQUIRED_FIELDS"
+    )
+
     class Config:
         env_file = ".env"
         env_file_encoding = "utf-8"
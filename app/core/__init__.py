@@ -4,7 +4,9 @@ from .utils import (
     create_response,
     create_error_response,
     handle_database_errors,
-    validate_object_id
+    validate_object_id,
+    encode_cursor,
+    decode_cursor
 )
 from .services import BaseService
 
@@ -14,5 +16,7 @@ __all__ = [
     "create_error_response",
     "handle_database_errors",
     "validate_object_id",
+    "encode_cursor",
+    "decode_cursor",
     "BaseService"
 ]
@@ -0,0 +1,18 @@
+import secrets
+from typing import Optional
+from fastapi import HTTPException, Security, status
+from fastapi.security import APIKeyHeader
+from app.config import settings
+import logging
+
+logger = logging.getLogger(__name__)
+
+api_key_header = APIKeyHeader(name="X-API-Key", auto_error=False)
+
+async def require_api_key(api_key: Optional[str] = Security(api_key_header)):
+    """Allow a request only with the configured FINGERPRINT_API_KEY; without one configured, the routes are off."""
+    if not settings.fingerprint_api_key:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+    if not api_key or not secrets.compare_digest(api_key.encode("utf-8"), settings.fingerprint_api_key.encode("utf-8")):
+        logger.warning("Rejected a fingerprint API request without a valid API key")
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid or missing API key")
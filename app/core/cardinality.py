@@ -0,0 +1,308 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+from app.config import settings
+from app.core.ingest import IngestItem, ingest_queue
+from app.database.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+# What is counted (distinct elements) and what it can be broken down by
+METRICS = ("visitors", "devices", "ips")
+DIMENSIONS = ("all", "site", "country", "browser")
+ALL_VALUE = "*"
+
+HOUR = "hour"
+DAY = "day"
+GRANULARITIES = (HOUR, DAY)
+_BUCKET_FORMATS = {HOUR: "%Y%m%d%H", DAY: "%Y%m%d"}
+_BUCKET_STEPS = {HOUR: timedelta(hours=1), DAY: timedelta(days=1)}
+
+# Redis HyperLogLogs use 16384 registers: relative standard error 1.04 / sqrt(16384) ~ 0.81%,
+# whether the count comes from one bucket or a union of many
+STANDARD_ERROR = 0.0081
+MAX_SERIES_POINTS = 1000
+
+def to_utc(moment: datetime) -> datetime:
+    """Naive UTC datetime (timestamps are stored and bucketed in UTC)."""
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return moment
+
+def floor_to(moment: datetime, granularity: str) -> datetime:
+    moment = moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0) if granularity == DAY else moment
+
+def _bucket(moment: datetime, granularity: str) -> str:
+    return moment.strftime(_BUCKET_FORMATS[granularity])
+
+def error_bounds(count: int) -> Dict[str, Any]:
+    """Standard error and a ~95% (two sigma) interval for an HLL estimate."""
+    margin = count * STANDARD_ERROR * 2
+    return {
+        "standard_error": STANDARD_ERROR,
+        "interval_95": [max(0, int(round(count - margin))), int(round(count + margin))],
+    }
+
+class CardinalityCounters:
+    """Unique visitors, devices and IPs per hour/day bucket and dimension, as HyperLogLogs in Redis."""
+
+    def __init__(self, prefix: str = "hll"):
+        self.prefix = prefix
+        self._pending: Dict[Tuple[str, int], Set[str]] = {}
+        self._pending_values: Dict[str, Set[str]] = {}
+        self._pending_elements = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "observed": 0,
+            "flushes": 0,
+            "flushed_keys": 0,
+            "flushed_elements": 0,
+            "dropped_elements": 0,
+            "queries": 0,
+            "total_query_ms": 0.0,
+        }
+
+    def _key(self, metric: str, dimension: str, value: str, granularity: str, bucket: str) -> str:
+        # The hash tag keeps every bucket of one series in one cluster slot, so PFCOUNT can merge them
+        return f"{self.prefix}:{{{metric}:{dimension}:{value}}}:{granularity[0]}:{bucket}"
+
+    def _values_key(self, dimension: str) -> str:
+        return f"{self.prefix}:values:{dimension}"
+
+    def observe(
+        self,
+        visitor: Optional[str],
+        device: Optional[str] = None,
+        ip: Optional[str] = None,
+        site: Optional[str] = None,
+        country: Optional[str] = None,
+        browser: Optional[str] = None,
+        at: Optional[datetime] = None
+    ):
+        """Buffer one visit; it reaches Redis with the next periodic flush."""
+        if not settings.cardinality_enabled:
+            return
+        at = to_utc(at or datetime.utcnow())
+        elements = [(metric, element) for metric, element in zip(METRICS, (visitor, device, ip)) if element]
+        dimensions = [("all", ALL_VALUE)] + [
+            (dimension, str(value)[:255]) for dimension, value in (("site", site), ("country", country), ("browser", browser)) if value
+        ]
+        for granularity, ttl in ((HOUR, settings.cardinality_hour_ttl), (DAY, settings.cardinality_day_ttl)):
+            bucket = _bucket(at, granularity)
+            for dimension, value in dimensions:
+                for metric, element in elements:
+                    self._pending.setdefault((self._key(metric, dimension, value, granularity, bucket), ttl), set()).add(element)
+        for dimension, value in dimensions[1:]:
+            self._pending_values.setdefault(dimension, set()).add(value)
+        self._stats["observed"] += 1
+        self._pending_elements += len(elements) * len(dimensions) * len(GRANULARITIES)
+        if self._wake is not None and self._pending_elements >= settings.cardinality_max_pending:
+            self._wake.set()
+
+    async def on_flush(self, items: List[IngestItem]):
+        """Ingest flush hook: observe the visits whose writes were applied."""
+        for item in items:
+            for visit in item.visits:
+                self.observe(
+                    visit.get("visitor_id") or visit.get("fingerprint_hash") or visit.get("ip"),
+                    device=visit.get("fingerprint_hash"),
+                    ip=visit.get("ip"),
+                    site=visit.get("site"),
+                    country=visit.get("country"),
+                    browser=visit.get("browser"),
+                    at=visit.get("at")
+                )
+
+    async def start(self):
+        """Count visits as the ingest queue flushes them, and start the periodic PFADD flusher."""
+        if self._task is not None or not settings.cardinality_enabled:
+            return
+        ingest_queue.add_flush_hook(self.on_flush)
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and push whatever is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=settings.cardinality_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Cardinality flush failed: {e}")
+
+    async def flush(self):
+        """Send buffered elements with one pipelined PFADD per key."""
+        pending, values, elements = self._pending, self._pending_values, self._pending_elements
+        self._pending, self._pending_values, self._pending_elements = {}, {}, 0
+        if not pending:
+            return
+        if not redis_client.connected:
+            # Best-effort counters: without Redis there is nowhere to keep them
+            self._stats["dropped_elements"] += elements
+            return
+        if not await redis_client.pfadd_many([(key, list(members), ttl) for (key, ttl), members in pending.items()]):
+            self._stats["dropped_elements"] += elements
+            return
+        for dimension, members in values.items():
+            await redis_client.sadd(self._values_key(dimension), members, ttl=settings.cardinality_day_ttl)
+        self._stats["flushes"] += 1
+        self._stats["flushed_keys"] += len(pending)
+        self._stats["flushed_elements"] += sum(len(members) for members in pending.values())
+
+    @staticmethod
+    def _validate(metric: str, dimension: str, value: Optional[str]) -> str:
+        if metric not in METRICS:
+            raise ValueError(f"Unknown metric '{metric}' (expected one of {', '.join(METRICS)})")
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension '{dimension}' (expected one of {', '.join(DIMENSIONS)})")
+        if dimension == "all":
+            return ALL_VALUE
+        if not value:
+            raise ValueError(f"A value is required for dimension '{dimension}'")
+        return value
+
+    @staticmethod
+    def _snap(start: datetime, end: datetime) -> Tuple[datetime, datetime]:
+        """Widen [start, end) to whole hours, the finest bucket kept."""
+        start, end = to_utc(start), to_utc(end)
+        if end <= start:
+            raise ValueError("end must be after start")
+        snapped_end = floor_to(end, HOUR)
+        if snapped_end < end:
+            snapped_end += _BUCKET_STEPS[HOUR]
+        return floor_to(start, HOUR), snapped_end
+
+    def range_buckets(self, start: datetime, end: datetime) -> Tuple[List[Tuple[str, str]], bool]:
+        """(granularity, bucket) pairs covering [start, end): whole days as day buckets, partial days as hours.
+
+        Partial days older than the hourly retention fall back to their day bucket; the second
+        value says whether that happened (the count then covers a slightly wider range).
+        """
+        hour_horizon = floor_to(datetime.utcnow(), HOUR) - timedelta(seconds=settings.cardinality_hour_ttl)
+        buckets: List[Tuple[str, str]] = []
+        widened = False
+        day = floor_to(start, DAY)
+        while day < end:
+            next_day = day + _BUCKET_STEPS[DAY]
+            low, high = max(start, day), min(end, next_day)
+            whole_day = low == day and high == next_day
+            if whole_day or low < hour_horizon:
+                buckets.append((DAY, _bucket(day, DAY)))
+                widened = widened or not whole_day
+            else:
+                hour = low
+                while hour < high:
+                    buckets.append((HOUR, _bucket(hour, HOUR)))
+                    hour += _BUCKET_STEPS[HOUR]
+            day = next_day
+        return buckets, widened
+
+    async def _count_groups(self, key_groups: List[List[str]]) -> List[Optional[int]]:
+        start = time.perf_counter()
+        counts = await redis_client.pfcount_many(key_groups)
+        self._stats["queries"] += 1
+        self._stats["total_query_ms"] += (time.perf_counter() - start) * 1000
+        return counts
+
+    async def count(self, metric: str, dimension: str, value: Optional[str], start: datetime, end: datetime) -> Dict[str, Any]:
+        """Distinct count over an arbitrary range, merging the covering buckets in a single PFCOUNT."""
+        value = self._validate(metric, dimension, value)
+        start, end = self._snap(start, end)
+        buckets, widened = self.range_buckets(start, end)
+        keys = [self._key(metric, dimension, value, granularity, bucket) for granularity, bucket in buckets]
+        count = (await self._count_groups([keys]))[0]
+        return {
+            "metric": metric,
+            "dimension": dimension,
+            "value": value,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "count": count,
+            "buckets": len(keys),
+            "widened": widened,
+            **(error_bounds(count) if count is not None else {}),
+        }
+
+    async def series(
+        self,
+        metric: str,
+        dimension: str,
+        value: Optional[str],
+        start: datetime,
+        end: datetime,
+        granularity: str = DAY
+    ) -> List[Dict[str, Any]]:
+        """Distinct count per hour or day bucket across a range."""
+        value = self._validate(metric, dimension, value)
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity '{granularity}' (expected hour or day)")
+        start, end = self._snap(start, end)
+        moments = []
+        moment = floor_to(start, granularity)
+        while moment < end:
+            moments.append(moment)
+            moment += _BUCKET_STEPS[granularity]
+            if len(moments) > MAX_SERIES_POINTS:
+                raise ValueError(f"Range spans more than {MAX_SERIES_POINTS} {granularity} buckets")
+        counts = await self._count_groups([[self._key(metric, dimension, value, granularity, _bucket(moment, granularity))] for moment in moments])
+        return [{"bucket": moment.isoformat(), "count": count} for moment, count in zip(moments, counts)]
+
+    async def breakdown(
+        self,
+        metric: str,
+        dimension: str,
+        start: datetime,
+        end: datetime,
+        limit: int = 20
+    ) -> Dict[str, Any]:
+        """Distinct count per dimension value over a range, largest first, next to the overall total."""
+        if dimension == "all":
+            raise ValueError("Pick a dimension to break down by (site, country or browser)")
+        self._validate(metric, dimension, "-")
+        start, end = self._snap(start, end)
+        buckets, widened = self.range_buckets(start, end)
+        values = sorted((await redis_client.smembers_many([self._values_key(dimension)], limit=settings.cardinality_max_dimension_values))[0])
+        # The total comes from the "all" series, not a sum: one visitor can appear under several values
+        groups = [[self._key(metric, "all", ALL_VALUE, granularity, bucket) for granularity, bucket in buckets]]
+        groups.extend([self._key(metric, dimension, value, granularity, bucket) for granularity, bucket in buckets] for value in values)
+        counts = await self._count_groups(groups)
+        ranked = sorted(((count or 0, value) for value, count in zip(values, counts[1:]) if count), reverse=True)
+        return {
+            "metric": metric,
+            "dimension": dimension,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "total": counts[0],
+            "values": [{"value": value, "count": count} for count, value in ranked[:limit]],
+            "widened": widened,
+            "standard_error": STANDARD_ERROR,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        queries = self._stats["queries"]
+        return {
+            **self._stats,
+            "total_query_ms": round(self._stats["total_query_ms"], 2),
+            "avg_query_ms": round(self._stats["total_query_ms"] / queries, 2) if queries else 0.0,
+            "pending_keys": len(self._pending),
+            "pending_elements": self._pending_elements,
+            "standard_error": STANDARD_ERROR,
+        }
+
+# Global unique-visitor counters instance
+unique_counters = CardinalityCounters()
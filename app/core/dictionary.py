@@ -0,0 +1,362 @@
+"""
+Dictionary encoding of profile values that repeat across visitors.
+
+Full user-agent strings, font lists and feature maps take a few thousand distinct
+values across millions of profiles. Each distinct value is stored once in the
+profile_dictionary collection under an integer id derived from its content (so any
+worker computes the same id without a round trip), and cached in process. Cold
+profiles keep only the ids, under "_refs", and are rehydrated when read; visitor_logs
+documents carry the ids as ua_id, fonts_id and features_id, which are indexed for
+equality lookups and grouping. Each entry also counts the visitor documents carrying
+its id, kept up to date as visits are flushed and visitors anonymized or deleted, so
+the most common values are an indexed sort, and when a visit last referenced it, so
+the retention job can delete entries nothing refers to anymore. Set the counts from
+visitor_logs (after upgrading, or after RETENTION_TTL_INDEX expired visitors) with:
+
+    python -m app.core.dictionary recount
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+from collections import Counter, OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pymongo import UpdateMany, UpdateOne
+from app.config import settings
+from app.core.ingest import IngestItem, ingest_queue
+from app.database.connection import get_collection
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "profile_dictionary"
+REFS = "_refs"
+# Dictionary kind -> profile path it replaces; visitor_logs gets "<kind>_id"
+FIELDS = {
+    "ua": "navigator.ua",
+    "fonts": "fonts.found",
+    "features": "features",
+}
+ID_FIELDS = tuple(f"{kind}_id" for kind in FIELDS)
+# Ids stay below 2**53 so JavaScript clients read them exactly
+ID_MASK = (1 << 53) - 1
+# How often a flushed visit refreshes an entry's referenced_at
+REFERENCE_REFRESH = timedelta(days=1)
+# Entries outlive their last reference by the retention window plus this, so a backed-up
+# retention job deletes the visitors (and cold profiles) using them first
+PRUNE_MARGIN = timedelta(days=7)
+
+def value_id(value: Any) -> int:
+    payload = json.dumps(value, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+    return int.from_bytes(hashlib.blake2b(payload, digest_size=8).digest(), "big") & ID_MASK
+
+def _entry_id(kind: str, id_: int) -> str:
+    return f"{kind}:{id_}"
+
+def _get_path(document: Dict[str, Any], path: str) -> Any:
+    node: Any = document
+    for part in path.split("."):
+        if not isinstance(node, dict):
+            return None
+        node = node.get(part)
+    return node
+
+def _set_path(document: Dict[str, Any], path: str, value: Any):
+    *parents, leaf = path.split(".")
+    node = document
+    for part in parents:
+        if not isinstance(node.get(part), dict):
+            node[part] = {}
+        node = node[part]
+    node[leaf] = value
+
+class ValueDictionary:
+    """Content-addressed dictionary of repeated profile values, with an in-process LRU cache."""
+
+    def __init__(self, collection_name: str = COLLECTION):
+        self.collection_name = collection_name
+        self._cache: "OrderedDict[str, Any]" = OrderedDict()
+        # New entries not yet known to be in MongoDB, or ones whose referenced_at is due
+        self._pending: Dict[str, Tuple[str, Any]] = {}
+        # When this process last wrote each cached entry's referenced_at
+        self._referenced: Dict[str, datetime] = {}
+        self._stats = {
+            "interned": 0,
+            "cache_hits": 0,
+            "cache_misses": 0,
+            "inserted": 0,
+            "lookups": 0,
+            "unresolved": 0,
+            "pruned": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return settings.profile_dictionary_enabled
+
+    def _remember(self, entry_id: str, value: Any):
+        self._cache[entry_id] = value
+        self._cache.move_to_end(entry_id)
+        while len(self._cache) > settings.profile_dictionary_cache_size:
+            evicted, _ = self._cache.popitem(last=False)
+            self._referenced.pop(evicted, None)
+
+    def ids(self, profile: Dict[str, Any]) -> Dict[str, int]:
+        """The dictionary ids of a profile's values, as visitor_logs fields (ua_id, fonts_id, features_id)."""
+        if not self.enabled:
+            return {}
+        ids = {}
+        for kind, path in FIELDS.items():
+            value = _get_path(profile, path)
+            if value is not None:
+                ids[f"{kind}_id"] = value_id(value)
+        return ids
+
+    def register(self, profile: Dict[str, Any], inline: Iterable[str] = ()) -> Dict[str, int]:
+        """Ids of a profile's values by kind, queueing the ones not seen yet (or due a reference refresh) for persist()."""
+        refs = {}
+        for kind, path in FIELDS.items():
+            value = _get_path(profile, path)
+            if value is None or kind in inline:
+                continue
+            id_ = value_id(value)
+            entry_id = _entry_id(kind, id_)
+            if entry_id in self._cache:
+                self._cache.move_to_end(entry_id)
+                self._stats["cache_hits"] += 1
+                if self._referenced.get(entry_id, datetime.min) < datetime.utcnow() - REFERENCE_REFRESH:
+                    self._pending[entry_id] = (kind, value)
+            else:
+                self._stats["cache_misses"] += 1
+                self._pending[entry_id] = (kind, value)
+                self._remember(entry_id, value)
+            refs[kind] = id_
+        return refs
+
+    def intern(self, profile: Dict[str, Any], inline: Iterable[str] = ()) -> Dict[str, Any]:
+        """A copy of the profile with dictionary values, except those of the inline kinds, replaced by their ids (call persist() before storing it)."""
+        if not self.enabled:
+            return profile
+        refs = self.register(profile, inline)
+        if not refs:
+            return profile
+        interned = dict(profile)
+        for kind in refs:
+            *parents, leaf = FIELDS[kind].split(".")
+            node = interned
+            # Copy only along the path, so the caller's profile is left as it was
+            for part in parents:
+                node[part] = dict(node[part])
+                node = node[part]
+            node.pop(leaf, None)
+        interned[REFS] = refs
+        self._stats["interned"] += 1
+        return interned
+
+    async def persist(self, visitors: Optional[Dict[str, int]] = None):
+        """Upsert the queued entries (they must be stored before anything referencing them) and move visitor counts by entry id."""
+        pending, self._pending = self._pending, {}
+        visitors = {entry_id: amount for entry_id, amount in (visitors or {}).items() if amount}
+        if not pending and not visitors:
+            return
+        now = datetime.utcnow()
+        operations = []
+        for entry_id, (kind, value) in pending.items():
+            update: Dict[str, Any] = {
+                "$setOnInsert": {"kind": kind, "value": value, "created_at": now},
+                "$max": {"referenced_at": now},
+            }
+            if entry_id in visitors:
+                update["$inc"] = {"visitors": visitors.pop(entry_id)}
+            operations.append(UpdateOne({"_id": entry_id}, update, upsert=True))
+        operations.extend(UpdateOne({"_id": entry_id}, {"$inc": {"visitors": amount}}) for entry_id, amount in visitors.items())
+        try:
+            await get_collection(self.collection_name).bulk_write(operations, ordered=False)
+        except Exception:
+            # Queue them again so the next write retries
+            self._pending.update(pending)
+            raise
+        for entry_id in pending:
+            self._referenced[entry_id] = now
+        self._stats["inserted"] += len(pending)
+
+    async def values(self, entry_ids: Iterable[str]) -> Dict[str, Any]:
+        """Values by entry id ("kind:id"), from the cache or one query for the rest."""
+        found: Dict[str, Any] = {}
+        missing = []
+        for entry_id in set(entry_ids):
+            if entry_id in self._cache:
+                found[entry_id] = self._cache[entry_id]
+            else:
+                missing.append(entry_id)
+        if missing:
+            self._stats["lookups"] += 1
+            async for document in get_collection(self.collection_name).find({"_id": {"$in": missing}}):
+                found[document["_id"]] = document["value"]
+                self._remember(document["_id"], document["value"])
+        return found
+
+    async def lookup(self, kind: str, id_: int) -> Optional[Any]:
+        if kind not in FIELDS:
+            raise ValueError(f"Unknown dictionary kind '{kind}' (expected one of {', '.join(FIELDS)})")
+        entry_id = _entry_id(kind, id_)
+        return (await self.values([entry_id])).get(entry_id)
+
+    async def rehydrate(self, profiles: List[Dict[str, Any]]):
+        """Put dictionary values back into interned profiles, in place, with at most one query."""
+        interned = [profile for profile in profiles if isinstance(profile.get(REFS), dict)]
+        if not interned:
+            return
+        values = await self.values(_entry_id(kind, id_) for profile in interned for kind, id_ in profile[REFS].items())
+        for profile in interned:
+            for kind, id_ in profile.pop(REFS).items():
+                entry_id = _entry_id(kind, id_)
+                if entry_id not in values or kind not in FIELDS:
+                    self._stats["unresolved"] += 1
+                    logger.warning(f"Profile references missing dictionary entry {entry_id}")
+                    continue
+                _set_path(profile, FIELDS[kind], values[entry_id])
+
+    async def start(self):
+        """Keep the dictionary complete, and its visitor counts current, for the ids written to visitor_logs."""
+        if self.enabled:
+            # Registered after the profile store's, so only changed profiles are looked up
+            ingest_queue.add_prepare_hook(self.prepare)
+            ingest_queue.add_flush_hook(self.on_flush)
+
+    async def prepare(self, items: List[IngestItem]):
+        """Ingest prepare hook: read the ids that changed profiles replace, with one query."""
+        returning: Dict[str, IngestItem] = {}
+        for item in items:
+            if item.profile is None or not item.profile_changed or not item.upsert:
+                continue
+            if item.filter.get("visitor_id"):
+                returning[item.filter["visitor_id"]] = item
+            else:
+                # Anonymous visits always get a new document
+                item.previous = {}
+        if not returning:
+            return
+        projection = {"visitor_id": 1, **{name: 1 for name in ID_FIELDS}}
+        stored = {
+            document["visitor_id"]: document
+            async for document in get_collection("visitor_logs").find({"visitor_id": {"$in": list(returning)}}, projection)
+        }
+        for visitor_id, item in returning.items():
+            document = stored.get(visitor_id, {})
+            item.previous = {name: document[name] for name in ID_FIELDS if name in document}
+
+    async def on_flush(self, items: List[IngestItem]):
+        """Ingest flush hook: store the values behind ids not known to be stored yet, and move visitor counts."""
+        visitors: Counter = Counter()
+        due = datetime.utcnow() - REFERENCE_REFRESH
+        for item in items:
+            if item.profile is None:
+                continue
+            # Unchanged profiles too: visitors stored before the dictionary existed only now get ids
+            entry_ids = {kind: _entry_id(kind, item.set_fields[f"{kind}_id"]) for kind in FIELDS if f"{kind}_id" in item.set_fields}
+            if not all(entry_id in self._cache for entry_id in entry_ids.values()):
+                self.register(item.profile)
+            for kind, entry_id in entry_ids.items():
+                # Upserted again, so an entry pruned since it was cached comes back
+                if entry_id in self._cache and self._referenced.get(entry_id, datetime.min) < due:
+                    self._pending[entry_id] = (kind, self._cache[entry_id])
+            # Unchanged profiles keep their ids
+            if item.previous is None:
+                continue
+            for kind in FIELDS:
+                old, new = item.previous.get(f"{kind}_id"), item.set_fields.get(f"{kind}_id")
+                # A missing id is not unset, so the stored one stays
+                if new is None or new == old:
+                    continue
+                visitors[_entry_id(kind, new)] += 1
+                if old is not None:
+                    visitors[_entry_id(kind, old)] -= 1
+        await self.persist(visitors)
+
+    async def release(self, documents: Iterable[Dict[str, Any]], kinds: Iterable[str] = tuple(FIELDS)):
+        """Take visitor documents that were deleted (or lost some ids) off the counts of their entries."""
+        if not self.enabled:
+            return
+        kinds = list(kinds)
+        visitors = Counter(
+            _entry_id(kind, document[f"{kind}_id"])
+            for document in documents for kind in kinds if document.get(f"{kind}_id") is not None
+        )
+        await self.persist({entry_id: -amount for entry_id, amount in visitors.items()})
+
+    async def prune(self, cutoff: datetime) -> int:
+        """Delete entries no visitor carries and no visit referenced since the cutoff; returns how many."""
+        if not self.enabled:
+            return 0
+        result = await get_collection(self.collection_name).delete_many({
+            "visitors": {"$not": {"$gt": 0}},
+            # Entries from before referenced_at was kept go by their creation
+            "$or": [
+                {"referenced_at": {"$lt": cutoff}},
+                {"referenced_at": {"$exists": False}, "created_at": {"$lt": cutoff}},
+            ],
+        })
+        self._stats["pruned"] += result.deleted_count
+        return result.deleted_count
+
+    async def top(self, kind: str, limit: int = 20) -> List[Dict[str, Any]]:
+        """Most common values of a kind across visitors, from the entries' visitor counts."""
+        if kind not in FIELDS:
+            raise ValueError(f"Unknown dictionary kind '{kind}' (expected one of {', '.join(FIELDS)})")
+        documents = await get_collection(self.collection_name).find(
+            {"kind": kind, "visitors": {"$gt": 0}}, {"value": 1, "visitors": 1}
+        ).sort("visitors", -1).limit(limit).to_list(length=limit)
+        return [
+            {"id": int(document["_id"].split(":", 1)[1]), "visitors": document["visitors"], "value": document.get("value")}
+            for document in documents
+        ]
+
+    async def recount(self) -> Dict[str, int]:
+        """Set every entry's visitor count from visitor_logs, one $group per kind; returns the distinct ids per kind."""
+        collection = get_collection(self.collection_name)
+        counted = {}
+        for kind in FIELDS:
+            field = f"{kind}_id"
+            rows = await get_collection("visitor_logs").aggregate([
+                {"$match": {field: {"$exists": True}}},
+                {"$group": {"_id": f"${field}", "visitors": {"$sum": 1}}},
+            ]).to_list(length=None)
+            entry_ids = [_entry_id(kind, row["_id"]) for row in rows]
+            operations: List[Any] = [
+                UpdateOne({"_id": entry_id}, {"$set": {"visitors": row["visitors"]}})
+                for entry_id, row in zip(entry_ids, rows)
+            ]
+            operations.append(UpdateMany({"kind": kind, "_id": {"$nin": entry_ids}}, {"$set": {"visitors": 0}}))
+            await collection.bulk_write(operations, ordered=False)
+            counted[kind] = len(rows)
+        return counted
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "enabled": self.enabled, "cached": len(self._cache), "pending": len(self._pending)}
+
+# Global value dictionary instance
+value_dictionary = ValueDictionary()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the profile value dictionary")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("recount", help="Set each entry's visitor count from visitor_logs")
+    parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    from app.database.connection import close_mongo_connection, connect_to_mongo
+
+    async def run():
+        await connect_to_mongo()
+        try:
+            return await value_dictionary.recount()
+        finally:
+            await close_mongo_connection()
+
+    print(json.dumps(asyncio.run(run()), indent=2))
+
+if __name__ == "__main__":
+    main()
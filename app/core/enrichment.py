@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import settings
+from app.core.ingest import IngestItem, ingest_queue
+from app.core.geo_cache import geo_cache
+from app.core.location_utils import get_location_from_coordinates
+
+logger = logging.getLogger(__name__)
+
+class GeocodeEnrichmentPool:
+    """Background worker pool that resolves GPS addresses after a visit has been stored."""
+
+    def __init__(self):
+        self.workers = settings.geocode_enrichment_workers
+        self.max_size = settings.geocode_enrichment_queue_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        # Geocode cache cell -> (lat, lon, document filters waiting on that address)
+        self._pending: Dict[str, Tuple[float, float, List[Dict[str, Any]]]] = {}
+        self._stats = {
+            "submitted": 0,
+            "deduplicated": 0,
+            "dropped": 0,
+            "resolved": 0,
+            "failed": 0,
+            "patches": 0,
+            "total_resolve_ms": 0.0,
+            "max_resolve_ms": 0.0,
+        }
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks)
+
+    async def start(self):
+        """Start the enrichment workers."""
+        if self._tasks:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Geocode enrichment pool started with {self.workers} workers")
+
+    async def stop(self):
+        """Cancel the workers; addresses still pending are left unresolved."""
+        if not self._tasks:
+            return
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pending:
+            logger.warning(f"Geocode enrichment stopped with {len(self._pending)} coordinates unresolved")
+        self._pending.clear()
+        logger.info("Geocode enrichment pool stopped")
+
+    def submit(self, lat: float, lon: float, target_filter: Dict[str, Any]) -> bool:
+        """Schedule an address lookup whose result is patched into the matching visitor document."""
+        if not self.running:
+            return False
+        try:
+            lat, lon = float(lat), float(lon)
+        except (TypeError, ValueError):
+            return False
+
+        self._stats["submitted"] += 1
+        # Coordinates in the same cache cell would share the cached answer anyway
+        key = geo_cache.cell(lat, lon)
+        if key in self._pending:
+            # Same cell already queued or in flight: piggyback on that lookup
+            self._pending[key][2].append(target_filter)
+            self._stats["deduplicated"] += 1
+            return True
+        try:
+            self._queue.put_nowait(key)
+        except asyncio.QueueFull:
+            self._stats["dropped"] += 1
+            return False
+        self._pending[key] = (lat, lon, [target_filter])
+        return True
+
+    async def _worker(self):
+        while True:
+            key = await self._queue.get()
+            try:
+                await self._resolve(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["failed"] += 1
+                logger.error(f"Geocode enrichment failed for {key}: {e}")
+                self._pending.pop(key, None)
+            finally:
+                self._queue.task_done()
+
+    async def _resolve(self, key: str):
+        lat, lon, _ = self._pending[key]
+        start = time.perf_counter()
+        location_data = await get_location_from_coordinates(lat, lon)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self._stats["total_resolve_ms"] += elapsed_ms
+        self._stats["max_resolve_ms"] = round(max(self._stats["max_resolve_ms"], elapsed_ms), 2)
+
+        # Pop only after the lookup so visits arriving meanwhile join this result
+        _, _, filters = self._pending.pop(key)
+        address = location_data.get('combined') or location_data.get('display_name')
+        self._stats["resolved"] += 1
+        patch = {"location.address": address}
+        if not settings.profile_cold_storage:
+            # Inline profiles keep the address where they always had it
+            patch["profile.loc.gps.address"] = address
+        for target_filter in filters:
+            await ingest_queue.submit(IngestItem(
+                filter=target_filter,
+                set_fields=dict(patch),
+                upsert=False
+            ))
+            self._stats["patches"] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Backlog and resolve latency statistics."""
+        resolved = self._stats["resolved"]
+        return {
+            **self._stats,
+            "total_resolve_ms": round(self._stats["total_resolve_ms"], 2),
+            "avg_resolve_ms": round(self._stats["total_resolve_ms"] / resolved, 2) if resolved else 0.0,
+            "backlog": len(self._pending),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "workers": self.workers,
+            "running": self.running,
+        }
+
+# Global enrichment pool instance
+geocode_enrichment = GeocodeEnrichmentPool()
@@ -0,0 +1,90 @@
+import hashlib
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+def _pick(value: Any, fields: List[str]) -> Any:
+    """Subset of a collected section; error markers (e.g. {"error": "no_webgl"}) are kept as-is."""
+    if not isinstance(value, dict):
+        return value
+    if "error" in value:
+        return {"error": value["error"]}
+    return {field: value[field] for field in fields if value.get(field) is not None}
+
+def _fonts(profile: Dict[str, Any]) -> Any:
+    fonts = profile.get("fonts")
+    found = fonts.get("found") if isinstance(fonts, dict) else fonts
+    if not isinstance(found, list):
+        return None
+    return sorted({str(font).strip() for font in found})
+
+def _display(profile: Dict[str, Any]) -> Any:
+    display = _pick(profile.get("display"), ["w", "h", "cdepth", "pdepth", "dpr"])
+    if isinstance(display, dict) and isinstance(display.get("w"), (int, float)) and isinstance(display.get("h"), (int, float)):
+        # Screen width/height swap with orientation on mobile devices
+        display["w"], display["h"] = max(display["w"], display["h"]), min(display["w"], display["h"])
+    return display
+
+def _timezone(profile: Dict[str, Any]) -> Any:
+    tz = profile.get("tz")
+    # The zone name, not the offset, which changes with DST
+    return tz.get("tz") if isinstance(tz, dict) else tz
+
+# Stable fingerprint components: name -> extractor over the collected profile.
+# Window sizes, audio context state, battery and network details are left out on purpose.
+COMPONENT_EXTRACTORS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "canvas": lambda profile: _pick(profile.get("canvas"), ["hash", "dataURLLength"]),
+    "webgl": lambda profile: _pick(profile.get("webgl"), ["vendor", "renderer", "version", "maxTex", "unmaskedVendor", "unmaskedRenderer"]),
+    "webgl_fingerprint": lambda profile: _pick(profile.get("webgl_fingerprint"), ["hash"]),
+    "audio": lambda profile: _pick(profile.get("audio"), ["rate", "maxCh"]),
+    "fonts": _fonts,
+    "hardware": lambda profile: _pick(profile.get("hardware"), ["cores", "mem", "touch", "touchable"]),
+    "display": _display,
+    "timezone": _timezone,
+}
+
+def _normalize(value: Any) -> Any:
+    """Make equal values serialize identically (1.0 vs 1, stray whitespace)."""
+    if isinstance(value, dict):
+        return {str(key): _normalize(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_normalize(item) for item in value]
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str):
+        return value.strip()
+    return value
+
+def canonical_components(profile: Dict[str, Any], components: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Extract the configured stable components from a collected profile."""
+    components = components or settings.fingerprint_components
+    canonical = {}
+    for name in components:
+        extractor = COMPONENT_EXTRACTORS.get(name)
+        if extractor is None:
+            logger.warning(f"Ignoring unknown fingerprint component: {name}")
+            continue
+        value = extractor(profile)
+        if value is not None and value != {}:
+            canonical[name] = _normalize(value)
+    return canonical
+
+def canonical_bytes(components: Dict[str, Any]) -> bytes:
+    """Deterministic serialization: sorted keys, no whitespace."""
+    return json.dumps(components, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def compute_fingerprint_hash(
+    profile: Dict[str, Any],
+    components: Optional[List[str]] = None,
+    version: Optional[int] = None
+) -> Optional[str]:
+    """Versioned digest of a profile's stable components ("v1:<hex>"), or None if it has none."""
+    canonical = canonical_components(profile, components)
+    if not canonical:
+        return None
+    version = version if version is not None else settings.fingerprint_hash_version
+    digest = hashlib.blake2b(canonical_bytes(canonical), digest_size=16).hexdigest()
+    return f"v{version}:{digest}"
@@ -0,0 +1,306 @@
+import hashlib
+import json
+import logging
+import math
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+from app.config import settings
+from app.core.fingerprint import canonical_components, compute_fingerprint_hash
+from app.core.ingest import IngestItem, ingest_queue
+from app.core.user_agent import parse_user_agent
+from app.database.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+EXACT = "exact"
+SKETCH = "sketch"
+# Exact counters are hash fields named by the (client-supplied) value: longer values, and new
+# values once an attribute has frequency_exact_max_values of them, are counted in the sketch
+EXACT_MAX_VALUE_LENGTH = 64
+# Slots per hash in the fixed-size dedupe table
+DEDUPE_CHUNK = 1024
+
+def _section(profile: Dict[str, Any], name: str) -> Dict[str, Any]:
+    value = profile.get(name)
+    return value if isinstance(value, dict) and "error" not in value else {}
+
+def _digest(value: Any) -> Optional[str]:
+    """Short stable digest of a list/dict attribute (font sets, voice lists, feature maps)."""
+    if not value:
+        return None
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":"), default=str).encode("utf-8")
+    return hashlib.blake2b(encoded, digest_size=8).hexdigest()
+
+def _screen(profile: Dict[str, Any]) -> Optional[str]:
+    display = _section(profile, "display")
+    if not isinstance(display.get("w"), (int, float)) or not isinstance(display.get("h"), (int, float)):
+        return None
+    return f"{max(display['w'], display['h'])}x{min(display['w'], display['h'])}"
+
+def _user_agent(profile: Dict[str, Any]):
+    return parse_user_agent((profile.get("navigator") or {}).get("ua") or "")
+
+def _browser_version(profile: Dict[str, Any]) -> Optional[str]:
+    info = _user_agent(profile)
+    if not info.browser_version:
+        return None
+    return f"{info.browser} {info.browser_version.split('.')[0]}"
+
+def _voices(profile: Dict[str, Any]) -> Optional[str]:
+    voices = profile.get("speechVoices")
+    if not isinstance(voices, list):
+        return None
+    return _digest(sorted(voice.get("name") if isinstance(voice, dict) else str(voice) for voice in voices))
+
+def _features(profile: Dict[str, Any]) -> Optional[str]:
+    features = profile.get("features")
+    if not isinstance(features, dict):
+        return None
+    return _digest({name: value for name, value in features.items() if not isinstance(value, (dict, list))})
+
+# Tracked attributes: name -> (storage, extractor). Exact counters are only used for attributes
+# whose domain is small by nature, and are capped per attribute since the values come from the
+# client; anything open-ended goes into a fixed-size count-min sketch, so memory stays bounded
+# however many visitors we see.
+ATTRIBUTES: Dict[str, Tuple[str, Callable[[Dict[str, Any]], Any]]] = {
+    "browser": (EXACT, lambda profile: _user_agent(profile).browser),
+    "os": (EXACT, lambda profile: _user_agent(profile).os),
+    "device_type": (EXACT, lambda profile: _user_agent(profile).device_type),
+    "timezone": (EXACT, lambda profile: _section(profile, "tz").get("tz")),
+    "language": (EXACT, lambda profile: (profile.get("navigator") or {}).get("lang")),
+    "platform": (EXACT, lambda profile: (profile.get("navigator") or {}).get("plat")),
+    "screen": (EXACT, _screen),
+    "pixel_ratio": (EXACT, lambda profile: _section(profile, "display").get("dpr")),
+    "color_depth": (EXACT, lambda profile: _section(profile, "display").get("cdepth")),
+    "cpu_cores": (EXACT, lambda profile: _section(profile, "hardware").get("cores")),
+    "memory": (EXACT, lambda profile: _section(profile, "hardware").get("mem")),
+    "touch_points": (EXACT, lambda profile: _section(profile, "hardware").get("touch")),
+    "audio_rate": (EXACT, lambda profile: _section(profile, "audio").get("rate")),
+    "webgl_vendor": (EXACT, lambda profile: _section(profile, "webgl").get("unmaskedVendor") or _section(profile, "webgl").get("vendor")),
+    "browser_version": (SKETCH, _browser_version),
+    "webgl_renderer": (SKETCH, lambda profile: _section(profile, "webgl").get("unmaskedRenderer") or _section(profile, "webgl").get("renderer")),
+    "canvas": (SKETCH, lambda profile: _section(profile, "canvas").get("hash")),
+    "webgl_fingerprint": (SKETCH, lambda profile: _section(profile, "webgl_fingerprint").get("hash")),
+    "fonts": (SKETCH, lambda profile: _digest(canonical_components(profile, ["fonts"]).get("fonts"))),
+    "voices": (SKETCH, _voices),
+    "features": (SKETCH, _features),
+}
+# The full fingerprint is counted too, but as a combination it is not added to the entropy sum
+FINGERPRINT_ATTRIBUTE = "fingerprint"
+
+def extract_attributes(profile: Dict[str, Any]) -> Dict[str, str]:
+    """Tracked attribute values of a collected profile, as strings."""
+    values = {}
+    for name, (_, extractor) in ATTRIBUTES.items():
+        try:
+            value = extractor(profile)
+        except (AttributeError, TypeError, ValueError):
+            value = None
+        if value is not None and value != "":
+            values[name] = str(value)
+    fingerprint_hash = compute_fingerprint_hash(profile)
+    if fingerprint_hash:
+        values[FINGERPRINT_ATTRIBUTE] = fingerprint_hash
+    return values
+
+class AttributeFrequencyStore:
+    """Streaming attribute frequencies in Redis: exact hashes for small domains, count-min sketches otherwise."""
+
+    def __init__(self, prefix: str = "freq"):
+        self.prefix = prefix
+        self.width = settings.frequency_sketch_width
+        self.depth = settings.frequency_sketch_depth
+        if not 1 <= self.depth <= 16:
+            raise ValueError("frequency_sketch_depth must be between 1 and 16")
+        self.dedupe_slots = max(1, settings.frequency_dedupe_slots)
+        self.exact_max_values = settings.frequency_exact_max_values
+        # Exact values known to have their own hash field (at most exact_max_values per attribute)
+        self._exact_known: Dict[str, Set[str]] = {}
+        self._stats = {"observations": 0, "deduplicated": 0, "scored": 0, "exact_overflow": 0}
+
+    def _totals_key(self) -> str:
+        return f"{self.prefix}:n"
+
+    def _exact_key(self, attribute: str) -> str:
+        return f"{self.prefix}:x:{attribute}"
+
+    def _sketch_key(self, attribute: str, row: int) -> str:
+        # One hash per sketch row, so a sketch spreads over several keys (and cluster slots)
+        return f"{self.prefix}:cms:{attribute}:{row}"
+
+    def _dedupe_cell(self, identity: str) -> Tuple[str, str, str]:
+        """(key, field, tag) of an identity's slot in the dedupe table; colliding identities share a slot."""
+        digest = hashlib.blake2b(identity.encode("utf-8"), digest_size=8).digest()
+        slot = int.from_bytes(digest[:4], "little") % self.dedupe_slots
+        return f"{self.prefix}:dedupe:{slot // DEDUPE_CHUNK}", str(slot % DEDUPE_CHUNK), digest[4:].hex()
+
+    def _storage(self, attribute: str) -> str:
+        return SKETCH if attribute == FINGERPRINT_ATTRIBUTE else ATTRIBUTES[attribute][0]
+
+    def _columns(self, attribute: str, value: str) -> List[int]:
+        digest = hashlib.blake2b(f"{attribute}\x00{value}".encode("utf-8"), digest_size=4 * self.depth).digest()
+        return [int.from_bytes(digest[row * 4:row * 4 + 4], "little") % self.width for row in range(self.depth)]
+
+    def _exact_candidate(self, attribute: str, value: str) -> bool:
+        return self._storage(attribute) == EXACT and len(value) <= EXACT_MAX_VALUE_LENGTH
+
+    def _sketch_cells(self, attribute: str, value: str) -> List[Tuple[str, str]]:
+        """Redis (key, field) pairs holding the count-min counters for one attribute value."""
+        return [(self._sketch_key(attribute, row), str(column)) for row, column in enumerate(self._columns(attribute, value))]
+
+    async def _admit_exact(self, values: Set[Tuple[str, str]], dedupe_cells: List[Tuple[str, str]]) -> List[Optional[str]]:
+        """Decide which new exact values get their own field; reads the dedupe cells in the same round trip."""
+        unknown = sorted(values)
+        attributes = sorted({attribute for attribute, _ in unknown})
+        stored, lengths = await redis_client.hread_many(
+            dedupe_cells + [(self._exact_key(attribute), value) for attribute, value in unknown],
+            [self._exact_key(attribute) for attribute in attributes]
+        )
+        # Approximate across workers: each may admit up to the room it saw
+        room = {attribute: self.exact_max_values - length for attribute, length in zip(attributes, lengths)}
+        for (attribute, value), existing in zip(unknown, stored[len(dedupe_cells):]):
+            if existing is None:
+                if room[attribute] <= 0:
+                    continue
+                room[attribute] -= 1
+            self._exact_known.setdefault(attribute, set()).add(value)
+        return stored[:len(dedupe_cells)]
+
+    async def observe_many(self, observations: List[Tuple[Optional[str], Dict[str, str]]]):
+        """Count attribute vectors; an identity whose vector is unchanged since last time is not counted again."""
+        dedupe = {identity: self._dedupe_cell(identity) for identity, _ in observations if identity}
+        unknown = {
+            (attribute, value)
+            for _, attributes in observations
+            for attribute, value in attributes.items()
+            if self._exact_candidate(attribute, value) and value not in self._exact_known.get(attribute, ())
+        }
+        slots = await self._admit_exact(unknown, [(key, field) for key, field, _ in dedupe.values()])
+        seen = dict(zip(dedupe, slots))
+
+        hour = int(time.time() // 3600)
+        increments: List[Tuple[str, str, int]] = []
+        assignments: List[Tuple[str, str, str]] = []
+        for identity, attributes in observations:
+            vector = str(_digest(attributes))
+            if identity:
+                key, field, tag = dedupe[identity]
+                previous = (seen.get(identity) or "").split(":")
+                if len(previous) == 3 and previous[:2] == [tag, vector] and (hour - int(previous[2])) * 3600 < settings.frequency_dedupe_ttl:
+                    self._stats["deduplicated"] += 1
+                    continue
+                seen[identity] = f"{tag}:{vector}:{hour}"
+                assignments.append((key, field, seen[identity]))
+            for attribute, value in attributes.items():
+                increments.append((self._totals_key(), attribute, 1))
+                if value in self._exact_known.get(attribute, ()):
+                    increments.append((self._exact_key(attribute), value, 1))
+                    continue
+                if self._storage(attribute) == EXACT:
+                    self._stats["exact_overflow"] += 1
+                increments.extend((key, field, 1) for key, field in self._sketch_cells(attribute, value))
+            self._stats["observations"] += 1
+        await redis_client.hincrby_many(increments, assignments)
+
+    async def counts(self, attributes: Dict[str, str]) -> Tuple[Dict[str, int], Dict[str, int]]:
+        """(value counts, attribute totals) for an attribute vector, in one round trip."""
+        names = list(attributes)
+        groups = []
+        for name in names:
+            value = attributes[name]
+            # An exact attribute's value may have overflowed into the sketch: read both
+            exact = [(self._exact_key(name), value)] if self._exact_candidate(name, value) else []
+            groups.append((bool(exact), exact + self._sketch_cells(name, value)))
+        requests = [(self._totals_key(), name) for name in names] + [cell for _, group in groups for cell in group]
+        values = await redis_client.hget_many(requests)
+        totals = {name: int(value or 0) for name, value in zip(names, values[:len(names)])}
+        counts = {}
+        offset = len(names)
+        for name, (exact, group) in zip(names, groups):
+            cells = values[offset:offset + len(group)]
+            offset += len(group)
+            if exact and cells[0] is not None:
+                counts[name] = int(cells[0])
+            else:
+                # Count-min: every row overestimates, so the smallest is the best estimate
+                counts[name] = min(int(value or 0) for value in cells[1 if exact else 0:])
+        return counts, totals
+
+    async def score(self, profile: Dict[str, Any], similar_fingerprints: int = 0) -> Dict[str, Any]:
+        """Surprisal-based uniqueness analysis of a profile (FingerprintAnalysis fields plus per-attribute detail)."""
+        attributes = extract_attributes(profile)
+        counts, totals = await self.counts(attributes)
+        self._stats["scored"] += 1
+
+        surprisals = {}
+        for name, value in attributes.items():
+            # Add-one smoothing: an unseen value is rare, not infinitely surprising
+            probability = min(1.0, (counts[name] + 1) / (totals[name] + 1))
+            surprisals[name] = round(max(0.0, -math.log2(probability)), 3)
+        entropy = round(sum(bits for name, bits in surprisals.items() if name != FINGERPRINT_ATTRIBUTE), 3)
+
+        population = max(totals.values(), default=0)
+        if FINGERPRINT_ATTRIBUTE in attributes:
+            # Devices observed with exactly this fingerprint (includes this one once it has been logged)
+            anonymity_set = max(1, counts[FINGERPRINT_ATTRIBUTE])
+        else:
+            # Independence approximation: expected devices sharing every attribute value
+            anonymity_set = max(1.0, population * 2 ** -entropy)
+        uniqueness_score = round(100 / anonymity_set, 2)
+        if uniqueness_score >= 80:
+            risk_level = "high"
+        elif uniqueness_score >= 30:
+            risk_level = "medium"
+        else:
+            risk_level = "low"
+
+        ranked = sorted(
+            ((bits, name) for name, bits in surprisals.items() if name != FINGERPRINT_ATTRIBUTE),
+            reverse=True
+        )
+        return {
+            "uniqueness_score": uniqueness_score,
+            "entropy": entropy,
+            "similar_fingerprints": similar_fingerprints,
+            "risk_level": risk_level,
+            "characteristics": [f"{name}={attributes[name]} ({bits} bits)" for bits, name in ranked[:5]],
+            "tracking_resistance": round(100 - uniqueness_score, 2),
+            "anonymity_set": round(anonymity_set, 2),
+            "population": population,
+            "attributes": {
+                name: {"value": value, "count": counts[name], "total": totals[name], "surprisal": surprisals[name]}
+                for name, value in attributes.items()
+            },
+        }
+
+    async def start(self):
+        """Count attributes as the ingest queue flushes visits."""
+        if settings.frequency_enabled:
+            ingest_queue.add_flush_hook(self.on_flush)
+
+    async def on_flush(self, items: List[IngestItem]):
+        """Ingest flush hook: fold the flushed profiles into the frequency store."""
+        if not redis_client.connected:
+            return
+        observations = []
+        for item in items:
+            if item.profile is None:
+                continue
+            identity = item.filter.get("visitor_id") or item.set_fields.get("fingerprint_hash")
+            observations.append((identity, extract_attributes(item.profile)))
+        if observations:
+            await self.observe_many(observations)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "sketch_width": self.width,
+            "sketch_depth": self.depth,
+            "dedupe_slots": self.dedupe_slots,
+            "exact_values": {name: len(values) for name, values in self._exact_known.items()},
+            "exact_attributes": sorted(name for name, (storage, _) in ATTRIBUTES.items() if storage == EXACT),
+            "sketch_attributes": sorted(name for name, (storage, _) in ATTRIBUTES.items() if storage == SKETCH) + [FINGERPRINT_ATTRIBUTE],
+        }
+
+# Global attribute frequency store instance
+attribute_frequencies = AttributeFrequencyStore()
@@ -0,0 +1,185 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import settings
+from app.database.redis_client import get_redis_client
+
+logger = logging.getLogger(__name__)
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+_BASE32_INDEX = {char: index for index, char in enumerate(_BASE32)}
+
+def geohash_encode(lat: float, lon: float, precision: int = 7) -> str:
+    """Encode coordinates as a geohash of the given length."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        rng, value = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if value >= mid:
+            bits = (bits << 1) | 1
+            rng[0] = mid
+        else:
+            bits <<= 1
+            rng[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+def geohash_bounds(geohash: str) -> Tuple[float, float, float, float]:
+    """Decode a geohash into its (min_lat, max_lat, min_lon, max_lon) cell."""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        bits = _BASE32_INDEX[char]
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if (bits >> shift) & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+def geohash_neighbors(geohash: str) -> List[str]:
+    """The (up to) eight cells surrounding a geohash cell."""
+    min_lat, max_lat, min_lon, max_lon = geohash_bounds(geohash)
+    height = max_lat - min_lat
+    width = max_lon - min_lon
+    center_lat = (min_lat + max_lat) / 2
+    center_lon = (min_lon + max_lon) / 2
+    neighbors = []
+    for dlat in (-1, 0, 1):
+        for dlon in (-1, 0, 1):
+            if dlat == 0 and dlon == 0:
+                continue
+            lat = center_lat + dlat * height
+            if lat > 90 or lat < -90:
+                continue
+            # Wrap around the antimeridian
+            lon = (center_lon + dlon * width + 180) % 360 - 180
+            cell = geohash_encode(lat, lon, len(geohash))
+            if cell != geohash and cell not in neighbors:
+                neighbors.append(cell)
+    return neighbors
+
+class GeoCache:
+    """Reverse-geocode cache keyed by geohash (or a fixed degree grid) so nearby coordinates share entries."""
+
+    def __init__(self, prefix: str = "geo"):
+        self.prefix = prefix
+        self.mode = settings.geo_cache_mode
+        self.precision = settings.geo_cache_precision
+        self.grid_size = settings.geo_cache_grid_size
+        self.neighbor_lookup = settings.geo_cache_neighbor_lookup
+        self._stats: Dict[str, Dict[str, int]] = {}
+
+    def _level(self, precision: Optional[int]) -> str:
+        if self.mode == "grid":
+            return f"grid{self.grid_size}"
+        return f"gh{precision or self.precision}"
+
+    def cell(self, lat: float, lon: float, precision: Optional[int] = None) -> str:
+        """Cache cell for a coordinate at the configured (or given) precision."""
+        if self.mode == "grid":
+            return f"{round(lat / self.grid_size)}:{round(lon / self.grid_size)}"
+        return geohash_encode(lat, lon, precision or self.precision)
+
+    def neighbors(self, cell: str) -> List[str]:
+        if self.mode == "grid":
+            row, col = (int(part) for part in cell.split(":"))
+            return [
+                f"{row + dlat}:{col + dlon}"
+                for dlat in (-1, 0, 1) for dlon in (-1, 0, 1)
+                if dlat or dlon
+            ]
+        return geohash_neighbors(cell)
+
+    def _key(self, level: str, cell: str) -> str:
+        return f"{self.prefix}:{level}:{cell}"
+
+    def _count(self, level: str, name: str):
+        counters = self._stats.setdefault(level, {"hits": 0, "neighbor_hits": 0, "misses": 0, "writes": 0})
+        counters[name] += 1
+
+    async def get(
+        self,
+        lat: float,
+        lon: float,
+        precision: Optional[int] = None,
+        neighbor_lookup: Optional[bool] = None,
+        record_stats: bool = True
+    ) -> Optional[Dict[str, Any]]:
+        """Cached location for the cell containing the coordinates, optionally trying adjacent cells on a miss.
+
+        record_stats=False leaves the hit/miss counters alone, for repeated polls of a cell
+        whose miss was already counted (single-flight followers waiting on the leader).
+        """
+        redis_client = await get_redis_client()
+        level = self._level(precision)
+        cell = self.cell(lat, lon, precision)
+        cached = await redis_client.get(self._key(level, cell))
+        hit_cell = cell
+        if not cached and (self.neighbor_lookup if neighbor_lookup is None else neighbor_lookup):
+            neighbor_cells = self.neighbors(cell)
+            results = await asyncio.gather(*(redis_client.get(self._key(level, c)) for c in neighbor_cells))
+            for neighbor_cell, result in zip(neighbor_cells, results):
+                if result:
+                    cached = result
+                    hit_cell = neighbor_cell
+                    break
+            if cached and record_stats:
+                self._count(level, "neighbor_hits")
+
+        if not cached:
+            if record_stats:
+                self._count(level, "misses")
+            return None
+        if hit_cell == cell and record_stats:
+            self._count(level, "hits")
+
+        # The entry was resolved for whichever visitor filled the cell first
+        result = dict(cached)
+        result["coordinates"] = {"latitude": lat, "longitude": lon}
+        result["cache"] = {"level": level, "cell": hit_cell, "neighbor": hit_cell != cell}
+        return result
+
+    async def set(
+        self,
+        lat: float,
+        lon: float,
+        value: Dict[str, Any],
+        precision: Optional[int] = None,
+        ttl: Optional[int] = None
+    ) -> bool:
+        """Cache a resolved location for the cell containing the coordinates."""
+        redis_client = await get_redis_client()
+        level = self._level(precision)
+        stored = await redis_client.set(self._key(level, self.cell(lat, lon, precision)), value, ttl)
+        if stored:
+            self._count(level, "writes")
+        return stored
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters per precision level."""
+        levels = {}
+        for level, counters in self._stats.items():
+            lookups = counters["hits"] + counters["neighbor_hits"] + counters["misses"]
+            levels[level] = {
+                **counters,
+                "hit_ratio": round((counters["hits"] + counters["neighbor_hits"]) / lookups, 4) if lookups else 0.0
+            }
+        return {"mode": self.mode, "neighbor_lookup": self.neighbor_lookup, "levels": levels}
+
+# Global geocode cache instance
+geo_cache = GeoCache()
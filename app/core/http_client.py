@@ -0,0 +1,117 @@
+import httpx
+import importlib.util
+import logging
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+class HTTPClientRegistry:
+    """Application-scoped pooled HTTP client shared by all outbound calls."""
+
+    def __init__(self):
+        self.client: Optional[httpx.AsyncClient] = None
+        self.http2 = False
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._hosts: Dict[str, Dict[str, Any]] = {}
+
+    def _create_client(self) -> httpx.AsyncClient:
+        # HTTP/2 needs the optional h2 package (httpx[http2])
+        self.http2 = settings.http2_enabled and importlib.util.find_spec("h2") is not None
+        return httpx.AsyncClient(
+            http2=self.http2,
+            timeout=httpx.Timeout(settings.http_timeout, connect=settings.http_connect_timeout),
+            limits=httpx.Limits(
+                max_connections=settings.http_max_connections,
+                max_keepalive_connections=settings.http_max_keepalive_connections,
+                keepalive_expiry=settings.http_keepalive_expiry
+            )
+        )
+
+    async def start(self):
+        """Create the shared client."""
+        if self.client is None:
+            self.client = self._create_client()
+            logger.info(
+                f"HTTP client pool started (max_connections={settings.http_max_connections}, "
+                f"keepalive={settings.http_max_keepalive_connections}, http2={self.http2})"
+            )
+
+    async def stop(self):
+        """Close the shared client and its pooled connections."""
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+            logger.info("HTTP client pool closed")
+
+    def get_client(self) -> httpx.AsyncClient:
+        """Get the shared client, creating it on first use outside the app lifespan."""
+        if self.client is None:
+            self.client = self._create_client()
+        return self.client
+
+    def timeout_for(self, host: str) -> float:
+        """Per-host timeout from settings, falling back to the default."""
+        return settings.http_host_timeouts.get(host, settings.http_timeout)
+
+    async def request(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request through the pool with the host's configured timeout."""
+        host = urlsplit(url).hostname or ""
+        kwargs.setdefault(
+            "timeout",
+            httpx.Timeout(self.timeout_for(host), connect=settings.http_connect_timeout)
+        )
+        host_stats = self._hosts.setdefault(host, {"requests": 0, "errors": 0, "total_ms": 0.0})
+        host_stats["requests"] += 1
+        self._in_flight += 1
+        self._max_in_flight = max(self._max_in_flight, self._in_flight)
+        start = time.perf_counter()
+        try:
+            return await self.get_client().request(method, url, **kwargs)
+        except Exception:
+            host_stats["errors"] += 1
+            raise
+        finally:
+            self._in_flight -= 1
+            host_stats["total_ms"] += (time.perf_counter() - start) * 1000
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    def _pool_stats(self) -> Dict[str, Any]:
+        """Connection counts from the transport's pool (best effort, httpcore internals)."""
+        try:
+            connections = self.client._transport._pool.connections
+            idle = sum(1 for connection in connections if connection.is_idle())
+            return {"connections": len(connections), "idle": idle, "active": len(connections) - idle}
+        except Exception:
+            return {}
+
+    def stats(self) -> Dict[str, Any]:
+        """Pool utilisation and per-host request statistics."""
+        return {
+            "started": self.client is not None,
+            "http2": self.http2,
+            "in_flight": self._in_flight,
+            "max_in_flight": self._max_in_flight,
+            "limits": {
+                "max_connections": settings.http_max_connections,
+                "max_keepalive_connections": settings.http_max_keepalive_connections,
+                "keepalive_expiry": settings.http_keepalive_expiry
+            },
+            "pool": self._pool_stats() if self.client is not None else {},
+            "hosts": {
+                host: {
+                    "requests": data["requests"],
+                    "errors": data["errors"],
+                    "avg_ms": round(data["total_ms"] / data["requests"], 2) if data["requests"] else 0.0
+                }
+                for host, data in self._hosts.items()
+            }
+        }
+
+# Global HTTP client registry instance
+http_client = HTTPClientRegistry()
@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from app.config import settings
+from app.database.connection import get_collection
+
+logger = logging.getLogger(__name__)
+
+OVERFLOW_POLICIES = ("block", "drop_newest", "drop_oldest", "inline")
+
+# Called with the coalesced items whose writes were applied, after each flush
+FlushHook = Callable[[List["IngestItem"]], Awaitable[None]]
+# Called with the coalesced items before they are written, and may narrow their updates
+PrepareHook = Callable[[List["IngestItem"]], Awaitable[None]]
+
+# Sentinel pushed onto the queue to tell the flusher to drain and exit
+_STOP = object()
+
+def _merge_set(target: Dict[str, Any], fields: Dict[str, Any]) -> None:
+    """Merge $set fields into target, folding dotted paths into pending sub-documents."""
+    for key, value in fields.items():
+        root = key.split(".", 1)[0]
+        if "." in key and isinstance(target.get(root), dict):
+            # Apply the patch to the pending document instead of emitting
+            # both "root" and "root.path", which Mongo rejects as a conflict
+            node = target[root]
+            parts = key.split(".")[1:]
+            for part in parts[:-1]:
+                if not isinstance(node.get(part), dict):
+                    node[part] = {}
+                node = node[part]
+            node[parts[-1]] = value
+            continue
+        if "." not in key:
+            # A full replacement supersedes earlier patches below it
+            for pending in [k for k in target if k.startswith(f"{key}.")]:
+                del target[pending]
+        target[key] = value
+
+@dataclass
+class IngestItem:
+    """A pending visitor upsert (or patch, with upsert=False), keyed by its filter."""
+    filter: Dict[str, Any]
+    set_fields: Dict[str, Any] = field(default_factory=dict)
+    inc: Dict[str, int] = field(default_factory=dict)
+    profile: Optional[Dict[str, Any]] = None
+    upsert: bool = True
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # Filled in by prepare hooks: the $set/$unset actually written when smaller than
+    # set_fields (which flush hooks still see in full), whether the profile changed, and
+    # fields of the stored document the write replaces ({} for a new one, None if unread)
+    delta: Optional[Dict[str, Any]] = None
+    unset: Dict[str, str] = field(default_factory=dict)
+    profile_changed: bool = True
+    previous: Optional[Dict[str, Any]] = None
+    # Details of each visit the item carries, for flush hooks that count visits (never written)
+    visits: List[Dict[str, Any]] = field(default_factory=list)
+
+    @property
+    def key(self) -> Tuple:
+        return tuple(sorted(self.filter.items()))
+
+    def merge(self, other: "IngestItem") -> None:
+        """Coalesce a later write for the same document into this one."""
+        _merge_set(self.set_fields, other.set_fields)
+        for name, amount in other.inc.items():
+            self.inc[name] = self.inc.get(name, 0) + amount
+        if other.profile is not None:
+            self.profile = other.profile
+        self.visits.extend(other.visits)
+        self.upsert = self.upsert or other.upsert
+
+    def to_operation(self) -> UpdateOne:
+        update: Dict[str, Any] = {}
+        set_fields = self.set_fields if self.delta is None else self.delta
+        if set_fields:
+            update["$set"] = set_fields
+        if self.unset:
+            update["$unset"] = self.unset
+        if self.inc:
+            update["$inc"] = self.inc
+        return UpdateOne(self.filter, update, upsert=self.upsert)
+
+class IngestQueue:
+    """Bounded in-process write-behind queue that flushes visitor upserts in batches."""
+
+    def __init__(self, collection_name: str = "visitor_logs"):
+        self.collection_name = collection_name
+        self.max_size = settings.ingest_queue_max_size
+        self.batch_size = settings.ingest_batch_size
+        self.flush_interval = settings.ingest_flush_interval
+        self.overflow_policy = settings.ingest_overflow_policy
+        if self.overflow_policy not in OVERFLOW_POLICIES:
+            logger.warning(f"Unknown ingest overflow policy '{self.overflow_policy}', falling back to 'block'")
+            self.overflow_policy = "block"
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._closing = False
+        self._flush_hooks: List[FlushHook] = []
+        self._prepare_hooks: List[PrepareHook] = []
+        self._stats = {
+            "enqueued": 0,
+            "dropped": 0,
+            "inline_writes": 0,
+            "coalesced": 0,
+            "batches": 0,
+            "operations": 0,
+            "failed_batches": 0,
+            "partial_batches": 0,
+            "failed_operations": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+            "last_batch_size": 0,
+            "hook_errors": 0,
+            "prepare_errors": 0,
+        }
+
+    def add_flush_hook(self, hook: FlushHook):
+        """Register a coroutine to run with each flushed batch (derived indexes, counters)."""
+        if hook not in self._flush_hooks:
+            self._flush_hooks.append(hook)
+
+    def add_prepare_hook(self, hook: PrepareHook):
+        """Register a coroutine that may narrow each batch's updates before they are written (change detection)."""
+        if hook not in self._prepare_hooks:
+            self._prepare_hooks.append(hook)
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._closing
+
+    async def start(self):
+        """Start the background flusher."""
+        if self._task is not None:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._closing = False
+        self._task = asyncio.create_task(self._run())
+        logger.info(
+            f"Ingest queue started (max_size={self.max_size}, batch_size={self.batch_size}, "
+            f"flush_interval={self.flush_interval}s, policy={self.overflow_policy})"
+        )
+
+    async def stop(self):
+        """Stop accepting work and drain everything still queued."""
+        if self._task is None:
+            return
+        self._closing = True
+        try:
+            await asyncio.wait_for(self._queue.put(_STOP), timeout=settings.ingest_shutdown_timeout)
+            await asyncio.wait_for(self._task, timeout=settings.ingest_shutdown_timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Ingest queue drain timed out with {self._queue.qsize()} items left")
+            self._task.cancel()
+        except Exception as e:
+            logger.error(f"Error draining ingest queue: {e}")
+        finally:
+            self._task = None
+        logger.info("Ingest queue drained and stopped")
+
+    async def submit(self, item: IngestItem) -> bool:
+        """Queue an upsert for the next flush. Returns False if it was dropped."""
+        if not self.running:
+            # Not started (scripts, tests) or shutting down: write straight through
+            return await self._write_inline(item)
+
+        if self.overflow_policy == "block":
+            try:
+                await asyncio.wait_for(self._queue.put(item), timeout=settings.ingest_enqueue_timeout)
+            except asyncio.TimeoutError:
+                # Backpressure exhausted: pay the round trip rather than lose the visit
+                return await self._write_inline(item)
+        else:
+            try:
+                self._queue.put_nowait(item)
+            except asyncio.QueueFull:
+                if self.overflow_policy == "inline":
+                    return await self._write_inline(item)
+                if self.overflow_policy == "drop_newest":
+                    self._stats["dropped"] += 1
+                    return False
+                # drop_oldest: evict the head of the queue to make room
+                try:
+                    evicted = self._queue.get_nowait()
+                    if evicted is not _STOP:
+                        self._stats["dropped"] += 1
+                    self._queue.put_nowait(item)
+                except (asyncio.QueueEmpty, asyncio.QueueFull):
+                    self._stats["dropped"] += 1
+                    return False
+        self._stats["enqueued"] += 1
+        return True
+
+    async def _write_inline(self, item: IngestItem) -> bool:
+        self._stats["inline_writes"] += 1
+        return await self._flush([item])
+
+    async def _run(self):
+        """Collect items into batches and flush on size or age."""
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is _STOP:
+                break
+            batch: List[IngestItem] = [first]
+            deadline = first.enqueued_at + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(batch)
+
+        # Drain anything that was queued behind the stop sentinel
+        remaining: List[IngestItem] = []
+        while not self._queue.empty():
+            item = self._queue.get_nowait()
+            if item is not _STOP:
+                remaining.append(item)
+        for start in range(0, len(remaining), self.batch_size):
+            await self._flush(remaining[start:start + self.batch_size])
+
+    async def _flush(self, batch: List[IngestItem]) -> bool:
+        """Coalesce a batch by document and write it with one bulk_write."""
+        pending: Dict[Tuple, IngestItem] = {}
+        for item in batch:
+            existing = pending.get(item.key)
+            if existing is None:
+                pending[item.key] = item
+            else:
+                existing.merge(item)
+                self._stats["coalesced"] += 1
+
+        items = list(pending.values())
+        for hook in self._prepare_hooks:
+            try:
+                await hook(items)
+            except Exception as e:
+                # Whatever the hook didn't get to is written in full
+                self._stats["prepare_errors"] += 1
+                logger.error(f"Ingest prepare hook {getattr(hook, '__qualname__', hook)} failed: {e}")
+
+        operations = [item.to_operation() for item in items]
+        if not operations:
+            return True
+
+        failed: Set[int] = set()
+        start = time.perf_counter()
+        try:
+            collection = get_collection(self.collection_name)
+            await collection.bulk_write(operations, ordered=False)
+        except BulkWriteError as e:
+            # Unordered: every operation not listed in writeErrors was applied
+            errors = e.details.get("writeErrors", [])
+            failed = {error["index"] for error in errors}
+            self._stats["partial_batches"] += 1
+            self._stats["failed_operations"] += len(failed)
+            first = errors[0].get("errmsg") if errors else e
+            logger.error(f"Ingest flush: {len(failed)} of {len(operations)} operations failed (first error: {first})")
+        except Exception as e:
+            self._stats["failed_batches"] += 1
+            self._stats["failed_operations"] += len(operations)
+            logger.error(f"Ingest flush of {len(operations)} operations failed: {e}")
+            return False
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self._stats["batches"] += 1
+            self._stats["operations"] += len(operations)
+            self._stats["last_batch_size"] = len(operations)
+            self._stats["last_flush_ms"] = round(elapsed_ms, 2)
+            self._stats["total_flush_ms"] += elapsed_ms
+            self._stats["max_flush_ms"] = round(max(self._stats["max_flush_ms"], elapsed_ms), 2)
+
+        if failed:
+            items = [item for index, item in enumerate(items) if index not in failed]
+        for hook in self._flush_hooks:
+            try:
+                await hook(items)
+            except Exception as e:
+                self._stats["hook_errors"] += 1
+                logger.error(f"Ingest flush hook {getattr(hook, '__qualname__', hook)} failed: {e}")
+        return not failed
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue depth and flush latency statistics."""
+        batches = self._stats["batches"]
+        return {
+            **self._stats,
+            "total_flush_ms": round(self._stats["total_flush_ms"], 2),
+            "avg_flush_ms": round(self._stats["total_flush_ms"] / batches, 2) if batches else 0.0,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_size": self.max_size,
+            "overflow_policy": self.overflow_policy,
+            "running": self.running,
+        }
+
+# Global ingest queue instance
+ingest_queue = IngestQueue()
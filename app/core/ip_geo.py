@@ -0,0 +1,439 @@
+"""
+Offline IP geolocation backed by a compact, memory-mapped range database.
+
+The database file is built from CSV range data with:
+
+    python -m app.core.ip_geo build ranges.csv ip-ranges.bfpgeo
+    python -m app.core.ip_geo lookup ip-ranges.bfpgeo 8.8.8.8
+
+Layout (little-endian): a 32 byte header, then sorted IPv4 range starts/ends
+and location indexes as uint32 arrays, IPv6 range starts/ends as 16 byte
+big-endian values with uint32 location indexes, and finally a table of
+offsets into a blob of JSON-encoded locations. Lookups are a binary search
+over the mapped arrays, so nothing is parsed or copied up front.
+"""
+
+import argparse
+import asyncio
+import csv
+import heapq
+import ipaddress
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_right
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import settings
+from app.core.http_client import http_client
+from app.core.singleflight import SingleFlight
+from app.database.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"BFPIPGEO"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<8sIIIIQ")  # magic, version, ipv4 ranges, ipv6 ranges, locations, reserved
+
+# Location fields, in the shape get_ip_info returns
+LOCATION_FIELDS = [
+    "country", "countryCode", "region", "city", "latitude", "longitude", "timezone",
+    "isp", "organization", "continent", "mobile", "proxy", "hosting"
+]
+
+# CSV column aliases accepted by the converter (GeoLite/IP2Location style headers)
+COLUMN_ALIASES = {
+    "country_name": "country",
+    "country_code": "countryCode",
+    "country_iso_code": "countryCode",
+    "region_name": "region",
+    "subdivision_1_name": "region",
+    "city_name": "city",
+    "lat": "latitude",
+    "lon": "longitude",
+    "time_zone": "timezone",
+    "org": "organization",
+    "continent_name": "continent",
+}
+
+class _FixedWidthView:
+    """Sequence view over fixed-width big-endian integers, so bisect can search them."""
+
+    def __init__(self, buffer: memoryview, width: int):
+        self._buffer = buffer
+        self._width = width
+
+    def __len__(self) -> int:
+        return len(self._buffer) // self._width
+
+    def __getitem__(self, index: int) -> bytes:
+        start = index * self._width
+        return self._buffer[start:start + self._width].tobytes()
+
+class IPGeoDatabase:
+    """A memory-mapped IP range database file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        stat = os.stat(path)
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        self._file = open(path, "rb")
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self._map_sections()
+        except Exception:
+            self.close()
+            raise
+
+    def _map_sections(self):
+        if sys.byteorder != "little":
+            raise ValueError("IP geolocation database requires a little-endian host")
+        magic, version, self.ipv4_count, self.ipv6_count, self.location_count, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} is not a version {FORMAT_VERSION} IP geolocation database")
+
+        view = memoryview(self._mmap)
+        self._views = [view]
+        offset = HEADER.size
+
+        def take(size: int) -> memoryview:
+            nonlocal offset
+            section = view[offset:offset + size]
+            self._views.append(section)
+            offset += size
+            return section
+
+        self._v4_starts = take(self.ipv4_count * 4).cast("I")
+        self._v4_ends = take(self.ipv4_count * 4).cast("I")
+        self._v4_locations = take(self.ipv4_count * 4).cast("I")
+        self._v6_starts = _FixedWidthView(take(self.ipv6_count * 16), 16)
+        self._v6_ends = _FixedWidthView(take(self.ipv6_count * 16), 16)
+        self._v6_locations = take(self.ipv6_count * 4).cast("I")
+        self._location_offsets = take((self.location_count + 1) * 4).cast("I")
+        self._location_blob = take(self._location_offsets[self.location_count] if self.location_count else 0)
+        self._views.extend([self._v4_starts, self._v4_ends, self._v4_locations, self._v6_locations, self._location_offsets])
+        self._location_cache: Dict[int, Dict[str, Any]] = {}
+
+    def close(self):
+        # Exported memoryviews must be released before the map can close
+        for view in reversed(getattr(self, "_views", [])):
+            view.release()
+        self._views = []
+        if getattr(self, "_mmap", None) is not None:
+            self._mmap.close()
+        self._file.close()
+
+    def _location(self, index: int) -> Dict[str, Any]:
+        location = self._location_cache.get(index)
+        if location is None:
+            start = self._location_offsets[index]
+            end = self._location_offsets[index + 1]
+            location = json.loads(self._location_blob[start:end].tobytes())
+            self._location_cache[index] = location
+        return location
+
+    def lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        """Location for an IPv4/IPv6 address, or None if no range covers it."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        if address.version == 6 and address.ipv4_mapped:
+            address = address.ipv4_mapped
+
+        if address.version == 4:
+            value = int(address)
+            index = bisect_right(self._v4_starts, value) - 1
+            if index >= 0 and value <= self._v4_ends[index]:
+                return self._location(self._v4_locations[index])
+            return None
+
+        value = address.packed
+        index = bisect_right(self._v6_starts, value) - 1
+        if index >= 0 and value <= self._v6_ends[index]:
+            return self._location(self._v6_locations[index])
+        return None
+
+def _parse_range(row: Dict[str, str]) -> Tuple[Any, Any]:
+    if row.get("network"):
+        network = ipaddress.ip_network(row["network"].strip(), strict=False)
+        return network.network_address, network.broadcast_address
+    start = ipaddress.ip_address(row["start_ip"].strip())
+    end = ipaddress.ip_address(row["end_ip"].strip())
+    if start.version != end.version or int(start) > int(end):
+        raise ValueError(f"invalid range {start} - {end}")
+    return start, end
+
+def _parse_location(row: Dict[str, str]) -> Dict[str, Any]:
+    location: Dict[str, Any] = {}
+    for column, raw in row.items():
+        if column is None or raw is None:
+            continue
+        name = COLUMN_ALIASES.get(column.strip(), column.strip())
+        if name not in LOCATION_FIELDS or raw.strip() == "":
+            continue
+        value: Any = raw.strip()
+        if name in ("latitude", "longitude"):
+            value = float(value)
+        elif name in ("mobile", "proxy", "hosting"):
+            value = value.lower() in ("1", "true", "yes")
+        location[name] = value
+    return location
+
+def resolve_overlaps(ranges: List[Tuple[int, int, int]]) -> Tuple[List[Tuple[int, int, int]], int]:
+    """Sorted, disjoint (start, end, location) ranges where the narrowest covering range wins.
+
+    An outer range is split around the ranges nested in it (8.8.8.0/24 inside
+    8.8.0.0/16 keeps its own location); equal sizes go to the range listed first.
+    Also returns how many input ranges overlapped another.
+    """
+    ordered = sorted((start, end, location, order) for order, (start, end, location) in enumerate(ranges))
+    overlapping = set()
+    reach = -1
+    reach_order = None
+    for start, end, _, order in ordered:
+        if start <= reach:
+            overlapping.update((order, reach_order))
+        if end > reach:
+            reach, reach_order = end, order
+    if not overlapping:
+        return [entry[:3] for entry in ordered], 0
+
+    boundaries = sorted({entry[0] for entry in ordered} | {entry[1] + 1 for entry in ordered})
+    active: List[Tuple[int, int, int, int]] = []  # heap of (size, order, end, location)
+    resolved: List[Tuple[int, int, int]] = []
+    next_range = 0
+    for point, following in zip(boundaries, boundaries[1:]):
+        while next_range < len(ordered) and ordered[next_range][0] <= point:
+            start, end, location, order = ordered[next_range]
+            heapq.heappush(active, (end - start, order, end, location))
+            next_range += 1
+        while active and active[0][2] < point:
+            heapq.heappop(active)
+        if not active:
+            continue
+        location = active[0][3]
+        if resolved and resolved[-1][2] == location and resolved[-1][1] + 1 == point:
+            resolved[-1] = (resolved[-1][0], following - 1, location)
+        else:
+            resolved.append((point, following - 1, location))
+    return resolved, len(overlapping)
+
+def build_database(csv_path: str, output_path: str) -> Dict[str, int]:
+    """Convert CSV range data (start_ip,end_ip or network columns plus location columns) into a database file."""
+    ipv4: List[Tuple[int, int, int]] = []
+    ipv6: List[Tuple[bytes, bytes, int]] = []
+    locations: List[bytes] = []
+    location_index: Dict[bytes, int] = {}
+    skipped = 0
+
+    with open(csv_path, newline="", encoding="utf-8") as handle:
+        for line, row in enumerate(csv.DictReader(handle), start=2):
+            try:
+                start, end = _parse_range(row)
+                encoded = json.dumps(_parse_location(row), sort_keys=True, separators=(",", ":")).encode()
+            except (KeyError, ValueError) as e:
+                logger.warning(f"Skipping {csv_path}:{line}: {e}")
+                skipped += 1
+                continue
+            # Many ranges share a location; store each distinct one once
+            index = location_index.setdefault(encoded, len(locations))
+            if index == len(locations):
+                locations.append(encoded)
+            if start.version == 4:
+                ipv4.append((int(start), int(end), index))
+            else:
+                ipv6.append((start.packed, end.packed, index))
+
+    ipv4, overlapping = resolve_overlaps(ipv4)
+    resolved6, overlapping6 = resolve_overlaps(
+        [(int.from_bytes(start, "big"), int.from_bytes(end, "big"), index) for start, end, index in ipv6]
+    )
+    ipv6 = [(start.to_bytes(16, "big"), end.to_bytes(16, "big"), index) for start, end, index in resolved6]
+    overlapping += overlapping6
+    if overlapping:
+        logger.warning(f"{overlapping} ranges in {csv_path} overlap; outer ranges were split so the narrowest one wins")
+
+    offsets = array("I", [0])
+    for encoded in locations:
+        offsets.append(offsets[-1] + len(encoded))
+
+    tmp_path = f"{output_path}.tmp"
+    with open(tmp_path, "wb") as out:
+        out.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(ipv4), len(ipv6), len(locations), 0))
+        for column in range(3):
+            out.write(array("I", (entry[column] for entry in ipv4)).tobytes())
+        out.write(b"".join(entry[0] for entry in ipv6))
+        out.write(b"".join(entry[1] for entry in ipv6))
+        out.write(array("I", (entry[2] for entry in ipv6)).tobytes())
+        out.write(offsets.tobytes())
+        out.write(b"".join(locations))
+    # Atomic replace so a running server never maps a half-written file
+    os.replace(tmp_path, output_path)
+    return {"ipv4_ranges": len(ipv4), "ipv6_ranges": len(ipv6), "locations": len(locations), "skipped": skipped, "overlapping": overlapping}
+
+class IPGeoEngine:
+    """Local IP-to-location lookups with hot reload of the database file."""
+
+    def __init__(self):
+        self.path = settings.ip_geo_db_path
+        self.db: Optional[IPGeoDatabase] = None
+        self._watcher: Optional[asyncio.Task] = None
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "remote_lookups": 0, "reloads": 0, "reload_failures": 0, "total_lookup_us": 0.0}
+
+    def load(self) -> bool:
+        """(Re)load the database file, keeping the current one if the new file is invalid."""
+        if not self.path:
+            return False
+        try:
+            new_db = IPGeoDatabase(self.path)
+        except Exception as e:
+            self._stats["reload_failures"] += 1
+            logger.error(f"Failed to load IP geolocation database {self.path}: {e}")
+            return False
+        old_db, self.db = self.db, new_db
+        if old_db is not None:
+            old_db.close()
+        self._stats["reloads"] += 1
+        logger.info(f"Loaded IP geolocation database {self.path} ({new_db.ipv4_count} IPv4 / {new_db.ipv6_count} IPv6 ranges)")
+        return True
+
+    async def start(self):
+        """Load the configured database and watch it for replacement."""
+        if not self.path:
+            logger.info("No IP geolocation database configured; using the remote provider only")
+            return
+        self.load()
+        if self._watcher is None and settings.ip_geo_reload_interval > 0:
+            self._watcher = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._watcher:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        if self.db is not None:
+            self.db.close()
+            self.db = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(settings.ip_geo_reload_interval)
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                continue
+            if self.db is None or (stat.st_mtime_ns, stat.st_size) != self.db.signature:
+                self.load()
+
+    def lookup(self, ip: str) -> Optional[Dict[str, Any]]:
+        """Local lookup only; None when no database is loaded or no range matches."""
+        if self.db is None:
+            return None
+        start = time.perf_counter()
+        location = self.db.lookup(ip)
+        self._stats["total_lookup_us"] += (time.perf_counter() - start) * 1_000_000
+        self._stats["lookups"] += 1
+        self._stats["hits" if location is not None else "misses"] += 1
+        return location
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["lookups"]
+        return {
+            **self._stats,
+            "total_lookup_us": round(self._stats["total_lookup_us"], 2),
+            "avg_lookup_us": round(self._stats["total_lookup_us"] / lookups, 2) if lookups else 0.0,
+            "database": self.path if self.db is not None else None,
+        }
+
+# Global IP geolocation engine instance
+ip_geo = IPGeoEngine()
+
+# Collapses concurrent remote lookups for the same IP
+ip_flight = SingleFlight("ip_geo")
+
+def _cache_key(ip: str) -> str:
+    return f"ipgeo:{ip}"
+
+async def _remote_ip_location(ip: str) -> Dict[str, Any]:
+    """Look an IP up with ip-api.com."""
+    try:
+        response = await http_client.get(f"http://ip-api.com/json/{ip}?fields=status,message,continent,continentCode,country,countryCode,region,regionName,city,district,zip,lat,lon,timezone,offset,currency,isp,org,as,asname,mobile,proxy,hosting,query")
+        if response.status_code != 200:
+            return {"error": "Geolocation service unavailable"}
+        geo_data = response.json()
+        if geo_data.get("status") != "success":
+            return {"error": geo_data.get("message", "Location lookup failed")}
+        return {
+            "country": geo_data.get("country"),
+            "countryCode": geo_data.get("countryCode"),
+            "region": geo_data.get("regionName"),
+            "city": geo_data.get("city"),
+            "latitude": geo_data.get("lat"),
+            "longitude": geo_data.get("lon"),
+            "timezone": geo_data.get("timezone"),
+            "isp": geo_data.get("isp"),
+            "organization": geo_data.get("org"),
+            "continent": geo_data.get("continent"),
+            "mobile": geo_data.get("mobile"),
+            "proxy": geo_data.get("proxy"),
+            "hosting": geo_data.get("hosting"),
+            "query": geo_data.get("query")
+        }
+    except Exception as e:
+        logger.warning(f"Geolocation lookup failed for IP {ip}: {str(e)}")
+        return {"error": "Geolocation lookup failed"}
+
+async def get_ip_location(ip: str) -> Dict[str, Any]:
+    """Location for an IP from the local database, falling back to the remote provider on a miss."""
+    location = ip_geo.lookup(ip)
+    if location is not None:
+        result = {field: location.get(field) for field in LOCATION_FIELDS}
+        result["query"] = ip
+        return result
+    if not settings.ip_geo_remote_fallback:
+        return {"error": "Location not found"}
+    cached = await redis_client.get(_cache_key(ip))
+    if cached:
+        return cached
+    return await ip_flight.do(
+        ip,
+        lambda: _resolve_remote(ip),
+        wait_for=lambda: redis_client.get(_cache_key(ip))
+    )
+
+async def _resolve_remote(ip: str) -> Dict[str, Any]:
+    """Remote lookup, caching successful answers for the other workers."""
+    ip_geo._stats["remote_lookups"] += 1
+    location = await _remote_ip_location(ip)
+    if "error" not in location:
+        await redis_client.set(_cache_key(ip), location)
+    return location
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or query the offline IP geolocation database")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser("build", help="Convert CSV range data into a database file")
+    build.add_argument("csv_path")
+    build.add_argument("output_path")
+    lookup = subparsers.add_parser("lookup", help="Look up addresses in a database file")
+    lookup.add_argument("db_path")
+    lookup.add_argument("ips", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(json.dumps(build_database(args.csv_path, args.output_path), indent=2))
+    else:
+        db = IPGeoDatabase(args.db_path)
+        try:
+            for ip in args.ips:
+                print(ip, json.dumps(db.lookup(ip)))
+        finally:
+            db.close()
+
+if __name__ == "__main__":
+    main()
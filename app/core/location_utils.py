@@ -1,108 +1,233 @@
+import asyncio
+import time
 import httpx
-from typing import Dict
-import hashlib
-from app.database.redis_client import get_redis_client
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from app.config import settings
+from app.core.http_client import http_client
+from app.core.geo_cache import geo_cache
+from app.core.provider_health import ProviderUnavailable, provider_health
+from app.core.reverse_geocoder import reverse_geocoder
+from app.core.singleflight import SingleFlight
 import logging
 
 logger = logging.getLogger(__name__)
 
-async def get_location_from_coordinates(lat: float, lon: float) -> Dict:
-    """Get location information from coordinates using multiple services with caching."""
-    # Create cache key from coordinates
-    cache_key = f"geo:{hashlib.md5(f'{lat},{lon}'.encode()).hexdigest()}"
-    
-    # Try to get from cache first
-    redis_client = await get_redis_client()
-    cached_result = await redis_client.get(cache_key)
+# Collapses concurrent remote lookups that fall in the same geohash cell
+geocode_flight = SingleFlight("geocode")
+
+async def _query_openstreetmap(lat: float, lon: float) -> Optional[Dict]:
+    """OpenStreetMap Nominatim (Free, no API key required)."""
+    response = await http_client.get(
+        f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lon}&zoom=18&addressdetails=1",
+        headers={"User-Agent": "BFP-Analytics/1.0"}
+    )
+    if response.status_code != 200:
+        raise ProviderUnavailable(f"HTTP {response.status_code}")
+    data = response.json()
+    if "address" not in data:
+        return {"error": "No address found"}
+    address = data["address"]
+    return {
+        "display_name": data.get("display_name"),
+        "country": address.get("country"),
+        "country_code": address.get("country_code"),
+        "state": address.get("state"),
+        "city": address.get("city") or address.get("town") or address.get("village"),
+        "postcode": address.get("postcode"),
+        "road": address.get("road"),
+        "house_number": address.get("house_number"),
+        "suburb": address.get("suburb") or address.get("neighbourhood"),
+        "district": address.get("city_district") or address.get("district"),
+        "county": address.get("county"),
+        "region": address.get("region")
+    }
+
+async def _query_bigdatacloud(lat: float, lon: float) -> Optional[Dict]:
+    """BigDataCloud (Free tier, no API key required)."""
+    response = await http_client.get(
+        f"https://api.bigdatacloud.net/data/reverse-geocode-client?latitude={lat}&longitude={lon}&localityLanguage=en"
+    )
+    if response.status_code != 200:
+        raise ProviderUnavailable(f"HTTP {response.status_code}")
+    data = response.json()
+    return {
+        "city": data.get("city"),
+        "locality": data.get("locality"),
+        "district": data.get("principalSubdivision"),
+        "country": data.get("countryName"),
+        "country_code": data.get("countryCode"),
+        "continent": data.get("continent"),
+        "timezone": data.get("localityInfo", {}).get("administrative", [{}])[0].get("name") if data.get("localityInfo") else None
+    }
+
+async def _query_ip_api(lat: float, lon: float) -> Optional[Dict]:
+    """IP-API for additional context (if we have coordinates, we can get more info)."""
+    response = await http_client.get(f"http://ip-api.com/json/?lat={lat}&lon={lon}&fields=status,country,countryCode,region,regionName,city,timezone,isp,org")
+    if response.status_code != 200:
+        raise ProviderUnavailable(f"HTTP {response.status_code}")
+    data = response.json()
+    if data.get("status") != "success":
+        return None
+    return {
+        "country": data.get("country"),
+        "country_code": data.get("countryCode"),
+        "region": data.get("regionName"),
+        "city": data.get("city"),
+        "timezone": data.get("timezone"),
+        "isp": data.get("isp"),
+        "organization": data.get("org")
+    }
+
+# Reverse geocoding providers, queried concurrently
+GEOCODING_PROVIDERS: Dict[str, Callable[[float, float], Awaitable[Optional[Dict]]]] = {
+    "openstreetmap": _query_openstreetmap,
+    "bigdatacloud": _query_bigdatacloud,
+    "ip_api": _query_ip_api,
+}
+
+async def _timed_query(name: str, provider: Callable, lat: float, lon: float) -> Tuple[Optional[Dict], float, str]:
+    """Run one provider under its adaptive timeout, reporting the outcome to its circuit breaker."""
+    health = provider_health.get(name)
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(provider(lat, lon), timeout=health.timeout())
+    except (asyncio.TimeoutError, httpx.TimeoutException):
+        health.record_failure(timed_out=True)
+        return {"error": "Provider timed out"}, round((time.perf_counter() - start) * 1000, 2), "timeout"
+    except asyncio.CancelledError:
+        health.release_probe()
+        raise
+    except Exception as e:
+        health.record_failure()
+        return {"error": str(e)}, round((time.perf_counter() - start) * 1000, 2), "unavailable"
+    elapsed_ms = round((time.perf_counter() - start) * 1000, 2)
+    health.record_success(elapsed_ms)
+    if result is None:
+        return None, elapsed_ms, "empty"
+    return result, elapsed_ms, "error" if "error" in result else "ok"
+
+# Provider outcomes that mean the upstream service, not the location, was the problem
+DEGRADED_STATUSES = {"timeout", "unavailable", "circuit_open"}
+
+def _has_required_fields(sources: Dict, required_fields: List[str]) -> bool:
+    combined = combine_location_data(sources)
+    return all(combined.get(field) for field in required_fields)
+
+async def get_location_from_coordinates(
+    lat: float,
+    lon: float,
+    deadline: Optional[float] = None,
+    early_exit: Optional[bool] = None,
+    street_level: Optional[bool] = None
+) -> Dict:
+    """Get location information from coordinates, querying all services concurrently under one deadline."""
+    deadline = deadline if deadline is not None else settings.geocode_deadline
+    early_exit = early_exit if early_exit is not None else settings.geocode_early_exit
+    street_level = street_level if street_level is not None else settings.geocode_street_level
+
+    # City-level questions are answered in-process when a gazetteer is loaded
+    if not street_level:
+        local_result = _local_location(lat, lon)
+        if local_result is not None:
+            return local_result
+
+    # Try to get from cache first (keyed by the coordinate's geohash cell)
+    cached_result = await geo_cache.get(lat, lon)
     if cached_result:
         logger.info(f"Using cached geolocation for {lat},{lon}")
         return cached_result
-    
+
+    # Concurrent misses for the same cell share one provider fan-out
+    result = await geocode_flight.do(
+        geo_cache.cell(lat, lon),
+        lambda: _resolve_remote(lat, lon, deadline, early_exit),
+        # The miss was counted above; the follower's polls aren't more misses
+        wait_for=lambda: geo_cache.get(lat, lon, record_stats=False)
+    )
+    return {**result, "coordinates": {"latitude": lat, "longitude": lon}}
+
+async def _resolve_remote(lat: float, lon: float, deadline: float, early_exit: bool) -> Dict:
+    """Query every provider concurrently under one deadline and cache the combined result."""
     location_result = {
         "coordinates": {"latitude": lat, "longitude": lon},
-        "sources": {}
+        "sources": {},
+        "timings": {}
     }
-    # Service 1: OpenStreetMap Nominatim (Free, no API key required)
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(
-                f"https://nominatim.openstreetmap.org/reverse?format=json&lat={lat}&lon={lon}&zoom=18&addressdetails=1",
-                headers={"User-Agent": "BFP-Analytics/1.0"}
-            )
-            if response.status_code == 200:
-                data = response.json()
-                if "address" in data:
-                    address = data["address"]
-                    location_result["sources"]["openstreetmap"] = {
-                        "display_name": data.get("display_name"),
-                        "country": address.get("country"),
-                        "country_code": address.get("country_code"),
-                        "state": address.get("state"),
-                        "city": address.get("city") or address.get("town") or address.get("village"),
-                        "postcode": address.get("postcode"),
-                        "road": address.get("road"),
-                        "house_number": address.get("house_number"),
-                        "suburb": address.get("suburb") or address.get("neighbourhood"),
-                        "district": address.get("city_district") or address.get("district"),
-                        "county": address.get("county"),
-                        "region": address.get("region")
-                    }
-                else:
-                    location_result["sources"]["openstreetmap"] = {"error": "No address found"}
-    except Exception as e:
-        location_result["sources"]["openstreetmap"] = {"error": str(e)}
-    # Service 2: BigDataCloud (Free tier, no API key required)
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(
-                f"https://api.bigdatacloud.net/data/reverse-geocode-client?latitude={lat}&longitude={lon}&localityLanguage=en"
-            )
-            if response.status_code == 200:
-                data = response.json()
-                location_result["sources"]["bigdatacloud"] = {
-                    "city": data.get("city"),
-                    "locality": data.get("locality"),
-                    "district": data.get("principalSubdivision"),
-                    "country": data.get("countryName"),
-                    "country_code": data.get("countryCode"),
-                    "continent": data.get("continent"),
-                    "timezone": data.get("localityInfo", {}).get("administrative", [{}])[0].get("name") if data.get("localityInfo") else None
-                }
-    except Exception as e:
-        location_result["sources"]["bigdatacloud"] = {"error": str(e)}
-    # Service 3: IP-API for additional context (if we have coordinates, we can get more info)
-    try:
-        async with httpx.AsyncClient(timeout=5.0) as client:
-            response = await client.get(f"http://ip-api.com/json/?lat={lat}&lon={lon}&fields=status,country,countryCode,region,regionName,city,timezone,isp,org")
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("status") == "success":
-                    location_result["sources"]["ip_api"] = {
-                        "country": data.get("country"),
-                        "country_code": data.get("countryCode"),
-                        "region": data.get("regionName"),
-                        "city": data.get("city"),
-                        "timezone": data.get("timezone"),
-                        "isp": data.get("isp"),
-                        "organization": data.get("org")
-                    }
-    except Exception as e:
-        location_result["sources"]["ip_api"] = {"error": str(e)}
+    sources = location_result["sources"]
+    timings = location_result["timings"]
+
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    tasks = {}
+    for name, provider in GEOCODING_PROVIDERS.items():
+        # An open breaker skips the provider instead of waiting out its timeout
+        if not provider_health.get(name).allow_request():
+            timings[name] = {"ms": 0.0, "status": "circuit_open"}
+            continue
+        tasks[asyncio.create_task(_timed_query(name, provider, lat, lon))] = name
+    pending = set(tasks)
+    exited_early = False
+    while pending:
+        remaining = started + deadline - loop.time()
+        if remaining <= 0:
+            break
+        done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            name = tasks[task]
+            result, elapsed_ms, status = task.result()
+            if result is not None:
+                sources[name] = result
+            timings[name] = {"ms": elapsed_ms, "status": status}
+        # Early exit: stop once the fields callers need are filled, cancelling slower providers
+        if early_exit and pending and _has_required_fields(sources, settings.geocode_required_fields):
+            exited_early = True
+            break
+
+    # Whatever is still running either missed the deadline or lost the race
+    if pending:
+        elapsed_ms = round((loop.time() - started) * 1000, 2)
+        for task in pending:
+            task.cancel()
+            timings[tasks[task]] = {"ms": elapsed_ms, "status": "cancelled" if exited_early else "timeout"}
+        await asyncio.gather(*pending, return_exceptions=True)
+        if not exited_early:
+            for task in pending:
+                provider_health.get(tasks[task]).record_failure(timed_out=True)
+    location_result["early_exit"] = exited_early
+    # Failed or skipped providers make this a partial answer worth retrying soon
+    degraded = any(timing["status"] in DEGRADED_STATUSES for timing in timings.values())
+    location_result["degraded"] = degraded
+
     # Combine best information from all sources
-    combined_location = combine_location_data(location_result["sources"])
+    combined_location = combine_location_data(sources)
     location_result["combined"] = combined_location
     
     # Cache the result for future use
-    await redis_client.set(cache_key, location_result)
-    logger.info(f"Cached geolocation result for {lat},{lon}")
+    await geo_cache.set(lat, lon, location_result, ttl=settings.geocode_negative_ttl if degraded else None)
+    logger.info(f"Cached {'degraded ' if degraded else ''}geolocation result for {lat},{lon}")
     
     return location_result
 
+def _local_location(lat: float, lon: float) -> Optional[Dict]:
+    """Location result from the local gazetteer, shaped like the remote result."""
+    start = time.perf_counter()
+    place = reverse_geocoder.lookup(lat, lon)
+    if place is None:
+        return None
+    sources = {"gazetteer": place}
+    return {
+        "coordinates": {"latitude": lat, "longitude": lon},
+        "sources": sources,
+        "timings": {"gazetteer": {"ms": round((time.perf_counter() - start) * 1000, 3), "status": "ok"}},
+        "early_exit": False,
+        "combined": combine_location_data(sources)
+    }
+
 def combine_location_data(sources: Dict) -> Dict:
     """Combine location data from multiple sources to get the best information."""
     combined = {}
     # Priority order for different fields
-    source_priority = ["openstreetmap", "bigdatacloud", "ip_api"]
+    source_priority = ["openstreetmap", "bigdatacloud", "ip_api", "gazetteer"]
     fields_to_combine = [
         "country", "country_code", "state", "region", "city", 
         "district", "postcode", "timezone", "road", "suburb"
@@ -0,0 +1,461 @@
+"""
+Compressed cold storage for full visitor profiles.
+
+visitor_logs keeps a small hot document per visitor (identity, visit count, parsed
+user agent, fingerprint hash, coarse location, last_seen) for list views, rollups
+and scans. The collected profile, typically tens of kilobytes, is compressed into a
+visitor_profiles document keyed by the visitor_id (or the anonymous visit's _id).
+
+The hot document carries a digest of the profile without its per-visit fields
+(profile_volatile_fields). Before each ingest flush the stored digests of the
+returning visitors are read in one query: an unchanged profile turns the visit into
+a $set of the hot fields only (no profile or cold write), and a changed one is diffed against
+the stored profile, writing only the changed paths when profiles are kept inline and
+a compact change record to profile_changes. Changed profiles are written out before
+the visit itself, so a stored digest always has its cold profile. Font lists, user
+agents and feature maps are stored once in profile_dictionary (app.core.dictionary)
+and referenced by id from the cold profile. Move profiles out of existing documents,
+or drop cold profiles whose visitor is gone, with:
+
+    python -m app.core.profile_store migrate --batch-size 500
+    python -m app.core.profile_store prune
+"""
+
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import zlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from pymongo import ReplaceOne, UpdateOne
+from app.config import settings
+from app.core.dictionary import ID_FIELDS, value_dictionary
+from app.core.ingest import IngestItem, ingest_queue
+from app.database.connection import get_collection
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "visitor_profiles"
+CHANGES = "profile_changes"
+CODECS = ("zlib", "zstd")
+# Two decimal places is roughly 1 km: enough for maps and clustering, not an address
+COARSE_COORDINATE_DIGITS = 2
+# What a visit with an unchanged profile leaves out of the hot document's $set
+PROFILE_FIELDS = ("profile", "profile_digest")
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib is always available
+    zstandard = None
+
+def serialize(profile: Dict[str, Any]) -> bytes:
+    """Canonical JSON (sorted keys, no whitespace), so equal profiles give equal bytes."""
+    return json.dumps(profile, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str).encode("utf-8")
+
+def digest(payload: bytes) -> str:
+    return hashlib.blake2b(payload, digest_size=16).hexdigest()
+
+def normalize(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """The profile without the paths that change on every collection (timestamps, session keys, network)."""
+    normalized = dict(profile)
+    for path in settings.profile_volatile_fields:
+        *parents, leaf = path.split(".")
+        node = normalized
+        for part in parents:
+            if not isinstance(node.get(part), dict):
+                node = None
+                break
+            # Copy only along the path, so the caller's profile is left as it was
+            node[part] = dict(node[part])
+            node = node[part]
+        if node is not None:
+            node.pop(leaf, None)
+    return normalized
+
+def profile_digest(profile: Dict[str, Any]) -> str:
+    return digest(serialize(normalize(profile)))
+
+def volatile_values(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """The per-visit paths normalize() drops, as {dotted path: value} for those present."""
+    values = {}
+    for path in settings.profile_volatile_fields:
+        node: Any = profile
+        for part in path.split("."):
+            node = node.get(part) if isinstance(node, dict) else None
+        if node is not None:
+            values[path] = node
+    return values
+
+def _addressable(document: Dict[str, Any]) -> bool:
+    """Whether every key can be written as a dotted update path."""
+    return all(isinstance(key, str) and key and "." not in key and not key.startswith("$") for key in document)
+
+def diff(old: Dict[str, Any], new: Dict[str, Any], prefix: str = "") -> Tuple[Dict[str, Any], List[str]]:
+    """Changed sub-paths between two profiles: ({dotted path: new value}, [removed paths]). Lists compare whole."""
+    changed: Dict[str, Any] = {}
+    removed: List[str] = []
+    for key, value in new.items():
+        path = f"{prefix}{key}"
+        if key not in old:
+            changed[path] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict) and _addressable(value) and _addressable(old[key]):
+            nested_changed, nested_removed = diff(old[key], value, f"{path}.")
+            changed.update(nested_changed)
+            removed.extend(nested_removed)
+        elif old[key] != value:
+            changed[path] = value
+    removed.extend(f"{prefix}{key}" for key in old if key not in new)
+    return changed, removed
+
+def compress(payload: bytes, codec: str, level: int) -> bytes:
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=level).compress(payload)
+    return zlib.compress(payload, level)
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Profile was stored with zstd but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+def cold_key(document: Dict[str, Any]) -> Any:
+    """Cold profile key for a hot document or ingest filter: its visitor_id, else its _id."""
+    return document.get("visitor_id") or document.get("_id")
+
+def hot_location(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Coarse location $set fields for the hot document (dotted, so a patched-in address survives)."""
+    gps = (profile.get("loc") or {}).get("gps") or {}
+    fields = {}
+    for axis in ("latitude", "longitude"):
+        if isinstance(gps.get(axis), (int, float)):
+            fields[f"location.{axis}"] = round(gps[axis], COARSE_COORDINATE_DIGITS)
+    return fields
+
+class ProfileStore:
+    """Reads and writes compressed profiles, skipping writes whose digest is unchanged."""
+
+    def __init__(self, collection_name: str = COLLECTION):
+        self.collection_name = collection_name
+        self.codec = settings.profile_compression
+        if self.codec not in CODECS:
+            logger.warning(f"Unknown profile compression '{self.codec}', falling back to 'zlib'")
+            self.codec = "zlib"
+        elif self.codec == "zstd" and zstandard is None:
+            logger.warning("PROFILE_COMPRESSION=zstd but the zstandard package is not installed, falling back to 'zlib'")
+            self.codec = "zlib"
+        self._stats = {
+            "written": 0,
+            "unchanged": 0,
+            "raw_bytes": 0,
+            "stored_bytes": 0,
+            "reads": 0,
+            "last_write_ms": 0.0,
+            "visits_checked": 0,
+            "visits_unchanged": 0,
+            "visits_changed": 0,
+            "visits_backfilled": 0,
+            "change_records": 0,
+            "write_errors": 0,
+        }
+
+    @property
+    def enabled(self) -> bool:
+        return settings.profile_cold_storage
+
+    def encode(self, key: Any, profile: Dict[str, Any], inline: Iterable[str] = ()) -> Dict[str, Any]:
+        """The cold document for a profile; its dictionary values (other than inline kinds) must be persisted before it is written."""
+        payload = serialize(value_dictionary.intern(profile, inline))
+        data = compress(payload, self.codec, settings.profile_compression_level)
+        return {
+            "_id": key,
+            "digest": profile_digest(profile),
+            "codec": self.codec,
+            "data": data,
+            "size": len(payload),
+            "stored_size": len(data),
+            "updated_at": datetime.utcnow(),
+        }
+
+    @staticmethod
+    def decode(document: Dict[str, Any]) -> Dict[str, Any]:
+        return json.loads(decompress(document["data"], document.get("codec", "zlib")))
+
+    async def start(self):
+        """Check returning visits for changes before they are written, and write changed profiles out ahead of them."""
+        if settings.profile_change_detection:
+            ingest_queue.add_prepare_hook(self.prepare)
+        if self.enabled:
+            # After prepare, which decides which profiles changed
+            ingest_queue.add_prepare_hook(self.write_cold)
+
+    async def prepare(self, items: List[IngestItem]):
+        """Ingest prepare hook: leave the profile out of returning visits whose stored profile_digest still matches."""
+        returning = {
+            item.filter["visitor_id"]: item for item in items
+            if item.profile is not None and item.upsert and item.filter.get("visitor_id") and item.set_fields.get("profile_digest")
+        }
+        if not returning:
+            return
+        hot = get_collection("visitor_logs")
+        projection = {"visitor_id": 1, "profile_digest": 1, **{name: 1 for name in ID_FIELDS}}
+        documents = {
+            document["visitor_id"]: document
+            async for document in hot.find({"visitor_id": {"$in": list(returning)}}, projection)
+        }
+        stored = {visitor_id: document.get("profile_digest") for visitor_id, document in documents.items()}
+        changed: Dict[str, IngestItem] = {}
+        for visitor_id, item in returning.items():
+            # First visits are written in full
+            if visitor_id not in stored:
+                continue
+            self._stats["visits_checked"] += 1
+            if stored[visitor_id] == item.set_fields["profile_digest"]:
+                # Derived fields (fingerprint_hash, dictionary ids, location) and coalesced patches still apply
+                item.delta = {name: value for name, value in item.set_fields.items() if name not in PROFILE_FIELDS}
+                if not self.enabled:
+                    # Inline profiles still get this visit's per-visit values, as a changed one would
+                    item.delta.update({f"profile.{path}": value for path, value in volatile_values(item.profile).items()})
+                # Stored before dictionary encoding: write the cold profile once more, with its values interned
+                item.profile_changed = any(name in item.set_fields and name not in documents[visitor_id] for name in ID_FIELDS)
+                self._stats["visits_unchanged"] += 1
+                if item.profile_changed:
+                    self._stats["visits_backfilled"] += 1
+            else:
+                changed[visitor_id] = item
+                self._stats["visits_changed"] += 1
+        if not changed or (self.enabled and not settings.profile_change_records):
+            return
+
+        if self.enabled:
+            previous = {key: profile for key, (_, profile) in (await self.get_many(changed)).items()}
+        else:
+            previous = {
+                document["visitor_id"]: document.get("profile")
+                async for document in hot.find({"visitor_id": {"$in": list(changed)}}, {"visitor_id": 1, "profile": 1})
+            }
+        records = []
+        for visitor_id, item in changed.items():
+            if not previous.get(visitor_id):
+                continue
+            set_paths, removed = diff(normalize(previous[visitor_id]), normalize(item.profile))
+            if not self.enabled:
+                # Inline profiles get just the changed paths instead of the whole profile, per-visit ones
+                # included, so they end up as the profile a cold write would have stored
+                written, unset = diff(previous[visitor_id], item.profile)
+                item.delta = {name: value for name, value in item.set_fields.items() if name != "profile"}
+                item.delta.update({f"profile.{path}": value for path, value in written.items()})
+                item.unset = {f"profile.{path}": "" for path in unset}
+            if settings.profile_change_records:
+                records.append({
+                    "visitor_id": visitor_id,
+                    "at": item.set_fields.get("created_at") or datetime.utcnow(),
+                    "from_digest": stored[visitor_id],
+                    "to_digest": item.set_fields["profile_digest"],
+                    "changes": [{"path": path, "value": value} for path, value in set_paths.items()],
+                    "removed": removed,
+                })
+        if records:
+            await get_collection(CHANGES).insert_many(records, ordered=False)
+            self._stats["change_records"] += len(records)
+
+    async def write_cold(self, items: List[IngestItem]):
+        """Ingest prepare hook: store changed profiles before their profile_digest is written to visitor_logs.
+
+        When the cold write fails the visits are written without the new digest, so the next
+        visit finds the profile changed and writes it again.
+        """
+        # Enrichment patches carry no profile; coalesced items carry the latest one
+        pending = [item for item in items if item.profile is not None and item.profile_changed]
+        if not pending:
+            return
+        try:
+            # Without change detection the digest is compared here instead
+            await self.save_many({cold_key(item.filter): item.profile for item in pending}, force=settings.profile_change_detection)
+        except Exception as e:
+            self._stats["write_errors"] += 1
+            logger.error(f"Cold write of {len(pending)} profiles failed, leaving their digests unchanged: {e}")
+            for item in pending:
+                item.set_fields.pop("profile_digest", None)
+                if item.delta is not None:
+                    item.delta.pop("profile_digest", None)
+
+    async def save_many(self, profiles: Dict[Any, Dict[str, Any]], force: bool = False) -> int:
+        """Upsert profiles by key with one digest read and one bulk_write; returns how many were written."""
+        if not profiles:
+            return 0
+        start = time.perf_counter()
+        collection = get_collection(self.collection_name)
+        encoded = [self.encode(key, profile) for key, profile in profiles.items()]
+        stored: Dict[Any, str] = {}
+        if not force:
+            async for document in collection.find({"_id": {"$in": list(profiles)}}, {"digest": 1}):
+                stored[document["_id"]] = document.get("digest")
+        await value_dictionary.persist()
+        operations = []
+        for document in encoded:
+            if stored.get(document["_id"]) == document["digest"]:
+                self._stats["unchanged"] += 1
+                continue
+            operations.append(ReplaceOne({"_id": document["_id"]}, document, upsert=True))
+            self._stats["raw_bytes"] += document["size"]
+            self._stats["stored_bytes"] += document["stored_size"]
+        if operations:
+            await collection.bulk_write(operations, ordered=False)
+            self._stats["written"] += len(operations)
+        self._stats["last_write_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        return len(operations)
+
+    async def get(self, key: Any) -> Optional[Dict[str, Any]]:
+        document = await get_collection(self.collection_name).find_one({"_id": key})
+        self._stats["reads"] += 1
+        if not document:
+            return None
+        profile = self.decode(document)
+        await value_dictionary.rehydrate([profile])
+        return profile
+
+    async def get_many(self, keys: Iterable[Any]) -> Dict[Any, Tuple[str, Dict[str, Any]]]:
+        """(digest, profile) by key with one query, for compare-and-swap rewrites; missing keys are left out."""
+        keys = list(keys)
+        if not keys:
+            return {}
+        documents = await get_collection(self.collection_name).find({"_id": {"$in": keys}}).to_list(length=None)
+        self._stats["reads"] += len(documents)
+        profiles = {document["_id"]: (document["digest"], self.decode(document)) for document in documents}
+        await value_dictionary.rehydrate([profile for _, profile in profiles.values()])
+        return profiles
+
+    async def replace_if_unchanged(self, replacements: Dict[Any, Tuple[str, Dict[str, Any]]], inline: Iterable[str] = ()) -> int:
+        """Rewrite profiles whose stored digest still matches; a visit written since then wins."""
+        operations = [
+            ReplaceOne({"_id": key, "digest": expected}, self.encode(key, profile, inline))
+            for key, (expected, profile) in replacements.items()
+        ]
+        if not operations:
+            return 0
+        await value_dictionary.persist()
+        result = await get_collection(self.collection_name).bulk_write(operations, ordered=False)
+        return getattr(result, "matched_count", len(operations))
+
+    async def load(self, document: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The full profile for a hot visitor document, falling back to an inline one not yet migrated."""
+        key = cold_key(document)
+        profile = await self.get(key) if key is not None else None
+        profile = profile or document.get("profile")
+        # Resolved GPS addresses are patched into the hot document only
+        address = (document.get("location") or {}).get("address")
+        gps = ((profile or {}).get("loc") or {}).get("gps")
+        if not address or not isinstance(gps, dict) or gps.get("address") == address:
+            return profile
+        return {**profile, "loc": {**profile["loc"], "gps": {**gps, "address": address}}}
+
+    async def changes(self, visitor_id: str, limit: int = 50) -> List[Dict[str, Any]]:
+        """A visitor's recorded profile changes, newest first."""
+        return await get_collection(CHANGES).find({"visitor_id": visitor_id}, {"_id": 0}) \
+            .sort("at", -1).limit(limit).to_list(length=limit)
+
+    async def delete_many(self, keys: Iterable[Any]) -> int:
+        keys = list(keys)
+        if not keys:
+            return 0
+        result = await get_collection(self.collection_name).delete_many({"_id": {"$in": keys}})
+        return result.deleted_count
+
+    async def migrate(self, source: str = "visitor_logs", batch_size: int = 500) -> Dict[str, int]:
+        """Move inline profiles out of hot documents; safe to interrupt and re-run."""
+        hot = get_collection(source)
+        migrated = 0
+        while True:
+            documents = await hot.find({"profile": {"$exists": True}}, {"visitor_id": 1, "profile": 1, "location": 1}) \
+                .limit(batch_size).to_list(length=None)
+            if not documents:
+                break
+            # A visit since the deploy already stored a newer profile (and location) than the inline one
+            keys = [cold_key(document) for document in documents]
+            newer = {document["_id"] async for document in get_collection(self.collection_name).find({"_id": {"$in": keys}}, {"_id": 1})}
+            # Cold first: a crash in between leaves the inline copy to migrate again
+            await self.save_many({
+                cold_key(document): document["profile"]
+                for document in documents
+                if document.get("profile") and cold_key(document) not in newer
+            }, force=True)
+            operations = []
+            for document in documents:
+                update: Dict[str, Any] = {"$unset": {"profile": ""}}
+                profile = document.get("profile") or {}
+                if cold_key(document) in newer:
+                    operations.append(UpdateOne({"_id": document["_id"]}, update))
+                    continue
+                update["$set"] = {"profile_digest": profile_digest(profile)}
+                if not document.get("location"):
+                    update["$set"].update(hot_location(profile))
+                    address = ((profile.get("loc") or {}).get("gps") or {}).get("address")
+                    if address:
+                        update["$set"]["location.address"] = address
+                operations.append(UpdateOne({"_id": document["_id"]}, update))
+            await hot.bulk_write(operations, ordered=False)
+            migrated += len(documents)
+            logger.info(f"Migrated {migrated} profiles to {self.collection_name}")
+        return {"migrated": migrated}
+
+    async def prune(self, source: str = "visitor_logs", batch_size: int = 1000) -> Dict[str, int]:
+        """Delete cold profiles whose hot document is gone (e.g. expired by a TTL index)."""
+        cold, hot = get_collection(self.collection_name), get_collection(source)
+        pruned = 0
+        last = None
+        while True:
+            query = {"_id": {"$gt": last}} if last is not None else {}
+            keys = [document["_id"] for document in await cold.find(query, {"_id": 1}).sort("_id", 1).limit(batch_size).to_list(length=None)]
+            if not keys:
+                break
+            last = keys[-1]
+            alive = set()
+            async for document in hot.find({"$or": [{"visitor_id": {"$in": keys}}, {"_id": {"$in": keys}}]}, {"visitor_id": 1}):
+                alive.update({document.get("visitor_id"), document["_id"]})
+            orphans = [key for key in keys if key not in alive]
+            if orphans:
+                pruned += await self.delete_many(orphans)
+        return {"pruned": pruned}
+
+    def stats(self) -> Dict[str, Any]:
+        raw, stored = self._stats["raw_bytes"], self._stats["stored_bytes"]
+        return {
+            **self._stats,
+            "enabled": self.enabled,
+            "codec": self.codec,
+            "compression_ratio": round(raw / stored, 2) if stored else 0.0,
+        }
+
+# Global profile store instance
+profile_store = ProfileStore()
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage compressed visitor profiles")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    migrate = subparsers.add_parser("migrate", help="Move inline profiles out of visitor_logs")
+    migrate.add_argument("--batch-size", type=int, default=500)
+    migrate.add_argument("--source", default="visitor_logs")
+    prune = subparsers.add_parser("prune", help="Delete cold profiles whose visitor document is gone")
+    prune.add_argument("--source", default="visitor_logs")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    from app.database.connection import close_mongo_connection, connect_to_mongo
+
+    async def run():
+        await connect_to_mongo()
+        try:
+            if args.command == "migrate":
+                return await profile_store.migrate(args.source, args.batch_size)
+            return await profile_store.prune(args.source)
+        finally:
+            await close_mongo_connection()
+
+    print(json.dumps(asyncio.run(run()), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+class ProviderUnavailable(Exception):
+    """Raised by a provider when the upstream service did not give a usable answer."""
+
+class ProviderHealth:
+    """Circuit breaker and latency tracker for one upstream provider."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self._probe_in_flight = False
+        self.latencies: Deque[float] = deque(maxlen=settings.provider_latency_window)
+        self._stats = {"successes": 0, "failures": 0, "timeouts": 0, "skipped": 0, "opened": 0}
+
+    def allow_request(self) -> bool:
+        """Whether the provider should be called now; an open breaker admits one probe after the recovery timeout."""
+        if self.state == OPEN:
+            if time.monotonic() - self.opened_at < settings.provider_recovery_timeout:
+                self._stats["skipped"] += 1
+                return False
+            self.state = HALF_OPEN
+            self._probe_in_flight = False
+        if self.state == HALF_OPEN:
+            if self._probe_in_flight:
+                self._stats["skipped"] += 1
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def timeout(self) -> float:
+        """Per-call timeout derived from recent latency, bounded by the HTTP timeout."""
+        if len(self.latencies) < settings.provider_timeout_min_samples:
+            return settings.http_timeout
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * settings.provider_timeout_percentile))
+        adaptive = ordered[index] / 1000 * settings.provider_timeout_multiplier
+        return min(settings.http_timeout, max(settings.provider_timeout_min, adaptive))
+
+    def record_success(self, elapsed_ms: float):
+        self._stats["successes"] += 1
+        self.latencies.append(elapsed_ms)
+        self.consecutive_failures = 0
+        if self.state != CLOSED:
+            logger.info(f"Provider {self.name} recovered; closing circuit")
+        self.state = CLOSED
+        self.opened_at = None
+        self._probe_in_flight = False
+
+    def record_failure(self, timed_out: bool = False):
+        self._stats["failures"] += 1
+        if timed_out:
+            self._stats["timeouts"] += 1
+        self.consecutive_failures += 1
+        self._probe_in_flight = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= settings.provider_failure_threshold:
+            if self.state != OPEN:
+                self._stats["opened"] += 1
+                logger.warning(f"Provider {self.name} failing ({self.consecutive_failures} in a row); opening circuit")
+            self.state = OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self):
+        """Let another caller probe if this one was cancelled before reporting."""
+        self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "timeout_s": round(self.timeout(), 3),
+            "latency_samples": len(self.latencies),
+        }
+
+class ProviderHealthRegistry:
+    """Health trackers keyed by provider name, created on first use."""
+
+    def __init__(self):
+        self._providers: Dict[str, ProviderHealth] = {}
+
+    def get(self, name: str) -> ProviderHealth:
+        health = self._providers.get(name)
+        if health is None:
+            health = self._providers[name] = ProviderHealth(name)
+        return health
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: health.stats() for name, health in self._providers.items()}
+
+# Global provider health registry
+provider_health = ProviderHealthRegistry()
@@ -0,0 +1,100 @@
+import asyncio
+import ipaddress
+import logging
+import time
+from typing import Any, Dict, Optional
+from app.config import settings
+from app.core.http_client import http_client
+
+logger = logging.getLogger(__name__)
+
+# Discovery services and the JSON field holding the address, tried in order
+PUBLIC_IP_SERVICES = [
+    ("https://api.ipify.org?format=json", "ip"),
+    ("https://ipinfo.io/json", "ip"),
+    ("https://httpbin.org/ip", "origin"),
+]
+
+class PublicIPService:
+    """The server's own public IP, discovered at startup and refreshed in the background."""
+
+    def __init__(self):
+        self.ip: Optional[str] = settings.public_ip or None
+        self.source: Optional[str] = "settings" if self.ip else None
+        self.refreshed_at: Optional[float] = None
+        self._last_attempt = 0.0
+        self._lock = asyncio.Lock()
+        self._refresher: Optional[asyncio.Task] = None
+        self._stats = {"refreshes": 0, "refresh_failures": 0, "changes": 0}
+
+    async def start(self):
+        """Resolve the public IP once and keep it fresh, unless it is pinned in settings."""
+        if settings.public_ip:
+            logger.info(f"Using configured public IP {settings.public_ip}")
+            return
+        await self.refresh()
+        if self._refresher is None and settings.public_ip_refresh_interval > 0:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresher:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+
+    async def _refresh_loop(self):
+        while True:
+            # Retry sooner while we still have no answer at all
+            interval = settings.public_ip_refresh_interval if self.ip else settings.public_ip_retry_interval
+            await asyncio.sleep(interval)
+            await self.refresh()
+
+    async def _discover(self) -> Optional[str]:
+        for url, field in PUBLIC_IP_SERVICES:
+            try:
+                response = await http_client.get(url)
+                if response.status_code != 200:
+                    continue
+                value = str(response.json().get(field, "")).split(",")[0].strip()
+                ipaddress.ip_address(value)
+                return value
+            except Exception as e:
+                logger.debug(f"Public IP discovery via {url} failed: {e}")
+        return None
+
+    async def refresh(self) -> bool:
+        """Query the discovery services, keeping the previous answer if all of them fail."""
+        async with self._lock:
+            self._last_attempt = time.monotonic()
+            discovered = await self._discover()
+            if discovered is None:
+                self._stats["refresh_failures"] += 1
+                logger.warning("Failed to discover the server's public IP")
+                return False
+            if discovered != self.ip:
+                if self.ip is not None:
+                    self._stats["changes"] += 1
+                    logger.info(f"Public IP changed from {self.ip} to {discovered}")
+                self.ip = discovered
+            self.source = "discovered"
+            self.refreshed_at = time.time()
+            self._stats["refreshes"] += 1
+            return True
+
+    async def get(self) -> Optional[str]:
+        """Public IP from memory; only retries discovery (rate limited) when nothing is known yet."""
+        if self.ip is None and time.monotonic() - self._last_attempt >= settings.public_ip_retry_interval:
+            if not self._lock.locked():
+                await self.refresh()
+        return self.ip
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **self._stats,
+            "ip": self.ip,
+            "source": self.source,
+            "refreshed_at": self.refreshed_at,
+        }
+
+# Global public IP service instance
+public_ip = PublicIPService()
@@ -0,0 +1,321 @@
+"""
+Background anonymization and retention for visitor_logs.
+
+Documents whose created_at (the last visit) is older than anonymize_after_days
+have their identifying fields stripped or replaced by keyed hashes, in the hot
+document and in its compressed profile in visitor_profiles; documents older than
+data_retention_days are deleted together with their profile. Both walk the created_at index in
+small batches with pauses in between, back off while the ingest queue is busy,
+and anonymization resumes from a checkpoint after a restart. A visitor who
+returns gets a fresh created_at and full profile, and is anonymized again once
+that visit ages. Profile dictionary values that no visitor carries and no visit has
+referenced within the retention window (plus a margin) are deleted as well. Runs on a
+schedule inside the app, or once with:
+
+    python -m app.core.retention run
+"""
+
+import argparse
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from app.config import settings
+from app.core.dictionary import ID_FIELDS, PRUNE_MARGIN, value_dictionary
+from app.core.ingest import ingest_queue
+from app.core.profile_store import cold_key, profile_store
+from app.database.connection import get_collection
+from app.database.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINTS = "job_checkpoints"
+LOCK_KEY = "retention:lock"
+
+# Removed outright: browser storage contents, full URLs and media device labels/ids
+STRIPPED_FIELDS = [
+    "profile.localStorageData",
+    "profile.sessionStorageData",
+    "profile.session.url",
+    "profile.session.ref",
+    "profile.mediaDevices",
+    "profile.loc.gps.address",
+    "profile.loc.gps.accuracy",
+    "location.address",
+    # Points at the raw user agent in profile_dictionary
+    "ua_id",
+]
+
+# Fields read to build the per-document replacements
+ANONYMIZE_PROJECTION = {
+    "visitor_id": 1,
+    "created_at": 1,
+    "location": 1,
+    "browser_version": 1,
+    "os_version": 1,
+    "profile.navigator.ua": 1,
+    "profile.loc.gps": 1,
+    "profile.loc.ipInfo": 1,
+    "ua_id": 1,
+}
+
+def pseudonym(value: str) -> str:
+    """Keyed hash: stable for grouping, not reversible by hashing every IPv4 address."""
+    return hashlib.blake2b(value.encode("utf-8"), digest_size=12, key=settings.secret_key.encode("utf-8")[:64]).hexdigest()
+
+def _major(version: Any) -> Optional[str]:
+    return str(version).split(".")[0] if version else None
+
+def anonymize_update(document: Dict[str, Any]) -> Dict[str, Any]:
+    """$set/$unset update replacing a document's identifying fields."""
+    profile = document.get("profile") or {}
+    location = profile.get("loc") or {}
+    set_fields: Dict[str, Any] = {"anonymized_at": datetime.utcnow()}
+    unset_fields = {field: "" for field in STRIPPED_FIELDS}
+
+    ua = (profile.get("navigator") or {}).get("ua")
+    if ua:
+        set_fields["profile.navigator.ua"] = pseudonym(ua)
+    for field in ("browser_version", "os_version"):
+        if document.get(field):
+            set_fields[field] = _major(document[field])
+
+    # Roughly 11 km at one decimal place
+    for prefix, coordinates in (("profile.loc.gps", location.get("gps")), ("location", document.get("location"))):
+        if isinstance(coordinates, dict):
+            for axis in ("latitude", "longitude"):
+                if isinstance(coordinates.get(axis), (int, float)):
+                    set_fields[f"{prefix}.{axis}"] = round(coordinates[axis], settings.anonymize_coordinate_precision)
+
+    ip_info = location.get("ipInfo")
+    if isinstance(ip_info, dict):
+        ip = ip_info.get("publicIP") or ip_info.get("detectedIP") or ip_info.get("ip")
+        geo = ip_info.get("location") if isinstance(ip_info.get("location"), dict) else {}
+        set_fields["profile.loc.ipInfo"] = {
+            "ip_hash": pseudonym(ip) if ip and ip != "unknown" else None,
+            "country": geo.get("countryCode") or geo.get("country"),
+        }
+    # The anonymized profile no longer matches: the visitor's next visit is written in full
+    unset_fields["profile_digest"] = ""
+    # A field can't be both set and unset in one update
+    for field in set_fields:
+        unset_fields.pop(field, None)
+    return {"$set": set_fields, "$unset": unset_fields}
+
+def anonymize_profile(profile: Dict[str, Any]) -> Dict[str, Any]:
+    """The profile.* part of anonymize_update applied to a (decompressed) cold profile."""
+    document = {"profile": copy.deepcopy(profile)}
+    update = anonymize_update(document)
+    for path in update["$unset"]:
+        if path.startswith("profile."):
+            *parents, leaf = path.split(".")[1:]
+            node = document["profile"]
+            for part in parents:
+                node = node.get(part) if isinstance(node, dict) else None
+            if isinstance(node, dict):
+                node.pop(leaf, None)
+    for path, value in update["$set"].items():
+        if path.startswith("profile."):
+            *parents, leaf = path.split(".")[1:]
+            node = document["profile"]
+            for part in parents:
+                node = node.setdefault(part, {})
+            node[leaf] = value
+    return document["profile"]
+
+class RetentionEngine:
+    """Scheduled, throttled anonymization and deletion of aged visitor documents."""
+
+    def __init__(self, collection_name: str = "visitor_logs"):
+        self.collection_name = collection_name
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "runs": 0,
+            "anonymized": 0,
+            "deleted": 0,
+            "skipped_changed": 0,
+            "backoffs": 0,
+            "errors": 0,
+            "last_run_at": None,
+            "last_run_s": 0.0,
+        }
+
+    async def start(self):
+        """Start the periodic retention job."""
+        if not settings.retention_enabled or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        # Let startup traffic settle before the first pass
+        await asyncio.sleep(settings.retention_initial_delay)
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                self._stats["errors"] += 1
+                logger.error(f"Retention run failed: {e}")
+            await asyncio.sleep(settings.retention_interval)
+
+    async def _pause(self):
+        """Pause between batches, longer while the ingest queue is backing up."""
+        if ingest_queue.running and ingest_queue.stats()["queue_depth"] > ingest_queue.max_size * settings.retention_ingest_backoff_ratio:
+            self._stats["backoffs"] += 1
+            await asyncio.sleep(settings.retention_batch_pause * 10)
+        else:
+            await asyncio.sleep(settings.retention_batch_pause)
+
+    async def _load_checkpoint(self, job: str) -> Optional[Tuple[datetime, Any]]:
+        checkpoint = await get_collection(CHECKPOINTS).find_one({"_id": job})
+        if not checkpoint or checkpoint.get("created_at") is None:
+            return None
+        return checkpoint["created_at"], checkpoint.get("doc_id")
+
+    async def _save_checkpoint(self, job: str, created_at: datetime, doc_id: Any):
+        await get_collection(CHECKPOINTS).update_one(
+            {"_id": job},
+            {"$set": {"created_at": created_at, "doc_id": doc_id, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def anonymize(self, cutoff: datetime, max_batches: Optional[int] = None) -> int:
+        """Anonymize documents last seen before the cutoff, resuming after the saved (created_at, _id) checkpoint."""
+        collection = get_collection(self.collection_name)
+        anonymized = 0
+        batches = 0
+        checkpoint = await self._load_checkpoint("anonymize")
+        while max_batches is None or batches < max_batches:
+            query: Dict[str, Any] = {"created_at": {"$lt": cutoff}}
+            if checkpoint is not None:
+                after, doc_id = checkpoint
+                query["$or"] = [{"created_at": {"$gt": after}}, {"created_at": after, "_id": {"$gt": doc_id}}]
+            documents = await collection.find(query, ANONYMIZE_PROJECTION) \
+                .sort([("created_at", 1), ("_id", 1)]).limit(settings.retention_batch_size).to_list(length=None)
+            if not documents:
+                break
+            operations = [
+                # Matching created_at too: a visitor who just came back keeps the fresh profile
+                UpdateOne({"_id": document["_id"], "created_at": document["created_at"]}, anonymize_update(document))
+                for document in documents
+            ]
+            result = await collection.bulk_write(operations, ordered=False)
+            modified = getattr(result, "matched_count", len(operations))
+            await self._anonymize_profiles(documents, cutoff)
+            anonymized += modified
+            self._stats["anonymized"] += modified
+            self._stats["skipped_changed"] += len(operations) - modified
+            last = documents[-1]
+            checkpoint = (last["created_at"], last["_id"])
+            await self._save_checkpoint("anonymize", *checkpoint)
+            batches += 1
+            await self._pause()
+        return anonymized
+
+    async def _still_aged(self, documents: List[Dict[str, Any]], cutoff: datetime) -> List[Dict[str, Any]]:
+        """The documents that weren't refreshed by a visit since they were read."""
+        ids = [document["_id"] for document in documents]
+        aged = {document["_id"] for document in await get_collection(self.collection_name)
+                .find({"_id": {"$in": ids}, "created_at": {"$lt": cutoff}}, {"_id": 1}).to_list(length=None)}
+        return [document for document in documents if document["_id"] in aged]
+
+    async def _anonymize_profiles(self, documents: List[Dict[str, Any]], cutoff: datetime):
+        """Anonymize the cold profiles of an anonymized batch, leaving any rewritten by a new visit."""
+        aged = await self._still_aged(documents, cutoff)
+        # Their ua_id was unset
+        await value_dictionary.release(aged, kinds=["ua"])
+        stored = await profile_store.get_many(cold_key(document) for document in aged)
+        # The pseudonymized user agent stays in the profile: as a dictionary value it would be
+        # a one-off entry counted among the real user agents
+        await profile_store.replace_if_unchanged({
+            key: (expected, anonymize_profile(profile)) for key, (expected, profile) in stored.items()
+        }, inline=["ua"])
+
+    async def delete_expired(self, cutoff: datetime, max_batches: Optional[int] = None) -> int:
+        """Delete documents last seen before the cutoff, oldest first, in paced chunks."""
+        collection = get_collection(self.collection_name)
+        deleted = 0
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            documents = await collection.find({"created_at": {"$lt": cutoff}}, {"_id": 1, "visitor_id": 1, **{name: 1 for name in ID_FIELDS}}) \
+                .sort("created_at", 1).limit(settings.retention_batch_size).to_list(length=None)
+            if not documents:
+                break
+            # Re-checking the cutoff spares a visitor who returned since the ids were read
+            result = await collection.delete_many({"_id": {"$in": [document["_id"] for document in documents]}, "created_at": {"$lt": cutoff}})
+            survivors = {document["_id"] for document in await collection.find(
+                {"_id": {"$in": [document["_id"] for document in documents]}}, {"_id": 1}).to_list(length=None)}
+            removed = [document for document in documents if document["_id"] not in survivors]
+            await profile_store.delete_many(cold_key(document) for document in removed)
+            await value_dictionary.release(removed)
+            deleted += result.deleted_count
+            self._stats["deleted"] += result.deleted_count
+            batches += 1
+            await self._pause()
+        return deleted
+
+    async def run_once(self) -> Dict[str, Any]:
+        """One pass: delete, then anonymize. Only one worker runs it at a time when Redis is available."""
+        token = None
+        if redis_client.connected:
+            token = await redis_client.acquire_lock(LOCK_KEY, int(settings.retention_lock_ttl * 1000))
+            if token is None:
+                return {"skipped": "another worker holds the retention lock"}
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        result: Dict[str, Any] = {"anonymized": 0, "deleted": 0, "pruned_values": 0}
+        try:
+            # Expired documents go first so they aren't anonymized just before being deleted
+            if settings.data_retention_days > 0:
+                cutoff = now - timedelta(days=settings.data_retention_days)
+                result["deleted"] = await self.delete_expired(cutoff, settings.retention_max_batches)
+                # Dictionary values last used by visitors that are gone by now
+                result["pruned_values"] = await value_dictionary.prune(cutoff - PRUNE_MARGIN)
+            if settings.anonymize_after_days > 0:
+                result["anonymized"] = await self.anonymize(now - timedelta(days=settings.anonymize_after_days), settings.retention_max_batches)
+        finally:
+            if token is not None:
+                await redis_client.release_lock(LOCK_KEY, token)
+        elapsed = time.perf_counter() - started
+        self._stats["runs"] += 1
+        self._stats["last_run_at"] = now.isoformat()
+        self._stats["last_run_s"] = round(elapsed, 2)
+        if result["anonymized"] or result["deleted"]:
+            logger.info(f"Retention run anonymized {result['anonymized']} and deleted {result['deleted']} visitor documents in {elapsed:.1f}s")
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "running": self._task is not None}
+
+# Global retention engine instance
+retention_engine = RetentionEngine()
+
+def main():
+    parser = argparse.ArgumentParser(description="Anonymize and expire aged visitor documents")
+    parser.add_argument("command", choices=["run"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    from app.database.connection import close_mongo_connection, connect_to_mongo
+
+    async def run():
+        await connect_to_mongo()
+        try:
+            return await retention_engine.run_once()
+        finally:
+            await close_mongo_connection()
+
+    print(json.dumps(asyncio.run(run()), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+import asyncio
+import csv
+import logging
+import math
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from app.config import settings
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Gazetteer CSV column aliases (GeoNames-style exports use admin1/admin2 etc.)
+COLUMN_ALIASES = {
+    "name": "city",
+    "asciiname": "city",
+    "lat": "latitude",
+    "lon": "longitude",
+    "lng": "longitude",
+    "country_name": "country",
+    "cc": "country_code",
+    "admin1": "state",
+    "admin1_name": "state",
+    "admin2": "county",
+    "admin2_name": "county",
+    "time_zone": "timezone",
+}
+PLACE_FIELDS = ["city", "district", "county", "state", "region", "country", "country_code", "timezone"]
+
+def _to_unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """Project coordinates onto the unit sphere so Euclidean nearest = great-circle nearest."""
+    lat_rad = np.radians(lat)
+    lon_rad = np.radians(lon)
+    cos_lat = np.cos(lat_rad)
+    return np.column_stack((cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad)))
+
+def _chord_to_km(chord: float) -> float:
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, chord / 2))
+
+class KDTree:
+    """Implicit, array-backed k-d tree over 3D points (nodes are medians of index ranges)."""
+
+    def __init__(self, points: np.ndarray, leaf_size: int = 16):
+        self.leaf_size = leaf_size
+        self.points = np.array(points, dtype=np.float64)
+        self.index = np.arange(len(self.points))
+        self.split_dims = np.zeros(len(self.points), dtype=np.int8)
+        self._build(0, len(self.points))
+
+    def _build(self, lo: int, hi: int):
+        if hi - lo <= self.leaf_size:
+            return
+        mid = (lo + hi) // 2
+        block = self.points[lo:hi]
+        dim = int(np.argmax(block.max(axis=0) - block.min(axis=0)))
+        order = np.argpartition(block[:, dim], mid - lo)
+        self.points[lo:hi] = block[order]
+        self.index[lo:hi] = self.index[lo:hi][order]
+        self.split_dims[mid] = dim
+        self._build(lo, mid)
+        self._build(mid + 1, hi)
+
+    def nearest(self, query: np.ndarray) -> Tuple[int, float]:
+        """Original index and chord distance of the point nearest to query."""
+        best = [-1, math.inf]  # [position, squared distance]
+        self._search(query, 0, len(self.points), best)
+        return int(self.index[best[0]]), math.sqrt(best[1])
+
+    def _search(self, query: np.ndarray, lo: int, hi: int, best: List):
+        if hi - lo <= self.leaf_size:
+            if hi > lo:
+                distances = ((self.points[lo:hi] - query) ** 2).sum(axis=1)
+                position = int(np.argmin(distances))
+                if distances[position] < best[1]:
+                    best[0], best[1] = lo + position, float(distances[position])
+            return
+        mid = (lo + hi) // 2
+        dim = self.split_dims[mid]
+        node = self.points[mid]
+        distance = float(((node - query) ** 2).sum())
+        if distance < best[1]:
+            best[0], best[1] = mid, distance
+        diff = query[dim] - node[dim]
+        near, far = ((lo, mid), (mid + 1, hi)) if diff < 0 else ((mid + 1, hi), (lo, mid))
+        self._search(query, near[0], near[1], best)
+        # Only cross the splitting plane if it is closer than the best match so far
+        if diff * diff < best[1]:
+            self._search(query, far[0], far[1], best)
+
+def load_gazetteer(path: str) -> Tuple[List[Dict[str, Any]], np.ndarray, np.ndarray]:
+    """Read a gazetteer CSV (city, latitude, longitude plus admin region columns)."""
+    places: List[Dict[str, Any]] = []
+    lats: List[float] = []
+    lons: List[float] = []
+    with open(path, newline="", encoding="utf-8") as handle:
+        for row in csv.DictReader(handle):
+            record: Dict[str, Any] = {}
+            for column, value in row.items():
+                if column is None or value is None or value.strip() == "":
+                    continue
+                name = column.strip().lower()
+                record[COLUMN_ALIASES.get(name, name)] = value.strip()
+            try:
+                lat = float(record.pop("latitude"))
+                lon = float(record.pop("longitude"))
+            except (KeyError, ValueError):
+                continue
+            places.append({field: record.get(field) for field in PLACE_FIELDS if record.get(field)})
+            lats.append(lat)
+            lons.append(lon)
+    return places, np.array(lats), np.array(lons)
+
+class ReverseGeocoder:
+    """In-process nearest-place reverse geocoder over a local gazetteer."""
+
+    def __init__(self):
+        self.path = settings.gazetteer_path
+        self.max_distance_km = settings.gazetteer_max_distance_km
+        self.places: List[Dict[str, Any]] = []
+        self.tree: Optional[KDTree] = None
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "total_lookup_us": 0.0}
+
+    @property
+    def available(self) -> bool:
+        return self.tree is not None
+
+    def load(self, path: Optional[str] = None):
+        """Load a gazetteer file and build the tree."""
+        path = path or self.path
+        start = time.perf_counter()
+        places, lats, lons = load_gazetteer(path)
+        if not places:
+            raise ValueError(f"Gazetteer {path} contains no usable places")
+        tree = KDTree(_to_unit_vectors(lats, lons))
+        self.places, self.tree, self.path = places, tree, path
+        logger.info(f"Loaded gazetteer {path}: {len(places)} places in {time.perf_counter() - start:.2f}s")
+
+    async def start(self):
+        """Load the configured gazetteer off the event loop (building the tree is CPU-bound)."""
+        if not self.path:
+            return
+        try:
+            await asyncio.to_thread(self.load)
+        except Exception as e:
+            logger.error(f"Failed to load gazetteer {self.path}: {e}. City-level lookups will use remote providers.")
+
+    def lookup(self, lat: float, lon: float) -> Optional[Dict[str, Any]]:
+        """Nearest place within the configured distance, with distance_km, or None."""
+        if self.tree is None:
+            return None
+        start = time.perf_counter()
+        place_index, chord = self.tree.nearest(_to_unit_vectors(np.array([lat]), np.array([lon]))[0])
+        distance_km = _chord_to_km(chord)
+        self._stats["total_lookup_us"] += (time.perf_counter() - start) * 1_000_000
+        self._stats["lookups"] += 1
+        if distance_km > self.max_distance_km:
+            self._stats["misses"] += 1
+            return None
+        self._stats["hits"] += 1
+        return {**self.places[place_index], "distance_km": round(distance_km, 3)}
+
+    def lookup_batch(self, coordinates: Sequence[Tuple[float, float]]) -> List[Optional[Dict[str, Any]]]:
+        """Nearest places for many coordinates, projecting them in one vectorised step."""
+        if self.tree is None or not coordinates:
+            return [None] * len(coordinates)
+        start = time.perf_counter()
+        coords = np.asarray(coordinates, dtype=np.float64)
+        vectors = _to_unit_vectors(coords[:, 0], coords[:, 1])
+        results: List[Optional[Dict[str, Any]]] = []
+        for vector in vectors:
+            place_index, chord = self.tree.nearest(vector)
+            distance_km = _chord_to_km(chord)
+            self._stats["lookups"] += 1
+            if distance_km > self.max_distance_km:
+                self._stats["misses"] += 1
+                results.append(None)
+            else:
+                self._stats["hits"] += 1
+                results.append({**self.places[place_index], "distance_km": round(distance_km, 3)})
+        self._stats["total_lookup_us"] += (time.perf_counter() - start) * 1_000_000
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self._stats["lookups"]
+        return {
+            **self._stats,
+            "total_lookup_us": round(self._stats["total_lookup_us"], 2),
+            "avg_lookup_us": round(self._stats["total_lookup_us"] / lookups, 2) if lookups else 0.0,
+            "places": len(self.places),
+            "gazetteer": self.path if self.available else None,
+        }
+
+# Global reverse geocoder instance
+reverse_geocoder = ReverseGeocoder()
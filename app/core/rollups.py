@@ -0,0 +1,379 @@
+"""
+Pre-aggregated visit counters per minute, hour and day bucket, for dashboards.
+
+Rollups are updated from the ingest queue's flush hook with one batched bulk_write of
+$inc upserts, and backfilled from the per-visit visit_events collection (in parallel
+day-aligned chunks) with:
+
+    python -m app.core.rollups backfill --start 2025-01-01 --end 2025-02-01 --workers 4
+
+Each rollup document holds one (granularity, bucket, dimension) cell with a map of
+dimension value -> visits, e.g. the visits per browser in the hour starting 10:00.
+Events expire after VISIT_EVENTS_TTL, so days older than that are skipped by a backfill.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from pymongo import UpdateOne
+from app.config import settings
+from app.core.cardinality import floor_to, to_utc
+from app.core.ingest import IngestItem, ingest_queue
+from app.core.visit_events import COLLECTION as VISIT_EVENTS, events_ttl
+from app.database.connection import get_collection
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "visit_rollups"
+
+# Dimension -> visitor_logs (and visit_events) field it is read from ("all" only keeps the total)
+DIMENSIONS = {
+    "all": None,
+    "browser": "browser",
+    "os": "os",
+    "device_type": "device_type",
+    "country": "country",
+}
+UNKNOWN = "unknown"
+
+MINUTE = "minute"
+HOUR = "hour"
+DAY = "day"
+# Coarsest first
+GRANULARITIES = (DAY, HOUR, MINUTE)
+STEPS = {MINUTE: timedelta(minutes=1), HOUR: timedelta(hours=1), DAY: timedelta(days=1)}
+
+def _floor(moment: datetime, granularity: str) -> datetime:
+    if granularity == MINUTE:
+        return moment.replace(second=0, microsecond=0)
+    return floor_to(moment, granularity)
+
+def _retention(granularity: str) -> int:
+    return {
+        MINUTE: settings.rollup_minute_ttl,
+        HOUR: settings.rollup_hour_ttl,
+        DAY: settings.rollup_day_ttl,
+    }[granularity]
+
+def _field(value: str) -> str:
+    """Dimension values become field names: dots and a leading $ are not allowed there."""
+    return value.replace(".", "\uff0e").replace("$", "\uff04")
+
+def _unfield(name: str) -> str:
+    return name.replace("\uff0e", ".").replace("\uff04", "$")
+
+def _doc_id(granularity: str, bucket: datetime, dimension: str) -> str:
+    return f"{granularity}:{bucket:%Y%m%d%H%M}:{dimension}"
+
+def visit_dimensions(fields: Dict[str, Any]) -> Dict[str, str]:
+    """Dimension values of one stored (or about to be stored) visitor document."""
+    return {
+        dimension: str(fields.get(source) or UNKNOWN)
+        for dimension, source in DIMENSIONS.items() if source is not None
+    }
+
+Cells = Dict[Tuple[str, datetime, str], Counter]
+
+def _accumulate(cells: Cells, at: datetime, dimensions: Dict[str, str], visits: int):
+    """Add visits at one moment to every granularity's bucket, per dimension."""
+    for granularity in GRANULARITIES:
+        bucket = _floor(at, granularity)
+        cells[(granularity, bucket, "all")][None] += visits
+        for dimension, value in dimensions.items():
+            cells[(granularity, bucket, dimension)][value] += visits
+
+class RollupStore:
+    """Incrementally maintained visit counters in the visit_rollups collection."""
+
+    def __init__(self, collection_name: str = COLLECTION):
+        self.collection_name = collection_name
+        self._stats = {"flushes": 0, "visits": 0, "cells_written": 0, "queries": 0, "documents_read": 0, "total_query_ms": 0.0}
+
+    def _expires_at(self, granularity: str, bucket: datetime) -> Optional[datetime]:
+        ttl = _retention(granularity)
+        return bucket + STEPS[granularity] + timedelta(seconds=ttl) if ttl > 0 else None
+
+    def _retained(self, granularity: str, bucket: datetime, now: datetime) -> bool:
+        ttl = _retention(granularity)
+        return ttl <= 0 or bucket + STEPS[granularity] + timedelta(seconds=ttl) > now
+
+    def _header(self, granularity: str, bucket: datetime, dimension: str) -> Dict[str, Any]:
+        header = {"granularity": granularity, "bucket": bucket, "dimension": dimension}
+        expires_at = self._expires_at(granularity, bucket)
+        if expires_at is not None:
+            header["expires_at"] = expires_at
+        return header
+
+    async def start(self):
+        """Count visits as the ingest queue flushes them."""
+        if settings.rollups_enabled:
+            ingest_queue.add_flush_hook(self.on_flush)
+
+    async def on_flush(self, items: List[IngestItem]):
+        """Ingest flush hook: fold the flushed visits into bucket counters with one bulk_write."""
+        cells: Cells = defaultdict(Counter)
+        visits = 0
+        for item in items:
+            # Enrichment patches carry no profile and are not visits
+            if item.profile is None:
+                continue
+            # Coalesced items carry the summed visit_count increment
+            count = item.inc.get("visit_count", 1)
+            at = item.set_fields.get("created_at") or datetime.utcnow()
+            _accumulate(cells, at, visit_dimensions(item.set_fields), count)
+            visits += count
+        if not cells:
+            return
+        operations = []
+        for (granularity, bucket, dimension), counts in cells.items():
+            increments = {"total": sum(counts.values())}
+            if dimension != "all":
+                increments.update({f"counts.{_field(value)}": amount for value, amount in counts.items()})
+            operations.append(UpdateOne(
+                {"_id": _doc_id(granularity, bucket, dimension)},
+                {"$inc": increments, "$setOnInsert": self._header(granularity, bucket, dimension)},
+                upsert=True
+            ))
+        await get_collection(self.collection_name).bulk_write(operations, ordered=False)
+        self._stats["flushes"] += 1
+        self._stats["visits"] += visits
+        self._stats["cells_written"] += len(operations)
+
+    def cover(self, start: datetime, end: datetime) -> Tuple[List[Tuple[str, datetime]], bool]:
+        """Fewest (granularity, bucket) cells covering [start, end): the coarsest bucket that fits at each step.
+
+        Where minute (or hour) buckets have already expired, the enclosing coarser bucket is used
+        instead; the second value says whether that widened the range.
+        """
+        now = datetime.utcnow()
+        cells: List[Tuple[str, datetime]] = []
+        widened = False
+        moment = start
+        while moment < end:
+            for granularity in GRANULARITIES:
+                step = STEPS[granularity]
+                if _floor(moment, granularity) == moment and moment + step <= end and self._retained(granularity, moment, now):
+                    cells.append((granularity, moment))
+                    moment += step
+                    break
+            else:
+                # Too old for minute buckets: fall back to the finest retained enclosing bucket
+                for granularity in (HOUR, DAY):
+                    bucket = _floor(moment, granularity)
+                    if self._retained(granularity, bucket, now) or granularity == DAY:
+                        cells.append((granularity, bucket))
+                        moment = bucket + STEPS[granularity]
+                        widened = True
+                        break
+        return cells, widened
+
+    @staticmethod
+    def _snap(start: datetime, end: datetime) -> Tuple[datetime, datetime]:
+        """Widen [start, end) to whole minutes, the finest bucket kept."""
+        start, end = to_utc(start), to_utc(end)
+        if end <= start:
+            raise ValueError("end must be after start")
+        snapped_end = _floor(end, MINUTE)
+        if snapped_end < end:
+            snapped_end += STEPS[MINUTE]
+        return _floor(start, MINUTE), snapped_end
+
+    @staticmethod
+    def _validate(dimension: str):
+        if dimension not in DIMENSIONS:
+            raise ValueError(f"Unknown dimension '{dimension}' (expected one of {', '.join(DIMENSIONS)})")
+
+    async def _read(self, filter_dict: Dict[str, Any], sort: bool = False) -> List[Dict[str, Any]]:
+        start = time.perf_counter()
+        cursor = get_collection(self.collection_name).find(filter_dict, {"_id": 0, "bucket": 1, "counts": 1, "total": 1})
+        if sort:
+            cursor = cursor.sort("bucket", 1)
+        documents = await cursor.to_list(length=None)
+        self._stats["queries"] += 1
+        self._stats["documents_read"] += len(documents)
+        self._stats["total_query_ms"] += (time.perf_counter() - start) * 1000
+        return documents
+
+    async def totals(self, dimension: str, start: datetime, end: datetime) -> Dict[str, Any]:
+        """Visits per dimension value over [start, end), read from the fewest covering bucket documents."""
+        self._validate(dimension)
+        start, end = self._snap(start, end)
+        cells, widened = self.cover(start, end)
+        documents = await self._read({"_id": {"$in": [_doc_id(granularity, bucket, dimension) for granularity, bucket in cells]}})
+        counts: Counter = Counter()
+        total = 0
+        for document in documents:
+            total += document.get("total", 0)
+            counts.update({_unfield(value): amount for value, amount in (document.get("counts") or {}).items()})
+        return {
+            "dimension": dimension,
+            "start": start.isoformat(),
+            "end": end.isoformat(),
+            "total": total,
+            "values": dict(counts.most_common()),
+            "buckets": {granularity: sum(1 for cell in cells if cell[0] == granularity) for granularity in GRANULARITIES},
+            "widened": widened,
+        }
+
+    def _series_granularity(self, start: datetime, end: datetime) -> str:
+        """Finest granularity that keeps the series within rollup_max_points and is still retained."""
+        now = datetime.utcnow()
+        for granularity in reversed(GRANULARITIES):
+            points = (end - _floor(start, granularity)) / STEPS[granularity]
+            if points <= settings.rollup_max_points and self._retained(granularity, _floor(start, granularity), now):
+                return granularity
+        return DAY
+
+    async def series(self, dimension: str, start: datetime, end: datetime, granularity: Optional[str] = None) -> Dict[str, Any]:
+        """Per-bucket visits (and per-value counts) across a range, one document per bucket."""
+        self._validate(dimension)
+        if granularity is not None and granularity not in GRANULARITIES:
+            raise ValueError(f"Unknown granularity '{granularity}' (expected minute, hour or day)")
+        start, end = self._snap(start, end)
+        granularity = granularity or self._series_granularity(start, end)
+        first = _floor(start, granularity)
+        if (end - first) / STEPS[granularity] > settings.rollup_max_points:
+            raise ValueError(f"Range spans more than {settings.rollup_max_points} {granularity} buckets")
+        documents = await self._read(
+            {"dimension": dimension, "granularity": granularity, "bucket": {"$gte": first, "$lt": end}},
+            sort=True
+        )
+        return {
+            "dimension": dimension,
+            "granularity": granularity,
+            "start": first.isoformat(),
+            "end": end.isoformat(),
+            "series": [
+                {
+                    "bucket": document["bucket"].isoformat(),
+                    "total": document.get("total", 0),
+                    **({"values": {_unfield(value): amount for value, amount in document["counts"].items()}} if document.get("counts") else {}),
+                }
+                for document in documents
+            ],
+        }
+
+    async def _backfill_day(self, day: datetime, source: str) -> int:
+        """Raise every rollup cell of one day to the visits recorded in visit_events; returns the visits counted."""
+        next_day = day + STEPS[DAY]
+        pipeline = [
+            {"$match": {"ts": {"$gte": day, "$lt": next_day}}},
+            {"$group": {
+                "_id": {
+                    "minute": {"$dateToString": {"format": "%Y%m%d%H%M", "date": "$ts"}},
+                    **{dimension: f"${field}" for dimension, field in DIMENSIONS.items() if field is not None},
+                },
+                "visits": {"$sum": 1},
+            }},
+        ]
+        cells: Cells = defaultdict(Counter)
+        visits = 0
+        async for group in get_collection(source).aggregate(pipeline, allowDiskUse=True):
+            key = group["_id"]
+            at = datetime.strptime(key.pop("minute"), "%Y%m%d%H%M")
+            _accumulate(cells, at, visit_dimensions(key), group["visits"])
+            visits += group["visits"]
+
+        now = datetime.utcnow()
+        # $max, not a replace: counts the live flush hook already wrote (including visits whose
+        # event was dropped) are never lowered, and re-running a day changes nothing
+        operations: List[Any] = []
+        for (granularity, bucket, dimension), counts in cells.items():
+            if not self._retained(granularity, bucket, now):
+                continue
+            maximums = {"total": sum(counts.values())}
+            if dimension != "all":
+                maximums.update({f"counts.{_field(value)}": amount for value, amount in counts.items()})
+            operations.append(UpdateOne(
+                {"_id": _doc_id(granularity, bucket, dimension)},
+                {"$max": maximums, "$setOnInsert": self._header(granularity, bucket, dimension)},
+                upsert=True
+            ))
+        if operations:
+            await get_collection(self.collection_name).bulk_write(operations, ordered=False)
+        return visits
+
+    async def backfill(self, start: datetime, end: datetime, workers: int = 4, source: str = "visit_events") -> Dict[str, Any]:
+        """Backfill rollups for the days overlapping [start, end) from visit events, several days at a time.
+
+        visit_events has one event per visit (visitor_logs only keeps each visitor's latest), so
+        only days still within VISIT_EVENTS_TTL can be backfilled: older days are skipped with a
+        warning and reported as skipped_days. Cells are only ever raised: live counts are kept,
+        and a visit flushed while its own day is being backfilled can be counted twice, so
+        prefer closed ranges.
+        """
+        first = floor_to(to_utc(start), DAY)
+        ttl = events_ttl() if source == VISIT_EVENTS else None
+        horizon = datetime.utcnow() - timedelta(seconds=ttl) if ttl else None
+        days = []
+        skipped = 0
+        day = first
+        while day < to_utc(end):
+            # Events of a day that ended before the horizon have all expired
+            if horizon is not None and day + STEPS[DAY] <= horizon:
+                skipped += 1
+            else:
+                days.append(day)
+            day += STEPS[DAY]
+        if skipped:
+            logger.warning(
+                f"Skipping {skipped} day(s) before {horizon:%Y-%m-%d}: their visit events have expired "
+                f"(VISIT_EVENTS_TTL), so they can't be backfilled"
+            )
+        semaphore = asyncio.Semaphore(max(1, workers))
+
+        async def rebuild(day: datetime) -> int:
+            async with semaphore:
+                visits = await self._backfill_day(day, source)
+                logger.info(f"Rebuilt rollups for {day:%Y-%m-%d}: {visits} visits")
+                return visits
+
+        started = time.perf_counter()
+        visits = await asyncio.gather(*(rebuild(day) for day in days))
+        return {
+            "days": len(days),
+            "skipped_days": skipped,
+            "visits": sum(visits),
+            "elapsed_s": round(time.perf_counter() - started, 2),
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        queries = self._stats["queries"]
+        return {
+            **self._stats,
+            "total_query_ms": round(self._stats["total_query_ms"], 2),
+            "avg_query_ms": round(self._stats["total_query_ms"] / queries, 2) if queries else 0.0,
+        }
+
+# Global rollup store instance
+rollups = RollupStore()
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain visit rollups")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill = subparsers.add_parser("backfill", help="Backfill rollups from the visit_events collection")
+    backfill.add_argument("--start", required=True, type=datetime.fromisoformat, help="First day (UTC), e.g. 2025-01-01")
+    backfill.add_argument("--end", type=datetime.fromisoformat, default=None, help="End (exclusive, UTC); defaults to now")
+    backfill.add_argument("--workers", type=int, default=4, help="Days rebuilt concurrently")
+    backfill.add_argument("--source", default="visit_events")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    from app.database.connection import close_mongo_connection, connect_to_mongo
+
+    async def run():
+        await connect_to_mongo()
+        try:
+            return await rollups.backfill(args.start, args.end or datetime.utcnow(), args.workers, args.source)
+        finally:
+            await close_mongo_connection()
+
+    print(json.dumps(asyncio.run(run()), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,37 @@
-from typing import List, Optional, Any, Dict
+from typing import List, Optional, Any, Dict, Tuple
+from fastapi import HTTPException, status
 from motor.motor_asyncio import AsyncIOMotorCollection
-from bson import ObjectId
+from bson import ObjectId, json_util
 from pymongo import ASCENDING, DESCENDING
+import hashlib
 import logging
-from app.core.utils import handle_database_errors
+from app.config import settings
+from app.core.utils import handle_database_errors, encode_cursor, decode_cursor
+from app.database.redis_client import redis_client
 from app.database.connection import get_collection
 from datetime import datetime
-from app.core.location_utils import get_location_from_coordinates  # Import reverse geocode function
+from app.core.ingest import IngestItem, ingest_queue
+from app.core.enrichment import geocode_enrichment
+from app.core.user_agent import parse_user_agent
+from app.core.fingerprint import compute_fingerprint_hash
+from app.core.ip_geo import ip_geo
+from app.core.profile_store import hot_location, profile_digest, profile_store
+from app.core.dictionary import value_dictionary
 import re
 
 logger = logging.getLogger(__name__)
 
+def _keyset_projection(projection: Optional[Dict[str, Any]], sort_field: str) -> Optional[Dict[str, Any]]:
+    """A projection that still returns what the next cursor is built from (_id and the sort field)."""
+    if not projection:
+        return projection
+    projection = {name: value for name, value in projection.items() if not (name == "_id" and not value)}
+    if any(value for name, value in projection.items() if name != "_id"):
+        projection[sort_field] = 1
+    else:
+        projection.pop(sort_field, None)
+    return projection or None
+
 class BaseService:
     """Base service class for common database operations."""
     
@@ -25,9 +46,9 @@ class BaseService:
         return created_doc
 
     @handle_database_errors
-    async def get_by_id(self, object_id: ObjectId) -> Optional[Dict[str, Any]]:
+    async def get_by_id(self, object_id: ObjectId, projection: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """Get document by ID."""
-        return await self.collection.find_one({"_id": object_id})
+        return await self.collection.find_one({"_id": object_id}, projection)
 
     @handle_database_errors
     async def get_all(
@@ -36,13 +57,62 @@ class BaseService:
         limit: int = 100,
         sort_field: str = "_id",
         sort_order: int = DESCENDING,
-        filter_dict: Optional[Dict[str, Any]] = None
+        filter_dict: Optional[Dict[str, Any]] = None,
+        projection: Optional[Dict[str, Any]] = None
     ) -> List[Dict[str, Any]]:
         """Get all documents with pagination and filtering."""
         query = filter_dict or {}
-        cursor = self.collection.find(query).sort(sort_field, sort_order).skip(skip).limit(limit)
+        cursor = self.collection.find(query, projection).sort(sort_field, sort_order).skip(skip).limit(limit)
         return await cursor.to_list(length=limit)
 
+    @handle_database_errors
+    async def get_page(
+        self,
+        limit: int = 100,
+        sort_field: str = "_id",
+        sort_order: int = DESCENDING,
+        cursor: Optional[str] = None,
+        skip: int = 0,
+        filter_dict: Optional[Dict[str, Any]] = None,
+        projection: Optional[Dict[str, Any]] = None
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """Keyset page after a cursor (or at skip without one), plus the cursor for the next page, None on the last."""
+        query = dict(filter_dict or {})
+        if cursor:
+            position = decode_cursor(cursor)
+            if position.get("f") != sort_field or position.get("o") != sort_order:
+                raise HTTPException(
+                    status_code=status.HTTP_400_BAD_REQUEST,
+                    detail="Cursor was issued for a different sort"
+                )
+            operator = "$gt" if sort_order == ASCENDING else "$lt"
+            value = position.get("v")
+            if sort_field == "_id":
+                after = {"_id": {operator: position["id"]}}
+            else:
+                # _id breaks ties so equal sort values are neither skipped nor repeated;
+                # {field: None} matches null and missing, which sort before every value
+                after = {"$or": [{sort_field: value, "_id": {operator: position["id"]}}]}
+                if value is None:
+                    if sort_order == ASCENDING:
+                        after["$or"].append({sort_field: {"$ne": None}})
+                else:
+                    after["$or"].append({sort_field: {operator: value}})
+                    if sort_order != ASCENDING:
+                        after["$or"].append({sort_field: None})
+            query = {"$and": [query, after]} if query else after
+        sort = [(sort_field, sort_order)] if sort_field == "_id" else [(sort_field, sort_order), ("_id", sort_order)]
+        find = self.collection.find(query, _keyset_projection(projection, sort_field)).sort(sort)
+        if not cursor and skip:
+            find = find.skip(skip)
+        # One extra document tells whether another page exists
+        documents = await find.limit(limit + 1).to_list(length=limit + 1)
+        if len(documents) <= limit:
+            return documents, None
+        documents = documents[:limit]
+        last = documents[-1]
+        return documents, encode_cursor({"f": sort_field, "o": sort_order, "v": last.get(sort_field), "id": last["_id"]})
+
     @handle_database_errors
     async def update(self, object_id: ObjectId, data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Update document by ID."""
@@ -56,9 +126,21 @@ class BaseService:
         return result.deleted_count > 0
 
     @handle_database_errors
-    async def count(self, filter_dict: Optional[Dict[str, Any]] = None) -> int:
-        """Count documents matching filter."""
+    async def count(self, filter_dict: Optional[Dict[str, Any]] = None, mode: str = "exact") -> int:
+        """Count documents matching filter: exact, estimated (collection metadata) or cached (exact, reused briefly)."""
         query = filter_dict or {}
+        if mode == "estimated" and not query:
+            return await self.collection.estimated_document_count()
+        if mode in ("estimated", "cached"):
+            # Metadata counts can't apply a filter, so a filtered estimate falls back to the cache
+            digest = hashlib.blake2b(json_util.dumps(query, sort_keys=True).encode("utf-8"), digest_size=8).hexdigest()
+            key = f"count:{self.collection.name}:{digest}"
+            cached = await redis_client.get(key)
+            if cached is not None:
+                return int(cached)
+            total = await self.collection.count_documents(query)
+            await redis_client.set(key, total, ttl=settings.pagination_count_cache_ttl)
+            return total
         return await self.collection.count_documents(query)
 
     @handle_database_errors
@@ -68,9 +150,9 @@ class BaseService:
         return count > 0
 
     @handle_database_errors
-    async def find_one(self, filter_dict: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    async def find_one(self, filter_dict: Dict[str, Any], projection: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
         """Find one document by filter."""
-        return await self.collection.find_one(filter_dict)
+        return await self.collection.find_one(filter_dict, projection)
 
     @handle_database_errors
     async def find_many(
@@ -79,54 +161,71 @@ class BaseService:
         skip: int = 0,
         limit: int = 100,
         sort_field: str = "_id",
-        sort_order: int = DESCENDING
+        sort_order: int = DESCENDING,
+        projection: Optional[Dict[str, Any]] = None
     ) -> List[Dict[str, Any]]:
         """Find many documents by filter."""
-        cursor = self.collection.find(filter_dict).sort(sort_field, sort_order).skip(skip).limit(limit)
+        cursor = self.collection.find(filter_dict, projection).sort(sort_field, sort_order).skip(skip).limit(limit)
         return await cursor.to_list(length=limit)
 
 async def log_visitor_profile(ip: str, profile: dict, real_ip: str = None):
-    collection = get_collection("visitor_logs")
     visitor_id = profile.get('visitor_id')
     visit_count = profile.get('visit_count', 1)
     user_agent = profile.get('navigator', {}).get('ua', '')
-    browser = detect_browser(user_agent)
+    user_agent_info = parse_user_agent(user_agent)
     gps = profile.get('loc', {}).get('gps')
-    address = None
-    if gps and 'latitude' in gps and 'longitude' in gps:
-        location_data = await get_location_from_coordinates(gps['latitude'], gps['longitude'])
-        address = location_data.get('combined') or location_data.get('display_name')
-        gps['address'] = address
+    # Local database only: a remote lookup has no place on the ingest path
+    location = ip_geo.lookup(ip) or {}
+    now = datetime.utcnow()
     # Upsert logic: increment visit_count for existing visitor_id
     doc_update = {
-        "profile": profile,
-        "browser": browser,
-        "created_at": datetime.utcnow()
+        **user_agent_info.as_dict(),
+        **hot_location(profile),
+        **value_dictionary.ids(profile),
+        "created_at": now,
+        "last_seen": now,
+        "profile_digest": profile_digest(profile)
+    }
+    if not profile_store.enabled:
+        doc_update["profile"] = profile
+    fingerprint_hash = compute_fingerprint_hash(profile)
+    if fingerprint_hash:
+        doc_update["fingerprint_hash"] = fingerprint_hash
+    if location.get('countryCode'):
+        doc_update["country"] = location['countryCode']
+    coordinates = gps if gps and 'latitude' in gps and 'longitude' in gps else location
+    # Counted by the unique counters and visit events once the write is applied
+    visit = {
+        "at": now,
+        "visitor_id": visitor_id,
+        "ip": ip,
+        "fingerprint_hash": fingerprint_hash,
+        "site": ((profile.get('session') or {}).get('host') or '').lower() or None,
+        "country": location.get('countryCode'),
+        "browser": user_agent_info.browser,
+        "os": user_agent_info.os,
+        "device_type": user_agent_info.device_type,
+        "latitude": coordinates.get('latitude'),
+        "longitude": coordinates.get('longitude'),
     }
     if visitor_id:
-        result = await collection.find_one_and_update(
-            {"visitor_id": visitor_id},
-            {"$set": doc_update, "$inc": {"visit_count": 1}},
-            upsert=True,
-            return_document=True
+        item = IngestItem(
+            filter={"visitor_id": visitor_id},
+            set_fields=doc_update,
+            inc={"visit_count": 1},
+            profile=profile,
+            visits=[visit]
         )
     else:
+        # Anonymous visits get their own document, keyed by a pre-allocated _id
         doc_update["visit_count"] = visit_count
-        await collection.insert_one(doc_update)
+        item = IngestItem(filter={"_id": ObjectId()}, set_fields=doc_update, profile=profile, visits=[visit])
+    # Written behind by the ingest queue's batched flusher; the full profile rides along to cold storage
+    await ingest_queue.submit(item)
+    # Coarse coordinates are stored now; the address is patched in once resolved
+    if gps and 'latitude' in gps and 'longitude' in gps:
+        geocode_enrichment.submit(gps['latitude'], gps['longitude'], item.filter)
 
 def detect_browser(user_agent):
-    # Simple user agent parser for major browsers
-    if 'Edg/' in user_agent:
-        return 'Edge'
-    elif 'OPR/' in user_agent or 'Opera' in user_agent:
-        return 'Opera'
-    elif 'Chrome/' in user_agent and 'Chromium' not in user_agent:
-        return 'Chrome'
-    elif 'Firefox/' in user_agent:
-        return 'Firefox'
-    elif 'Safari/' in user_agent and 'Chrome/' not in user_agent:
-        return 'Safari'
-    elif 'Chromium' in user_agent:
-        return 'Chromium'
-    else:
-        return 'Other'
+    """Browser family name for a UA string."""
+    return parse_user_agent(user_agent or "").browser
@@ -0,0 +1,305 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+import numpy as np
+from pymongo import UpdateOne
+from app.config import settings
+from app.core.fingerprint import COMPONENT_EXTRACTORS, canonical_components
+from app.core.ingest import IngestItem, ingest_queue
+from app.database.connection import get_collection
+from app.database.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+MAX_HASH = np.uint64((1 << 32) - 1)
+
+def _flatten(prefix: str, value: Any, tokens: Set[str]):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}", item, tokens)
+    elif isinstance(value, list):
+        for item in value:
+            _flatten(prefix, item, tokens)
+    elif value is not None:
+        tokens.add(f"{prefix}={value}")
+
+def feature_set(profile: Dict[str, Any]) -> Set[str]:
+    """Attribute tokens of a collected profile: fonts, features, plugins, voices and the stable fingerprint components."""
+    tokens: Set[str] = set()
+    for name, value in canonical_components(profile, list(COMPONENT_EXTRACTORS)).items():
+        _flatten(name, value, tokens)
+    features = profile.get("features")
+    if isinstance(features, dict):
+        for name, value in features.items():
+            if not isinstance(value, (dict, list)):
+                tokens.add(f"feature.{name}={value}")
+    navigator = profile.get("navigator") or {}
+    for plugin in profile.get("plugins") or navigator.get("plugins") or []:
+        tokens.add(f"plugin={plugin.get('name') if isinstance(plugin, dict) else plugin}")
+    voices = profile.get("speechVoices")
+    if isinstance(voices, list):
+        for voice in voices:
+            tokens.add(f"voice={voice.get('name') if isinstance(voice, dict) else voice}")
+    for name in ("plat", "lang"):
+        if navigator.get(name):
+            tokens.add(f"navigator.{name}={navigator[name]}")
+    for lang in navigator.get("langs") or []:
+        tokens.add(f"navigator.langs={lang}")
+    return tokens
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+class MinHasher:
+    """MinHash signatures with banded LSH keys (num_perm = bands * rows)."""
+
+    def __init__(self, num_perm: int, bands: int, seed: int = 1):
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be a multiple of bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        # Fixed seed: signatures must agree across workers and restarts
+        rng = np.random.RandomState(seed)
+        self.a = rng.randint(1, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+        self.b = rng.randint(0, int(MERSENNE_PRIME), size=num_perm, dtype=np.uint64)
+
+    @staticmethod
+    def _token_hashes(tokens: Iterable[str]) -> np.ndarray:
+        return np.array(
+            [int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=4).digest(), "little") for token in tokens],
+            dtype=np.uint64
+        )
+
+    def signature(self, tokens: Set[str]) -> np.ndarray:
+        """Per-permutation minimum of (a*x + b) mod p over the token hashes."""
+        signature = np.full(self.num_perm, MAX_HASH, dtype=np.uint64)
+        if not tokens:
+            return signature
+        hashes = self._token_hashes(tokens)
+        with np.errstate(over="ignore"):
+            permuted = (np.outer(self.a, hashes) + self.b[:, None]) % MERSENNE_PRIME & MAX_HASH
+        return permuted.min(axis=1)
+
+    def band_keys(self, signature: np.ndarray) -> List[str]:
+        """One bucket key per band; devices sharing any bucket become candidates."""
+        rows = signature.astype("<u4").reshape(self.bands, self.rows)
+        return [f"{band}:{hashlib.blake2b(row.tobytes(), digest_size=8).hexdigest()}" for band, row in enumerate(rows)]
+
+    @staticmethod
+    def similarity(a: np.ndarray, b: np.ndarray) -> float:
+        """Estimated Jaccard similarity: fraction of agreeing signature positions."""
+        return float(np.mean(a == b))
+
+    @staticmethod
+    def encode(signature: np.ndarray) -> str:
+        return signature.astype("<u4").tobytes().hex()
+
+    @staticmethod
+    def decode(encoded: str) -> np.ndarray:
+        return np.frombuffer(bytes.fromhex(encoded), dtype="<u4").astype(np.uint64)
+
+class SimilarityIndex:
+    """Incremental MinHash/LSH index of device attribute sets, stored in Redis sets."""
+
+    def __init__(self, prefix: str = "lsh"):
+        self.prefix = prefix
+        self.hasher = MinHasher(settings.similarity_num_perm, settings.similarity_bands, settings.similarity_seed)
+        # Visitors whose similar count is due, by visitor_id: (visitor_logs filter, signature)
+        self._pending: Dict[str, Tuple[Dict[str, Any], np.ndarray]] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "indexed": 0,
+            "refreshed": 0,
+            "queries": 0,
+            "candidates": 0,
+            "capped_queries": 0,
+            "total_query_ms": 0.0,
+            "counts_written": 0,
+            "counts_dropped": 0,
+        }
+
+    def _bucket_key(self, band_key: str) -> str:
+        return f"{self.prefix}:b:{band_key}"
+
+    def _signature_key(self, visitor_id: str) -> str:
+        return f"{self.prefix}:sig:{visitor_id}"
+
+    async def add(self, visitor_id: str, profile: Dict[str, Any]) -> Optional[np.ndarray]:
+        """Index (or re-index) one visitor, moving it out of buckets its new signature no longer hashes to."""
+        tokens = feature_set(profile)
+        if not tokens:
+            return None
+        signature = self.hasher.signature(tokens)
+        bands = self.hasher.band_keys(signature)
+        # Signatures bypass the L1 tier: every ingest rewrites them, and caching them
+        # would fill L1 and broadcast an invalidation to every worker per visit
+        signature_key = self._signature_key(visitor_id)
+        previous = (await redis_client.get_many([signature_key]))[0]
+        stale = set(self.hasher.band_keys(self.hasher.decode(previous))) - set(bands) if previous else set()
+        # Always rewrite so a returning visitor's entries don't expire
+        await redis_client.move_member(
+            visitor_id,
+            add_keys=[self._bucket_key(band_key) for band_key in bands],
+            remove_keys=[self._bucket_key(band_key) for band_key in stale],
+            ttl=settings.similarity_ttl,
+            values={signature_key: self.hasher.encode(signature)}
+        )
+        self._stats["indexed"] += 1
+        return signature
+
+    async def touch(self, visitor_ids: List[str]):
+        """Refresh the expiry of unchanged visitors' signatures and buckets without re-hashing them."""
+        signature_keys = [self._signature_key(visitor_id) for visitor_id in visitor_ids]
+        keys = list(signature_keys)
+        for encoded in await redis_client.get_many(signature_keys):
+            if encoded:
+                keys.extend(self._bucket_key(band_key) for band_key in self.hasher.band_keys(self.hasher.decode(encoded)))
+        await redis_client.expire_many(keys, ttl=settings.similarity_ttl)
+        self._stats["refreshed"] += len(visitor_ids)
+
+    async def signature_for(self, visitor_id: str) -> Optional[np.ndarray]:
+        encoded = (await redis_client.get_many([self._signature_key(visitor_id)]))[0]
+        return self.hasher.decode(encoded) if encoded else None
+
+    async def query(
+        self,
+        signature: np.ndarray,
+        k: Optional[int] = None,
+        threshold: Optional[float] = None,
+        exclude: Optional[str] = None
+    ) -> List[Tuple[str, float]]:
+        """Top-k (visitor_id, estimated similarity) among LSH candidates, best first."""
+        k = k or settings.similarity_top_k
+        threshold = settings.similarity_threshold if threshold is None else threshold
+        start = time.perf_counter()
+        bands = self.hasher.band_keys(signature)
+        # Oversized buckets (very common configurations) are sampled so a query stays sub-linear
+        buckets = await redis_client.smembers_many([self._bucket_key(band_key) for band_key in bands], limit=settings.similarity_max_bucket)
+        shared = Counter(member for bucket in buckets for member in bucket if member != exclude)
+        if len(shared) > settings.similarity_max_candidates:
+            # Sharing more bands means more agreeing positions, so those are compared first
+            candidates = sorted(member for member, _ in shared.most_common(settings.similarity_max_candidates))
+            self._stats["capped_queries"] += 1
+        else:
+            candidates = sorted(shared)
+        scored: List[Tuple[str, float]] = []
+        if candidates:
+            encoded = await redis_client.get_many([self._signature_key(candidate) for candidate in candidates])
+            for candidate, value in zip(candidates, encoded):
+                if not value:
+                    continue
+                score = self.hasher.similarity(signature, self.hasher.decode(value))
+                if score >= threshold:
+                    scored.append((candidate, round(score, 4)))
+        scored.sort(key=lambda pair: pair[1], reverse=True)
+        self._stats["queries"] += 1
+        self._stats["candidates"] += len(candidates)
+        self._stats["total_query_ms"] += (time.perf_counter() - start) * 1000
+        return scored[:k]
+
+    async def similar_to_visitor(self, visitor_id: str, k: Optional[int] = None, threshold: Optional[float] = None) -> Optional[List[Tuple[str, float]]]:
+        signature = await self.signature_for(visitor_id)
+        if signature is None:
+            return None
+        return await self.query(signature, k, threshold, exclude=visitor_id)
+
+    async def similar_to_profile(self, profile: Dict[str, Any], k: Optional[int] = None, threshold: Optional[float] = None) -> List[Tuple[str, float]]:
+        return await self.query(self.hasher.signature(feature_set(profile)), k, threshold, exclude=profile.get("visitor_id"))
+
+    async def start(self):
+        """Index visitors as the ingest queue flushes them, and start the similar-count updater."""
+        if not settings.similarity_enabled or self._task is not None:
+            return
+        ingest_queue.add_flush_hook(self.on_flush)
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the updater and write whatever counts are still queued."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=settings.similarity_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def _index_item(self, item: IngestItem):
+        visitor_id = item.filter["visitor_id"]
+        signature = await self.add(visitor_id, item.profile)
+        if signature is None:
+            return
+        if visitor_id not in self._pending and len(self._pending) >= settings.similarity_max_pending * 10:
+            # Redis or MongoDB has been slow for a while: don't grow without bound
+            self._stats["counts_dropped"] += 1
+            return
+        self._pending[visitor_id] = (item.filter, signature)
+
+    async def on_flush(self, items: List[IngestItem]):
+        """Ingest flush hook: index visitors whose profile changed and queue their similar-device count."""
+        if not redis_client.connected:
+            return
+        items = [item for item in items if item.filter.get("visitor_id") and item.profile is not None]
+        # Items in a flushed batch are already coalesced to one per visitor
+        unchanged = [item.filter["visitor_id"] for item in items if not item.profile_changed]
+        if unchanged:
+            # Same signature and buckets as last time: only keep them from expiring
+            await self.touch(unchanged)
+        await asyncio.gather(*(self._index_item(item) for item in items if item.profile_changed))
+        if self._wake is not None and len(self._pending) >= settings.similarity_max_pending:
+            self._wake.set()
+
+    async def _count_update(self, visitor_id: str, visitor_filter: Dict[str, Any], signature: np.ndarray) -> UpdateOne:
+        similar = await self.query(signature, exclude=visitor_id)
+        return UpdateOne(visitor_filter, {"$set": {
+            "similar_fingerprints": len(similar),
+            "similarity_score": similar[0][1] if similar else 0.0,
+        }}, upsert=False)
+
+    async def flush(self):
+        """Query the queued visitors' similar devices and write the counts with one unordered bulk_write."""
+        pending, self._pending = self._pending, {}
+        if not pending or not redis_client.connected:
+            return
+        updates = await asyncio.gather(*(
+            self._count_update(visitor_id, visitor_filter, signature) for visitor_id, (visitor_filter, signature) in pending.items()
+        ))
+        try:
+            await get_collection("visitor_logs").bulk_write(updates, ordered=False)
+        except Exception as e:
+            # The counts are refreshed on the visitor's next changed profile
+            self._stats["counts_dropped"] += len(updates)
+            logger.error(f"Writing {len(updates)} similar-device counts failed: {e}")
+            return
+        self._stats["counts_written"] += len(updates)
+
+    def stats(self) -> Dict[str, Any]:
+        queries = self._stats["queries"]
+        return {
+            **self._stats,
+            "total_query_ms": round(self._stats["total_query_ms"], 2),
+            "avg_query_ms": round(self._stats["total_query_ms"] / queries, 2) if queries else 0.0,
+            "avg_candidates": round(self._stats["candidates"] / queries, 2) if queries else 0.0,
+            "pending": len(self._pending),
+            "running": self._task is not None,
+            "num_perm": self.hasher.num_perm,
+            "bands": self.hasher.bands,
+        }
+
+# Global similarity index instance
+similarity_index = SimilarityIndex()
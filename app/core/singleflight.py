@@ -0,0 +1,117 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+from app.config import settings
+from app.database.redis_client import redis_client
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+class SingleFlight:
+    """Collapse concurrent calls for the same key into one execution.
+
+    Within a worker, callers await the in-flight future. Across workers, a short
+    Redis lock elects one leader and the others poll `wait_for` (normally the
+    cache the leader writes) until it produces a value or the lock goes away.
+    `wait_for` is called repeatedly, so it should read without recording cache stats.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._stats = {
+            "calls": 0,
+            "executions": 0,
+            "collapsed_local": 0,
+            "collapsed_remote": 0,
+            "lock_wait_timeouts": 0,
+        }
+
+    def _lock_key(self, key: str) -> str:
+        return f"singleflight:{self.name}:{key}"
+
+    async def do(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[T]],
+        wait_for: Optional[Callable[[], Awaitable[Optional[T]]]] = None
+    ) -> T:
+        """Run fn once per key at a time; concurrent callers share its result."""
+        self._stats["calls"] += 1
+        future = self._calls.get(key)
+        if future is not None:
+            self._stats["collapsed_local"] += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if future.cancelled():
+                    # The leader was cancelled, not us: take over
+                    return await self.do(key, fn, wait_for)
+                raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await self._execute(key, fn, wait_for)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
+
+    async def _execute(
+        self,
+        key: str,
+        fn: Callable[[], Awaitable[T]],
+        wait_for: Optional[Callable[[], Awaitable[Optional[T]]]]
+    ) -> T:
+        if wait_for is None or not settings.singleflight_distributed or not redis_client.connected:
+            self._stats["executions"] += 1
+            return await fn()
+
+        lock_key = self._lock_key(key)
+        token = await redis_client.acquire_lock(lock_key, settings.singleflight_lock_ttl_ms)
+        if token is None and await redis_client.exists(lock_key):
+            # Another worker is already resolving this key
+            result = await self._wait_for_leader(lock_key, wait_for)
+            if result is not None:
+                self._stats["collapsed_remote"] += 1
+                return result
+
+        self._stats["executions"] += 1
+        try:
+            return await fn()
+        finally:
+            if token is not None:
+                await redis_client.release_lock(lock_key, token)
+
+    async def _wait_for_leader(self, lock_key: str, wait_for: Callable[[], Awaitable[Any]]) -> Optional[Any]:
+        deadline = time.monotonic() + settings.singleflight_wait_timeout
+        while time.monotonic() < deadline:
+            await asyncio.sleep(settings.singleflight_poll_interval)
+            result = await wait_for()
+            if result is not None:
+                return result
+            if not await redis_client.exists(lock_key):
+                # Leader finished without leaving a result (e.g. it failed): run it ourselves
+                return await wait_for()
+        self._stats["lock_wait_timeouts"] += 1
+        return None
+
+    def stats(self) -> Dict[str, Any]:
+        collapsed = self._stats["collapsed_local"] + self._stats["collapsed_remote"]
+        return {
+            **self._stats,
+            "collapsed": collapsed,
+            "in_flight": len(self._calls),
+        }
@@ -0,0 +1,144 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+from app.config import settings
+
+# Every "Product/version" token in a UA string, scanned once
+_TOKEN_RE = re.compile(r"([A-Za-z][A-Za-z0-9]*)/([0-9][0-9A-Za-z._]*)")
+
+# Browser families by token, in priority order: most UAs carry several of these
+# (every Chrome UA also says Safari, every Edge UA also says Chrome)
+BROWSER_TOKENS: List[Tuple[str, str]] = [
+    ("EdgA", "Edge"),
+    ("EdgiOS", "Edge"),
+    ("Edg", "Edge"),
+    ("Edge", "Edge"),
+    ("OPR", "Opera"),
+    ("OPiOS", "Opera"),
+    ("SamsungBrowser", "Samsung Internet"),
+    ("YaBrowser", "Yandex"),
+    ("Vivaldi", "Vivaldi"),
+    ("UCBrowser", "UC Browser"),
+    ("FxiOS", "Firefox"),
+    ("Firefox", "Firefox"),
+    ("CriOS", "Chrome"),
+    ("Chromium", "Chromium"),
+    ("HeadlessChrome", "Chrome"),
+    ("Chrome", "Chrome"),
+]
+_IE_RE = re.compile(r"MSIE ([\d.]+)|Trident/.*?rv:([\d.]+)")
+
+# Operating systems, in priority order (Android UAs also say Linux, iPad UAs also say Mac OS X)
+OS_PATTERNS: List[Tuple[str, "re.Pattern"]] = [
+    ("Windows", re.compile(r"Windows NT ([\d.]+)")),
+    ("iOS", re.compile(r"(?:iPhone|iPad|iPod)(?:.*? OS ([\d_]+))?")),
+    ("Android", re.compile(r"Android(?: ([\d.]+))?")),
+    ("Chrome OS", re.compile(r"CrOS \w+ ([\d.]+)")),
+    ("macOS", re.compile(r"Mac OS X(?: ([\d_.]+))?")),
+    ("Linux", re.compile(r"Linux")),
+]
+WINDOWS_VERSIONS = {"10.0": "10", "6.3": "8.1", "6.2": "8", "6.1": "7", "6.0": "Vista", "5.1": "XP"}
+
+# Matched against the lower-cased UA (plain substring checks beat an IGNORECASE alternation)
+BOT_TOKENS = ("crawl", "spider", "slurp", "headless", "lighthouse", "facebookexternalhit", "curl", "wget", "python-requests")
+# "bot" only as its own word (bot, -bot, /bot.html) or a product token (Googlebot/2.1, AdsBot-Google),
+# not inside device names such as "CUBOT X30"
+_BOT_RE = re.compile(r"(?:^|[^a-z])bot(?:[^a-z]|$)|[a-z]bot[/_;-]")
+TABLET_TOKENS = ("iPad", "Tablet", "Kindle", "Silk", "PlayBook")
+MOBILE_TOKENS = ("Mobi", "iPhone", "iPod", "Windows Phone", "Opera Mini")
+
+class UserAgentInfo(NamedTuple):
+    """Parsed UA; immutable because cached instances are shared between requests."""
+    browser: str = "Other"
+    browser_version: Optional[str] = None
+    os: Optional[str] = None
+    os_version: Optional[str] = None
+    device_type: str = "desktop"
+    engine: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return self._asdict()
+
+def _detect_os(user_agent: str) -> Tuple[Optional[str], Optional[str]]:
+    for name, pattern in OS_PATTERNS:
+        match = pattern.search(user_agent)
+        if match:
+            version = match.group(1) if match.groups() else None
+            if version:
+                version = version.replace("_", ".")
+                if name == "Windows":
+                    version = WINDOWS_VERSIONS.get(version, version)
+            return name, version
+    return None, None
+
+def _detect_browser(user_agent: str, tokens: Dict[str, str]) -> Tuple[str, Optional[str]]:
+    for token, family in BROWSER_TOKENS:
+        if token in tokens:
+            return family, tokens[token]
+    if "Opera" in tokens or "Opera" in user_agent:
+        return "Opera", tokens.get("Version") or tokens.get("Opera")
+    if "Safari" in tokens:
+        return "Safari", tokens.get("Version")
+    match = _IE_RE.search(user_agent) if "MSIE" in user_agent or "Trident" in user_agent else None
+    if match:
+        return "Internet Explorer", match.group(1) or match.group(2)
+    return "Other", None
+
+def _detect_engine(browser: str, os_name: Optional[str], tokens: Dict[str, str]) -> Optional[str]:
+    if os_name == "iOS":
+        # Every iOS browser is required to use WebKit
+        return "WebKit"
+    if "Edge" in tokens:
+        return "EdgeHTML"
+    if "Chrome" in tokens or "Chromium" in tokens or "HeadlessChrome" in tokens:
+        return "Blink"
+    if "Presto" in tokens:
+        return "Presto"
+    if "Trident" in tokens or browser == "Internet Explorer":
+        return "Trident"
+    if "Gecko" in tokens and browser == "Firefox":
+        return "Gecko"
+    if "AppleWebKit" in tokens:
+        return "WebKit"
+    return None
+
+def _detect_device(user_agent: str, os_name: Optional[str]) -> str:
+    lowered = user_agent.lower()
+    if any(token in lowered for token in BOT_TOKENS) or _BOT_RE.search(lowered):
+        return "bot"
+    if any(token in user_agent for token in TABLET_TOKENS) or (os_name == "Android" and "Mobile" not in user_agent):
+        return "tablet"
+    if any(token in user_agent for token in MOBILE_TOKENS):
+        return "mobile"
+    return "desktop"
+
+@lru_cache(maxsize=settings.user_agent_cache_size)
+def parse_user_agent(user_agent: str) -> UserAgentInfo:
+    """Browser, OS, device type and engine for a raw UA string (cached: real traffic repeats a few UAs)."""
+    if not user_agent:
+        return UserAgentInfo()
+    tokens: Dict[str, str] = {}
+    for name, version in _TOKEN_RE.findall(user_agent):
+        # First occurrence wins
+        tokens.setdefault(name, version)
+    os_name, os_version = _detect_os(user_agent)
+    browser, browser_version = _detect_browser(user_agent, tokens)
+    return UserAgentInfo(
+        browser=browser,
+        browser_version=browser_version,
+        os=os_name,
+        os_version=os_version,
+        device_type=_detect_device(user_agent, os_name),
+        engine=_detect_engine(browser, os_name, tokens),
+    )
+
+def stats() -> Dict[str, Any]:
+    info = parse_user_agent.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        "hits": info.hits,
+        "misses": info.misses,
+        "hit_ratio": round(info.hits / lookups, 4) if lookups else 0.0,
+        "size": info.currsize,
+        "max_size": info.maxsize,
+    }
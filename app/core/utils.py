@@ -1,7 +1,8 @@
 from fastapi import HTTPException, status
 from typing import Any, Dict, List, Optional, Union
-from bson import ObjectId
+from bson import ObjectId, json_util
 from datetime import datetime
+import base64
 import logging
 
 logger = logging.getLogger(__name__)
@@ -70,6 +71,8 @@ def handle_database_errors(func):
     async def wrapper(*args, **kwargs):
         try:
             return await func(*args, **kwargs)
+        except HTTPException:
+            raise
         except Exception as e:
             logger.error(f"Database error in {func.__name__}: {str(e)}")
             raise HTTPException(
@@ -87,3 +90,25 @@ def validate_object_id(object_id: str) -> ObjectId:
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid ObjectId format"
         )
+
+def encode_cursor(position: Dict[str, Any]) -> str:
+    """Opaque pagination cursor (URL-safe; keeps ObjectId and datetime types)."""
+    return base64.urlsafe_b64encode(json_util.dumps(position).encode("utf-8")).decode("ascii").rstrip("=")
+
+# Types a cursor position may hold; anything else (e.g. a {"$ne": ...} document) is rejected
+CURSOR_SCALARS = (type(None), bool, int, float, str, datetime, ObjectId)
+
+def decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Decode a cursor from encode_cursor, accepting only scalar positions."""
+    try:
+        position = json_util.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8"))
+        if not isinstance(position, dict):
+            raise ValueError("cursor is not an object")
+        if not all(isinstance(position.get(key), CURSOR_SCALARS) for key in ("v", "id")):
+            raise ValueError("cursor position is not a scalar")
+        return position
+    except Exception:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid pagination cursor"
+        )
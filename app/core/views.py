@@ -0,0 +1,81 @@
+from typing import Any, Dict, List, Optional
+
+FULL_VIEW = "full"
+
+# Named projections per collection; "full" (no projection) is always available
+VIEWS: Dict[str, Dict[str, Dict[str, int]]] = {
+    "visitor_logs": {
+        # List rows: identity, counters and parsed UA fields, without the raw profile blob
+        "summary": {
+            "_id": 0,
+            "visitor_id": 1,
+            "visit_count": 1,
+            "created_at": 1,
+            "last_seen": 1,
+            "browser": 1,
+            "browser_version": 1,
+            "os": 1,
+            "device_type": 1,
+            "country": 1,
+            "fingerprint_hash": 1,
+            "location": 1,
+        },
+        # Device matching results; the components themselves live in the cold profile (visitor_profiles)
+        "fingerprint": {
+            "visitor_id": 1,
+            "fingerprint_hash": 1,
+            "similar_fingerprints": 1,
+            "similarity_score": 1,
+        },
+    },
+}
+
+def register_view(collection_name: str, name: str, projection: Dict[str, int]):
+    """Add (or replace) a named projection for a collection."""
+    if name == FULL_VIEW:
+        raise ValueError(f"'{FULL_VIEW}' is reserved for whole documents")
+    VIEWS.setdefault(collection_name, {})[name] = projection
+
+def view_names(collection_name: str) -> List[str]:
+    return [FULL_VIEW] + sorted(VIEWS.get(collection_name, {}))
+
+def _split(fields: Optional[str]) -> List[str]:
+    return [field.strip() for field in (fields or "").split(",") if field.strip()]
+
+def build_projection(
+    collection_name: str,
+    view: Optional[str] = None,
+    fields: Optional[str] = None,
+    exclude: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """MongoDB projection for a named view narrowed or widened by comma-separated fields/exclude; None means whole documents."""
+    include_fields, exclude_fields = _split(fields), _split(exclude)
+    if view and view != FULL_VIEW:
+        if view not in VIEWS.get(collection_name, {}):
+            raise ValueError(f"Unknown view '{view}' for {collection_name} (available: {', '.join(view_names(collection_name))})")
+        projection: Dict[str, Any] = dict(VIEWS[collection_name][view])
+    else:
+        projection = {}
+    for field in include_fields + exclude_fields:
+        if field.startswith("$"):
+            raise ValueError(f"Invalid field name '{field}'")
+
+    inclusive = any(value for name, value in projection.items() if name != "_id")
+    if include_fields:
+        if projection and not inclusive:
+            raise ValueError("fields can't be combined with an exclusion view")
+        projection.update({field: 1 for field in include_fields})
+        inclusive = True
+    if exclude_fields:
+        if inclusive:
+            # Excluding from an inclusion projection just drops those fields from it (_id is the exception MongoDB allows)
+            for field in exclude_fields:
+                if field == "_id":
+                    projection["_id"] = 0
+                else:
+                    projection.pop(field, None)
+            if not any(value for name, value in projection.items() if name != "_id"):
+                raise ValueError("Projection excludes every included field")
+        else:
+            projection.update({field: 0 for field in exclude_fields})
+    return projection or None
@@ -0,0 +1,279 @@
+"""
+Per-visit history in a MongoDB time-series collection.
+
+visitor_logs keeps one document per visitor with its latest visit, so every visit is
+also appended to visit_events as a slim event: ts, visitor_id (the series key, stored
+as the metaField), ip, fingerprint_hash, cell (a geohash of the GPS or IP location),
+browser, os, device_type and country. MongoDB groups a visitor's events into compressed
+buckets whose span follows VISIT_EVENTS_GRANULARITY, and drops whole buckets after
+VISIT_EVENTS_TTL (by default the anonymization window, as events keep raw IPs).
+The IP is stored for that window but is never returned, filtered or grouped on by queries.
+Events are buffered in process and inserted in batches; the collection is created at
+startup and its expiry (and a coarser granularity) are brought in line with the settings.
+"""
+
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from app.config import settings
+from app.core.cardinality import to_utc
+from app.core.geo_cache import geohash_encode
+from app.core.ingest import IngestItem, ingest_queue
+from app.database.connection import get_collection, get_database
+
+logger = logging.getLogger(__name__)
+
+COLLECTION = "visit_events"
+TIME_FIELD = "ts"
+META_FIELD = "visitor_id"
+# Finest first; MongoDB can only make an existing collection's granularity coarser
+GRANULARITIES = ("seconds", "minutes", "hours")
+# Fields a range scan can filter and a histogram can group by
+FILTER_FIELDS = ("visitor_id", "fingerprint_hash", "cell", "browser", "os", "device_type", "country")
+# Left out of every event a query returns (raw IPs stay in the database until the events expire)
+EVENT_PROJECTION = {"_id": 0, "ip": 0}
+HISTOGRAM_UNITS = ("minute", "hour", "day", "week", "month")
+
+def events_ttl() -> Optional[int]:
+    """Seconds events are kept (None: forever)."""
+    if settings.visit_events_ttl is not None:
+        return settings.visit_events_ttl or None
+    # Events hold raw IPs, so by default they don't outlive the anonymization window
+    days = settings.anonymize_after_days or settings.data_retention_days
+    return days * 86400 if days > 0 else None
+
+class VisitEventLog:
+    """Buffered appends to, and queries over, the visit_events time-series collection."""
+
+    def __init__(self, collection_name: str = COLLECTION):
+        self.collection_name = collection_name
+        self.granularity = settings.visit_events_granularity
+        if self.granularity not in GRANULARITIES:
+            logger.warning(f"Unknown visit event granularity '{self.granularity}', falling back to 'minutes'")
+            self.granularity = "minutes"
+        self._pending: List[Dict[str, Any]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stats = {
+            "recorded": 0,
+            "flushes": 0,
+            "inserted": 0,
+            "dropped": 0,
+            "queries": 0,
+            "collection": None,
+        }
+
+    def record(
+        self,
+        visitor: str,
+        ip: Optional[str] = None,
+        fingerprint_hash: Optional[str] = None,
+        latitude: Optional[float] = None,
+        longitude: Optional[float] = None,
+        browser: Optional[str] = None,
+        country: Optional[str] = None,
+        at: Optional[datetime] = None,
+        os: Optional[str] = None,
+        device_type: Optional[str] = None
+    ):
+        """Buffer one visit; it is inserted with the next periodic flush."""
+        if not settings.visit_events_enabled:
+            return
+        if len(self._pending) >= settings.visit_events_max_pending * 10:
+            # MongoDB has been unreachable for a while: don't grow without bound
+            self._stats["dropped"] += 1
+            return
+        event: Dict[str, Any] = {TIME_FIELD: at or datetime.utcnow(), META_FIELD: visitor}
+        if isinstance(latitude, (int, float)) and isinstance(longitude, (int, float)):
+            event["cell"] = geohash_encode(latitude, longitude, settings.visit_events_geo_precision)
+        for name, value in (("ip", ip), ("fingerprint_hash", fingerprint_hash), ("browser", browser), ("os", os),
+                            ("device_type", device_type), ("country", country)):
+            if value:
+                event[name] = value
+        self._pending.append(event)
+        self._stats["recorded"] += 1
+        if self._wake is not None and len(self._pending) >= settings.visit_events_max_pending:
+            self._wake.set()
+
+    async def ensure_collection(self) -> str:
+        """Create the time-series collection, or update its expiry and (coarser) granularity to match the settings."""
+        database = get_database()
+        existing = await database.list_collections(filter={"name": self.collection_name}).to_list(length=None)
+        ttl = events_ttl()
+        granularity = self.granularity
+        if not existing:
+            options: Dict[str, Any] = {
+                "timeseries": {"timeField": TIME_FIELD, "metaField": META_FIELD, "granularity": granularity},
+            }
+            if ttl:
+                options["expireAfterSeconds"] = ttl
+            await database.create_collection(self.collection_name, **options)
+            return "created"
+
+        options = existing[0].get("options") or {}
+        timeseries = options.get("timeseries")
+        if not timeseries:
+            logger.error(f"{self.collection_name} exists but is not a time-series collection; drop it to have it recreated")
+            return "conflict"
+        command: Dict[str, Any] = {}
+        if options.get("expireAfterSeconds") != ttl:
+            command["expireAfterSeconds"] = ttl if ttl else "off"
+        current = timeseries.get("granularity")
+        if current in GRANULARITIES and current != granularity:
+            if GRANULARITIES.index(granularity) > GRANULARITIES.index(current):
+                command["timeseries"] = {"granularity": granularity}
+            else:
+                logger.warning(
+                    f"{self.collection_name} uses granularity '{current}'; MongoDB can't make it finer ('{granularity}') in place"
+                )
+        if not command:
+            return "ok"
+        await database.command({"collMod": self.collection_name, **command})
+        return "updated"
+
+    async def on_flush(self, items: List[IngestItem]):
+        """Ingest flush hook: record the visits whose writes were applied."""
+        for item in items:
+            for visit in item.visits:
+                self.record(
+                    visit.get("visitor_id") or str(item.filter.get("_id")),
+                    ip=visit.get("ip"),
+                    fingerprint_hash=visit.get("fingerprint_hash"),
+                    latitude=visit.get("latitude"),
+                    longitude=visit.get("longitude"),
+                    browser=visit.get("browser"),
+                    country=visit.get("country"),
+                    at=visit.get("at"),
+                    os=visit.get("os"),
+                    device_type=visit.get("device_type")
+                )
+
+    async def start(self):
+        """Create or update the collection, record visits as the ingest queue flushes them and start the periodic flusher."""
+        if self._task is not None or not settings.visit_events_enabled:
+            return
+        ingest_queue.add_flush_hook(self.on_flush)
+        try:
+            self._stats["collection"] = await self.ensure_collection()
+        except Exception as e:
+            # Visits are still recorded, but into a plain collection until this is fixed
+            self._stats["collection"] = "error"
+            logger.error(f"Could not set up the {self.collection_name} time-series collection: {e}")
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the flusher and insert whatever is still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=settings.visit_events_flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Insert the buffered events with one unordered insert_many."""
+        events, self._pending = self._pending, []
+        if not events:
+            return
+        try:
+            await get_collection(self.collection_name).insert_many(events, ordered=False)
+        except Exception as e:
+            # History is best-effort: a failed batch is dropped rather than retried
+            self._stats["dropped"] += len(events)
+            logger.error(f"Inserting {len(events)} visit events failed: {e}")
+            return
+        self._stats["flushes"] += 1
+        self._stats["inserted"] += len(events)
+
+    @staticmethod
+    def _limit(limit: int) -> int:
+        return max(1, min(limit, settings.visit_events_max_results))
+
+    async def timeline(
+        self,
+        visitor_id: str,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        limit: int = 100
+    ) -> List[Dict[str, Any]]:
+        """A visitor's visits, newest first: a metaField match, so only that visitor's buckets are opened."""
+        query: Dict[str, Any] = {META_FIELD: visitor_id}
+        if start or end:
+            query[TIME_FIELD] = {
+                **({"$gte": to_utc(start)} if start else {}),
+                **({"$lt": to_utc(end)} if end else {}),
+            }
+        self._stats["queries"] += 1
+        return await get_collection(self.collection_name).find(query, EVENT_PROJECTION) \
+            .sort(TIME_FIELD, -1).limit(self._limit(limit)).to_list(length=None)
+
+    async def scan(
+        self,
+        start: datetime,
+        end: datetime,
+        filters: Optional[Dict[str, str]] = None,
+        limit: int = 1000
+    ) -> List[Dict[str, Any]]:
+        """Visits in [start, end), oldest first, optionally narrowed by FILTER_FIELDS; buckets outside the range are skipped."""
+        query = self._range_query(start, end, filters)
+        self._stats["queries"] += 1
+        return await get_collection(self.collection_name).find(query, EVENT_PROJECTION) \
+            .sort(TIME_FIELD, 1).limit(self._limit(limit)).to_list(length=None)
+
+    async def histogram(
+        self,
+        start: datetime,
+        end: datetime,
+        unit: str = "hour",
+        by: Optional[str] = None,
+        filters: Optional[Dict[str, str]] = None
+    ) -> List[Dict[str, Any]]:
+        """Visit counts per time unit (and per value of a FILTER_FIELDS field), aggregated on the server."""
+        if unit not in HISTOGRAM_UNITS:
+            raise ValueError(f"Unknown unit '{unit}' (expected one of {', '.join(HISTOGRAM_UNITS)})")
+        if by is not None and by not in FILTER_FIELDS:
+            raise ValueError(f"Can't group by '{by}' (expected one of {', '.join(FILTER_FIELDS)})")
+        group_id: Dict[str, Any] = {"bucket": {"$dateTrunc": {"date": f"${TIME_FIELD}", "unit": unit}}}
+        if by:
+            group_id["value"] = f"${by}"
+        pipeline = [
+            {"$match": self._range_query(start, end, filters)},
+            {"$group": {"_id": group_id, "visits": {"$sum": 1}}},
+            {"$sort": {"_id.bucket": 1, "visits": -1}},
+            {"$limit": settings.visit_events_max_results},
+        ]
+        self._stats["queries"] += 1
+        rows = await get_collection(self.collection_name).aggregate(pipeline).to_list(length=None)
+        return [
+            {"bucket": row["_id"]["bucket"], **({"value": row["_id"].get("value")} if by else {}), "visits": row["visits"]}
+            for row in rows
+        ]
+
+    @staticmethod
+    def _range_query(start: datetime, end: datetime, filters: Optional[Dict[str, str]]) -> Dict[str, Any]:
+        start, end = to_utc(start), to_utc(end)
+        if end <= start:
+            raise ValueError("end must be after start")
+        query: Dict[str, Any] = {TIME_FIELD: {"$gte": start, "$lt": end}}
+        for name, value in (filters or {}).items():
+            if name not in FILTER_FIELDS:
+                raise ValueError(f"Can't filter on '{name}' (expected one of {', '.join(FILTER_FIELDS)})")
+            if value is not None:
+                query[name] = value
+        return query
+
+    def stats(self) -> Dict[str, Any]:
+        return {**self._stats, "pending": len(self._pending), "running": self._task is not None}
+
+# Global visit event log instance
+visit_events = VisitEventLog()
@@ -0,0 +1,333 @@
+"""
+Declarative MongoDB index registry.
+
+Every index the application relies on is listed in index_specs() and applied
+idempotently at startup (in the background) or from the command line:
+
+    python -m app.database.indexes apply
+    python -m app.database.indexes check      # missing, conflicting, unmanaged and unused indexes
+    python -m app.database.indexes progress   # index builds currently running on the server
+
+Applying creates missing indexes, updates TTLs in place with collMod when the
+retention settings change, and reports (never drops) indexes whose options
+conflict with the registry.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from app.config import settings
+from app.database.connection import get_collection, get_database
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """One index the application expects to exist."""
+    collection: str
+    keys: Tuple[Tuple[str, int], ...]
+    name: str
+    unique: bool = False
+    sparse: bool = False
+    expire_after_seconds: Optional[int] = None
+    partial_filter: Optional[Dict[str, Any]] = None
+    purpose: str = ""
+
+    def options(self) -> Dict[str, Any]:
+        options: Dict[str, Any] = {"name": self.name}
+        if self.unique:
+            options["unique"] = True
+        if self.sparse:
+            options["sparse"] = True
+        if self.expire_after_seconds is not None:
+            options["expireAfterSeconds"] = self.expire_after_seconds
+        if self.partial_filter is not None:
+            options["partialFilterExpression"] = self.partial_filter
+        return options
+
+def _retention_ttl() -> Optional[int]:
+    if not settings.retention_ttl_index or settings.data_retention_days <= 0:
+        return None
+    return settings.data_retention_days * 86400
+
+def _change_record_ttl() -> Optional[int]:
+    # Change records hold raw profile values, so they don't outlive the anonymization window
+    days = settings.anonymize_after_days or settings.data_retention_days
+    return days * 86400 if days > 0 else None
+
+def index_specs() -> List[IndexSpec]:
+    """The registry (TTLs follow the current settings)."""
+    return [
+        IndexSpec(
+            "visitor_logs", (("visitor_id", 1),), "visitor_id_unique",
+            unique=True,
+            # Anonymous visits have no visitor_id and must not collide on null
+            partial_filter={"visitor_id": {"$type": "string"}},
+            purpose="returning-visitor upserts and lookups"
+        ),
+        IndexSpec(
+            "visitor_logs", (("created_at", 1),), "created_at_ttl",
+            expire_after_seconds=_retention_ttl(),
+            purpose="time-range scans; expires visitors not seen for data_retention_days"
+        ),
+        IndexSpec(
+            # TTL indexes must be single-field, so the keyset order gets its own index
+            "visitor_logs", (("created_at", 1), ("_id", 1)), "created_at_id",
+            purpose="retention anonymize batches in (created_at, _id) keyset order without an in-memory sort"
+        ),
+        IndexSpec(
+            "visitor_logs", (("fingerprint_hash", 1),), "fingerprint_hash",
+            sparse=True,
+            purpose="returning-device lookups by fingerprint hash"
+        ),
+        IndexSpec(
+            "visitor_logs", (("ua_id", 1),), "ua_id",
+            sparse=True,
+            purpose="visitors sharing a user agent (profile_dictionary id); grouping by user agent"
+        ),
+        IndexSpec(
+            "visitor_logs", (("fonts_id", 1),), "fonts_id",
+            sparse=True,
+            purpose="visitors sharing a font list (profile_dictionary id); grouping by font list"
+        ),
+        IndexSpec(
+            "visitor_logs", (("features_id", 1),), "features_id",
+            sparse=True,
+            purpose="visitors sharing a feature map (profile_dictionary id); grouping by feature map"
+        ),
+        IndexSpec(
+            "visit_rollups", (("dimension", 1), ("granularity", 1), ("bucket", 1)), "dimension_granularity_bucket",
+            purpose="rollup series scans"
+        ),
+        IndexSpec(
+            "visit_rollups", (("expires_at", 1),), "expires_at_ttl",
+            sparse=True, expire_after_seconds=0,
+            purpose="expiry of minute and hour rollup buckets"
+        ),
+        IndexSpec(
+            # Created by MongoDB itself (6.3+) on the time-series metaField and timeField
+            "visit_events", (("visitor_id", 1), ("ts", 1)), "visitor_id_ts",
+            purpose="per-visitor visit timelines"
+        ),
+        IndexSpec(
+            "profile_dictionary", (("kind", 1), ("visitors", -1)), "kind_visitors",
+            purpose="most common user agents, font lists and feature maps"
+        ),
+        IndexSpec(
+            "profile_changes", (("visitor_id", 1), ("at", -1)), "visitor_id_at",
+            purpose="per-visitor profile change history"
+        ),
+        IndexSpec(
+            "profile_changes", (("at", 1),), "at_ttl",
+            expire_after_seconds=_change_record_ttl(),
+            purpose="expires change records after ANONYMIZE_AFTER_DAYS (or DATA_RETENTION_DAYS)"
+        ),
+    ]
+
+def _key_tuple(key: Any) -> Tuple[Tuple[str, int], ...]:
+    items = key.items() if isinstance(key, dict) else key
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction) for field, direction in items)
+
+def _differences(spec: IndexSpec, existing: Dict[str, Any]) -> List[str]:
+    """Option mismatches between a spec and an existing index with the same keys."""
+    differences = []
+    if bool(existing.get("unique")) != spec.unique:
+        differences.append("unique")
+    if bool(existing.get("sparse")) != spec.sparse:
+        differences.append("sparse")
+    if existing.get("partialFilterExpression") != spec.partial_filter:
+        differences.append("partialFilterExpression")
+    if existing.get("expireAfterSeconds") != spec.expire_after_seconds:
+        differences.append("expireAfterSeconds")
+    return differences
+
+class IndexManager:
+    """Applies and audits the index registry."""
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+        self._last_report: Optional[Dict[str, Any]] = None
+
+    async def _existing(self, collection_name: str) -> Dict[Tuple[Tuple[str, int], ...], Dict[str, Any]]:
+        information = await get_collection(collection_name).index_information()
+        return {_key_tuple(info["key"]): {"name": name, **info} for name, info in information.items()}
+
+    async def build_progress(self) -> List[Dict[str, Any]]:
+        """Index builds running on the server, with their progress where reported."""
+        try:
+            result = await get_database().client.admin.command({
+                "currentOp": True,
+                "$or": [
+                    {"command.createIndexes": {"$exists": True}},
+                    {"msg": {"$regex": "^Index Build"}},
+                ],
+            })
+        except Exception as e:
+            logger.warning(f"Could not read index build progress: {e}")
+            return []
+        builds = []
+        for operation in result.get("inprog", []):
+            progress = operation.get("progress") or {}
+            builds.append({
+                "namespace": operation.get("ns"),
+                "indexes": [index.get("name") for index in (operation.get("command") or {}).get("indexes", [])],
+                "message": operation.get("msg"),
+                "done": progress.get("done"),
+                "total": progress.get("total"),
+                "seconds_running": operation.get("secs_running"),
+            })
+        return builds
+
+    async def _log_progress(self, spec: IndexSpec):
+        while True:
+            await asyncio.sleep(settings.index_progress_interval)
+            for build in await self.build_progress():
+                if build["namespace"] and build["namespace"].endswith(f".{spec.collection}"):
+                    logger.info(f"Building index {spec.collection}.{spec.name}: {build['message'] or 'in progress'}")
+
+    async def _create(self, spec: IndexSpec):
+        """create_index, logging server-side build progress while it runs."""
+        reporter = asyncio.create_task(self._log_progress(spec))
+        try:
+            await get_collection(spec.collection).create_index(list(spec.keys), **spec.options())
+        finally:
+            reporter.cancel()
+            await asyncio.gather(reporter, return_exceptions=True)
+
+    async def apply(self) -> List[Dict[str, Any]]:
+        """Create missing indexes and update changed TTLs; conflicting indexes are reported, not rebuilt."""
+        results = []
+        existing_by_collection: Dict[str, Dict] = {}
+        for spec in index_specs():
+            if spec.collection not in existing_by_collection:
+                existing_by_collection[spec.collection] = await self._existing(spec.collection)
+            existing = existing_by_collection[spec.collection].get(spec.keys)
+            result = {"collection": spec.collection, "index": spec.name}
+            try:
+                if existing is None:
+                    await self._create(spec)
+                    result["status"] = "created"
+                else:
+                    differences = _differences(spec, existing)
+                    if not differences:
+                        result["status"] = "ok"
+                    elif differences == ["expireAfterSeconds"] and spec.expire_after_seconds is not None and "expireAfterSeconds" in existing:
+                        await get_database().command({
+                            "collMod": spec.collection,
+                            "index": {"keyPattern": dict(spec.keys), "expireAfterSeconds": spec.expire_after_seconds},
+                        })
+                        result["status"] = "ttl_updated"
+                    else:
+                        result["status"] = "conflict"
+                        result["differences"] = differences
+                        result["existing"] = existing["name"]
+                        logger.warning(
+                            f"Index {spec.collection}.{existing['name']} differs from the registry ({', '.join(differences)}); "
+                            f"drop it to let {spec.name} be built"
+                        )
+            except Exception as e:
+                result["status"] = "error"
+                result["error"] = str(e)
+                logger.error(f"Failed to apply index {spec.collection}.{spec.name}: {e}")
+            results.append(result)
+        self._last_report = {"applied_at": datetime.utcnow().isoformat(), "indexes": results}
+        return results
+
+    async def _usage(self, collection_name: str) -> Dict[str, Dict[str, Any]]:
+        """$indexStats per index name: operations since the server (or index) started."""
+        try:
+            stats = await get_collection(collection_name).aggregate([{"$indexStats": {}}]).to_list(length=None)
+        except Exception as e:
+            logger.warning(f"Could not read index usage for {collection_name}: {e}")
+            return {}
+        return {
+            entry["name"]: {"ops": entry.get("accesses", {}).get("ops", 0), "since": entry.get("accesses", {}).get("since")}
+            for entry in stats
+        }
+
+    async def check(self) -> Dict[str, Any]:
+        """Audit without changing anything: missing and conflicting registry indexes, unmanaged and unused ones."""
+        specs = index_specs()
+        report: Dict[str, Any] = {"missing": [], "conflicts": [], "unmanaged": [], "unused": [], "builds": await self.build_progress()}
+        for collection_name in sorted({spec.collection for spec in specs}):
+            existing = await self._existing(collection_name)
+            managed = set()
+            for spec in (spec for spec in specs if spec.collection == collection_name):
+                index = existing.get(spec.keys)
+                if index is None:
+                    report["missing"].append({"collection": collection_name, "index": spec.name, "keys": dict(spec.keys), "purpose": spec.purpose})
+                    continue
+                managed.add(index["name"])
+                differences = _differences(spec, index)
+                if differences:
+                    report["conflicts"].append({"collection": collection_name, "index": index["name"], "expected": spec.name, "differences": differences})
+            usage = await self._usage(collection_name)
+            for keys, index in existing.items():
+                if index["name"] == "_id_":
+                    continue
+                if index["name"] not in managed:
+                    report["unmanaged"].append({"collection": collection_name, "index": index["name"], "keys": dict(keys)})
+                if usage.get(index["name"], {}).get("ops") == 0:
+                    report["unused"].append({"collection": collection_name, "index": index["name"], "since": str(usage[index["name"]]["since"])})
+        return report
+
+    async def start(self):
+        """Apply the registry in the background so large first-time builds don't hold up startup."""
+        if settings.index_apply_on_startup and self._task is None:
+            self._task = asyncio.create_task(self._apply_logged())
+
+    async def _apply_logged(self):
+        try:
+            results = await self.apply()
+            changed = [f"{result['collection']}.{result['index']}: {result['status']}" for result in results if result["status"] != "ok"]
+            if changed:
+                logger.info(f"Index registry applied ({'; '.join(changed)})")
+        except Exception as e:
+            logger.error(f"Applying the index registry failed: {e}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "registered": len(index_specs()),
+            "applying": self._task is not None and not self._task.done(),
+            "last_apply": self._last_report,
+        }
+
+# Global index manager instance
+index_manager = IndexManager()
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply or audit the MongoDB index registry")
+    parser.add_argument("command", choices=["apply", "check", "progress"])
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    from app.database.connection import close_mongo_connection, connect_to_mongo
+
+    async def run():
+        await connect_to_mongo()
+        try:
+            if args.command == "apply":
+                # Time-series collections must exist before an index would create them as plain ones
+                from app.core.visit_events import visit_events
+                await visit_events.ensure_collection()
+                return await index_manager.apply()
+            if args.command == "check":
+                return await index_manager.check()
+            return await index_manager.build_progress()
+        finally:
+            await close_mongo_connection()
+
+    print(json.dumps(asyncio.run(run()), indent=2, default=str))
+
+if __name__ == "__main__":
+    main()
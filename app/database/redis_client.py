@@ -1,23 +1,50 @@
 import aioredis
-from typing import Optional, Any
+from typing import Optional, Any, Dict, Iterable, List, Set, Tuple
+import asyncio
 import json
 import logging
+import uuid
 from app.config import settings
+from app.database.local_cache import LocalCache
 
 logger = logging.getLogger(__name__)
 
+# Delete a lock only if it still holds our token
+_RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
 class RedisClient:
-    """Redis client for caching operations."""
-    
+    """Redis client for caching operations, with an optional in-process L1 tier."""
+
     def __init__(self):
         self.redis: Optional[aioredis.Redis] = None
-    
+        self.local: Optional[LocalCache] = None
+        if settings.redis_l1_enabled:
+            self.local = LocalCache(
+                max_bytes=settings.redis_l1_max_bytes,
+                max_entries=settings.redis_l1_max_entries,
+                default_ttl=settings.redis_l1_ttl
+            )
+        # Identifies this worker's own invalidation messages
+        self.instance_id = uuid.uuid4().hex
+        self._pubsub = None
+        self._listener: Optional[asyncio.Task] = None
+        self._stats = {"hits": 0, "misses": 0, "errors": 0}
+
+    @property
+    def connected(self) -> bool:
+        return self.redis is not None
+
     async def connect(self):
         """Connect to Redis."""
         try:
             self.redis = aioredis.from_url(
-                settings.redis_url, 
-                encoding="utf-8", 
+                settings.redis_url,
+                encoding="utf-8",
                 decode_responses=True
             )
             # Test connection
@@ -26,63 +53,409 @@ class RedisClient:
         except Exception as e:
             logger.warning(f"Failed to connect to Redis: {e}. Caching will be disabled.")
             self.redis = None
-    
+            return
+
+        if self.local is not None:
+            try:
+                self._pubsub = self.redis.pubsub()
+                await self._pubsub.subscribe(settings.redis_l1_invalidation_channel)
+                self._listener = asyncio.create_task(self._listen_for_invalidations())
+            except Exception as e:
+                # Without cross-worker invalidation a stale L1 could outlive a write elsewhere
+                logger.warning(f"Failed to subscribe to cache invalidations: {e}. L1 cache disabled.")
+                self.local = None
+
     async def disconnect(self):
         """Disconnect from Redis."""
+        if self._listener:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._pubsub:
+            try:
+                await self._pubsub.unsubscribe()
+                await self._pubsub.close()
+            except Exception as e:
+                logger.error(f"Error closing Redis pub/sub: {e}")
+            self._pubsub = None
         if self.redis:
             await self.redis.close()
             logger.info("Redis connection closed")
-    
+
+    async def _listen_for_invalidations(self):
+        """Drop L1 entries written or deleted by other workers."""
+        try:
+            async for message in self._pubsub.listen():
+                if message.get("type") != "message":
+                    continue
+                try:
+                    data = json.loads(message["data"])
+                except (TypeError, ValueError):
+                    continue
+                if data.get("origin") != self.instance_id and self.local is not None:
+                    self.local.delete(data.get("key", ""), invalidation=True)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Cache invalidation listener stopped: {e}")
+            # Entries can no longer be trusted across workers
+            if self.local is not None:
+                self.local.clear()
+            self.local = None
+
+    def _invalidation_message(self, key: str) -> str:
+        return json.dumps({"origin": self.instance_id, "key": key})
+
     async def get(self, key: str) -> Optional[Any]:
-        """Get value from Redis cache."""
+        """Get value from the L1 cache, falling back to Redis."""
+        if self.local is not None:
+            found, value = self.local.get(key)
+            if found:
+                return value
+
         if not self.redis:
             return None
-        
+
         try:
-            value = await self.redis.get(key)
+            if self.local is not None:
+                # Fetch the remaining TTL in the same round trip so L1 never outlives Redis
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.get(key)
+                    pipe.pttl(key)
+                    value, pttl = await pipe.execute()
+            else:
+                value = await self.redis.get(key)
+                pttl = None
             if value:
-                return json.loads(value)
+                self._stats["hits"] += 1
+                result = json.loads(value)
+                if self.local is not None:
+                    ttl = pttl / 1000 if pttl and pttl > 0 else None
+                    self.local.set(key, result, size=len(value), ttl=ttl)
+                return result
+            self._stats["misses"] += 1
             return None
         except Exception as e:
+            self._stats["errors"] += 1
             logger.error(f"Redis GET error for key {key}: {e}")
             return None
-    
+
     async def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
         """Set value in Redis cache."""
         if not self.redis:
             return False
-        
+
         try:
             ttl = ttl or settings.redis_cache_ttl
-            await self.redis.setex(key, ttl, json.dumps(value))
+            payload = json.dumps(value)
+            if self.local is not None:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.setex(key, ttl, payload)
+                    pipe.publish(settings.redis_l1_invalidation_channel, self._invalidation_message(key))
+                    await pipe.execute()
+                self.local.set(key, value, size=len(payload), ttl=ttl)
+            else:
+                await self.redis.setex(key, ttl, payload)
             return True
         except Exception as e:
+            self._stats["errors"] += 1
             logger.error(f"Redis SET error for key {key}: {e}")
             return False
-    
+
     async def delete(self, key: str) -> bool:
         """Delete key from Redis cache."""
+        if self.local is not None:
+            self.local.delete(key)
+
         if not self.redis:
             return False
-        
+
         try:
-            result = await self.redis.delete(key)
+            if self.local is not None:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    pipe.delete(key)
+                    pipe.publish(settings.redis_l1_invalidation_channel, self._invalidation_message(key))
+                    result, _ = await pipe.execute()
+            else:
+                result = await self.redis.delete(key)
             return result > 0
         except Exception as e:
+            self._stats["errors"] += 1
             logger.error(f"Redis DELETE error for key {key}: {e}")
             return False
-    
+
     async def exists(self, key: str) -> bool:
         """Check if key exists in Redis."""
+        if self.local is not None and self.local.contains(key):
+            return True
+
         if not self.redis:
             return False
-        
+
         try:
             return await self.redis.exists(key) > 0
         except Exception as e:
+            self._stats["errors"] += 1
             logger.error(f"Redis EXISTS error for key {key}: {e}")
             return False
 
+    async def get_many(self, keys: List[str]) -> List[Optional[Any]]:
+        """Get several JSON values from Redis in one round trip (bypasses the L1 tier)."""
+        if not self.redis or not keys:
+            return [None] * len(keys)
+
+        try:
+            values = await self.redis.mget(keys)
+            return [json.loads(value) if value else None for value in values]
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis MGET error for {len(keys)} keys: {e}")
+            return [None] * len(keys)
+
+    async def sadd(self, key: str, members: Iterable[str], ttl: Optional[int] = None) -> bool:
+        """Add members to a set, refreshing its expiry."""
+        members = list(members)
+        if not self.redis or not members:
+            return False
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.sadd(key, *members)
+                pipe.expire(key, ttl or settings.redis_cache_ttl)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis SADD error for key {key}: {e}")
+            return False
+
+    async def sadd_many(self, keys: List[str], member: str, ttl: Optional[int] = None) -> bool:
+        """Add one member to several sets in one pipelined round trip, refreshing their expiry."""
+        if not self.redis or not keys:
+            return False
+
+        try:
+            ttl = ttl or settings.redis_cache_ttl
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.sadd(key, member)
+                    pipe.expire(key, ttl)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis SADD error for {len(keys)} keys: {e}")
+            return False
+
+    async def move_member(
+        self,
+        member: str,
+        add_keys: List[str],
+        remove_keys: List[str],
+        ttl: Optional[int] = None,
+        values: Optional[Dict[str, Any]] = None
+    ) -> bool:
+        """Move a member between sets and write JSON values in one pipelined round trip (bypasses the L1 tier).
+
+        Values written here are not published for L1 invalidation, so read them back with get_many.
+        """
+        if not self.redis or not (add_keys or remove_keys or values):
+            return False
+
+        try:
+            ttl = ttl or settings.redis_cache_ttl
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in remove_keys:
+                    pipe.srem(key, member)
+                for key in add_keys:
+                    pipe.sadd(key, member)
+                    pipe.expire(key, ttl)
+                for key, value in (values or {}).items():
+                    pipe.setex(key, ttl, json.dumps(value))
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis set update error for member {member}: {e}")
+            return False
+
+    async def expire_many(self, keys: List[str], ttl: Optional[int] = None) -> bool:
+        """Refresh the expiry of several keys in one pipelined round trip (missing keys are skipped)."""
+        if not self.redis or not keys:
+            return False
+
+        try:
+            ttl = ttl or settings.redis_cache_ttl
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.expire(key, ttl)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis EXPIRE error for {len(keys)} keys: {e}")
+            return False
+
+    async def srem(self, key: str, members: Iterable[str]) -> bool:
+        """Remove members from a set."""
+        members = list(members)
+        if not self.redis or not members:
+            return False
+
+        try:
+            return await self.redis.srem(key, *members) > 0
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis SREM error for key {key}: {e}")
+            return False
+
+    async def smembers(self, key: str) -> Set[str]:
+        """Members of a set (empty if missing or Redis is unavailable)."""
+        return (await self.smembers_many([key]))[0]
+
+    async def smembers_many(self, keys: List[str], limit: Optional[int] = None) -> List[Set[str]]:
+        """Members of several sets in one pipelined round trip (a random sample of at most limit each, if given)."""
+        if not self.redis or not keys:
+            return [set() for _ in keys]
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    if limit:
+                        pipe.srandmember(key, limit)
+                    else:
+                        pipe.smembers(key)
+                return [set(members) for members in await pipe.execute()]
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis SMEMBERS error for {len(keys)} keys: {e}")
+            return [set() for _ in keys]
+
+    async def hincrby_many(
+        self,
+        increments: List[Tuple[str, str, int]],
+        assignments: Optional[List[Tuple[str, str, str]]] = None
+    ) -> bool:
+        """Apply (key, field, amount) hash increments and (key, field, value) HSETs in one pipelined round trip."""
+        if not self.redis or not (increments or assignments):
+            return False
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, field, amount in increments:
+                    pipe.hincrby(key, field, amount)
+                for key, field, value in assignments or []:
+                    pipe.hset(key, field, value)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis HINCRBY error for {len(increments)} fields: {e}")
+            return False
+
+    async def hget_many(self, fields: List[Tuple[str, str]]) -> List[Optional[str]]:
+        """Read (key, field) hash values in one pipelined round trip."""
+        if not self.redis or not fields:
+            return [None] * len(fields)
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, field in fields:
+                    pipe.hget(key, field)
+                return await pipe.execute()
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis HGET error for {len(fields)} fields: {e}")
+            return [None] * len(fields)
+
+    async def hread_many(self, fields: List[Tuple[str, str]], length_keys: List[str]) -> Tuple[List[Optional[str]], List[int]]:
+        """HGET (key, field) pairs and HLEN keys in one pipelined round trip."""
+        if not self.redis or not (fields or length_keys):
+            return [None] * len(fields), [0] * len(length_keys)
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, field in fields:
+                    pipe.hget(key, field)
+                for key in length_keys:
+                    pipe.hlen(key)
+                results = await pipe.execute()
+            return results[:len(fields)], [int(length) for length in results[len(fields):]]
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis HGET/HLEN error for {len(fields) + len(length_keys)} keys: {e}")
+            return [None] * len(fields), [0] * len(length_keys)
+
+    async def pfadd_many(self, additions: List[Tuple[str, List[str], int]]) -> bool:
+        """Add (key, elements, ttl) to HyperLogLogs in one pipelined round trip, refreshing each key's TTL."""
+        if not self.redis or not additions:
+            return False
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for key, elements, ttl in additions:
+                    pipe.pfadd(key, *elements)
+                    pipe.expire(key, ttl)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis PFADD error for {len(additions)} keys: {e}")
+            return False
+
+    async def pfcount_many(self, key_groups: List[List[str]]) -> List[Optional[int]]:
+        """Cardinality of the union of each key group (PFCOUNT merges on the fly), in one round trip."""
+        if not self.redis or not key_groups:
+            return [None] * len(key_groups)
+
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for keys in key_groups:
+                    pipe.pfcount(*keys)
+                return [int(count) for count in await pipe.execute()]
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis PFCOUNT error for {len(key_groups)} key groups: {e}")
+            return [None] * len(key_groups)
+
+    async def acquire_lock(self, key: str, ttl_ms: int) -> Optional[str]:
+        """Take a short-lived lock; returns the owner token, or None if it is held elsewhere."""
+        if not self.redis:
+            return None
+
+        token = uuid.uuid4().hex
+        try:
+            acquired = await self.redis.set(key, token, nx=True, px=ttl_ms)
+            return token if acquired else None
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis lock error for key {key}: {e}")
+            return None
+
+    async def release_lock(self, key: str, token: str) -> bool:
+        """Release a lock taken with acquire_lock, unless it already expired and changed hands."""
+        if not self.redis:
+            return False
+
+        try:
+            return await self.redis.eval(_RELEASE_LOCK_SCRIPT, 1, key, token) > 0
+        except Exception as e:
+            self._stats["errors"] += 1
+            logger.error(f"Redis unlock error for key {key}: {e}")
+            return False
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit ratios for the L1 and Redis tiers."""
+        lookups = self._stats["hits"] + self._stats["misses"]
+        return {
+            "l1": self.local.stats() if self.local is not None else {"enabled": False},
+            "redis": {
+                **self._stats,
+                "hit_ratio": round(self._stats["hits"] / lookups, 4) if lookups else 0.0,
+                "connected": self.redis is not None
+            }
+        }
+
 # Global Redis client instance
 redis_client = RedisClient()
 
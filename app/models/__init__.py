@@ -4,6 +4,7 @@ from .base import (
     BaseResponse,
     ErrorResponse,
     PaginationParams,
+    ProjectionParams,
     PaginatedResponse
 )
 from .visitor import (
@@ -31,6 +32,7 @@ __all__ = [
     "BaseResponse",
     "ErrorResponse", 
     "PaginationParams",
+    "ProjectionParams",
     "PaginatedResponse",
     # Visitor models
     "VisitorProfile",
@@ -34,6 +34,14 @@ class PaginationParams(BaseModel):
     limit: int = Field(10, ge=1, le=100, description="Number of records to return")
     sort_field: str = Field("_id", description="Field to sort by")
     sort_order: int = Field(-1, description="Sort order: 1 for ascending, -1 for descending")
+    cursor: Optional[str] = Field(None, description="next_cursor from the previous page; replaces skip")
+    count: str = Field("exact", pattern="^(exact|estimated|cached)$", description="Total count mode: exact, estimated or cached")
+
+class ProjectionParams(BaseModel):
+    """Field projection parameters."""
+    view: Optional[str] = Field(None, description="Named view, e.g. summary or full")
+    fields: Optional[str] = Field(None, description="Comma-separated fields to include")
+    exclude: Optional[str] = Field(None, description="Comma-separated fields to leave out")
 
 class PaginatedResponse(BaseResponse):
     """Paginated response model."""
@@ -43,3 +51,5 @@ class PaginatedResponse(BaseResponse):
     limit: int = 0
     has_next: bool = False
     has_prev: bool = False
+    next_cursor: Optional[str] = None
+    count_mode: str = "exact"
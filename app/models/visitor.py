@@ -100,8 +100,11 @@ class VisitorProfile(BaseDocument):
     # Analytics data
     visit_count: int = Field(1, description="Total visit count")
     browser: Optional[str] = Field(None, description="Detected browser")
+    browser_version: Optional[str] = Field(None, description="Detected browser version")
     device_type: Optional[str] = Field(None, description="Device type")
     os: Optional[str] = Field(None, description="Operating system")
+    os_version: Optional[str] = Field(None, description="Operating system version")
+    engine: Optional[str] = Field(None, description="Rendering engine")
     
     # Metadata
     collect_duration: Optional[int] = Field(None, description="Time taken to collect fingerprint (ms)")
@@ -126,8 +129,11 @@ class VisitorProfileCreate(BaseModel):
     features: Optional[Dict[str, Any]] = None
     visit_count: int = 1
     browser: Optional[str] = None
+    browser_version: Optional[str] = None
     device_type: Optional[str] = None
     os: Optional[str] = None
+    os_version: Optional[str] = None
+    engine: Optional[str] = None
     collect_duration: Optional[int] = None
     adblock_detected: Optional[bool] = None
 
@@ -1,7 +1,8 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from typing import List, Optional, Dict, Any
-from app.models import PaginationParams, PaginatedResponse
+from app.models import PaginationParams, PaginatedResponse, ProjectionParams
 from app.core import create_response, create_error_response, validate_object_id, BaseService
+from app.core.views import build_projection, view_names
 from app.database import get_collection
 import logging
 
@@ -15,39 +16,56 @@ class BaseRouter:
         self.router = APIRouter(prefix=f"/{collection_name}", tags=[tag])
         self._setup_routes()
     
+    def _projection(self, params: ProjectionParams) -> Optional[Dict[str, Any]]:
+        """MongoDB projection for the requested view/fields; 400 on an invalid combination."""
+        try:
+            return build_projection(self.collection_name, params.view, params.fields, params.exclude)
+        except ValueError as e:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=str(e)
+            )
+    
     def _setup_routes(self):
         """Setup common CRUD routes."""
         
         @self.router.get("/", summary=f"Get all {self.collection_name}")
         async def get_all(
-            pagination: PaginationParams = Depends()
+            pagination: PaginationParams = Depends(),
+            projection: ProjectionParams = Depends()
         ):
             try:
                 collection = get_collection(self.collection_name)
                 service = BaseService(collection)
                 
-                # Get paginated data
-                data = await service.get_all(
-                    skip=pagination.skip,
+                # Get paginated data (keyset after a cursor, skip/limit otherwise)
+                data, next_cursor = await service.get_page(
                     limit=pagination.limit,
                     sort_field=pagination.sort_field,
-                    sort_order=pagination.sort_order
+                    sort_order=pagination.sort_order,
+                    cursor=pagination.cursor,
+                    skip=pagination.skip,
+                    projection=self._projection(projection)
                 )
                 
                 # Get total count
-                total = await service.count()
+                total = await service.count(mode=pagination.count)
                 
                 # Create paginated response
                 return PaginatedResponse(
                     data=data,
                     total=total,
-                    skip=pagination.skip,
+                    skip=0 if pagination.cursor else pagination.skip,
                     limit=pagination.limit,
-                    has_next=pagination.skip + pagination.limit < total,
-                    has_prev=pagination.skip > 0,
+                    has_next=next_cursor is not None,
+                    has_prev=bool(pagination.cursor) or pagination.skip > 0,
+                    next_cursor=next_cursor,
+                    count_mode=pagination.count,
                     message=f"Successfully retrieved {self.collection_name}"
                 )
                 
+            except HTTPException:
+                raise
             except Exception as e:
                 logger.error(f"Error getting {self.collection_name}: {str(e)}")
                 raise HTTPException(
@@ -55,14 +73,21 @@ class BaseRouter:
                     detail=f"Failed to retrieve {self.collection_name}"
                 )
         
+        @self.router.get("/views", summary=f"Named views of {self.collection_name}")
+        async def get_views():
+            return create_response(
+                data={"views": view_names(self.collection_name)},
+                message=f"Views available for {self.collection_name}"
+            )
+        
         @self.router.get("/{item_id}", summary=f"Get {self.collection_name} by ID")
-        async def get_by_id(item_id: str):
+        async def get_by_id(item_id: str, projection: ProjectionParams = Depends()):
             try:
                 object_id = validate_object_id(item_id)
                 collection = get_collection(self.collection_name)
                 service = BaseService(collection)
                 
-                item = await service.get_by_id(object_id)
+                item = await service.get_by_id(object_id, self._projection(projection))
                 if not item:
                     raise HTTPException(
                         status_code=status.HTTP_404_NOT_FOUND,
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Write amplification and working-set size of inline profiles vs. hot documents with compressed cold profiles.
+
+    python benchmarks/profile_storage_benchmark.py
+    python benchmarks/profile_storage_benchmark.py --visitors 5000 --visits 50000 --change-rate 0.05 --codec zlib --level 6
+    python benchmarks/profile_storage_benchmark.py --no-change-detection   # digest over the raw profile
+    python benchmarks/profile_storage_benchmark.py --font-sets 500 --feature-sets 50
+
+Sizes are BSON-encoded with the driver's encoder, which is what travels to the server and
+into the oplog for each $set/replace; no MongoDB is needed. A returning visitor re-sends its
+profile with the per-visit fields (collectedAt, collectDuration, sessionKey, network,
+battery) refreshed, and with --change-rate probability also a changed font or feature.
+With change detection an unchanged returning visit only writes the hot fields, and a
+changed one also writes a change record with the changed paths. Font lists and
+feature maps are drawn from --font-sets/--feature-sets distinct values, and cold profiles
+are measured with and without their dictionary values (app.core.dictionary) interned.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import string
+import sys
+import time
+from datetime import datetime
+
+import bson
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.dictionary import value_dictionary  # noqa: E402
+from app.core.profile_store import (  # noqa: E402
+    compress, decompress, diff, digest, hot_location, normalize, profile_digest, serialize, zstandard
+)
+from app.core.user_agent import parse_user_agent  # noqa: E402
+
+FONT_POOL = [f"Font {i}" for i in range(400)]
+FEATURES = ["webp", "wasm", "worker", "sw", "ws", "rtc", "geo", "crypto", "notif", "vibrate", "bt", "usb", "indexedDB", "isPWA"]
+USER_AGENTS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/{v}.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{v}.1 Safari/605.1.15",
+    "Mozilla/5.0 (X11; Linux x86_64; rv:{v}.0) Gecko/20100101 Firefox/{v}.0",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/{v}.0 Mobile/15E148 Safari/604.1",
+]
+
+def _token(rng: random.Random, length: int) -> str:
+    return "".join(rng.choices(string.ascii_letters + string.digits, k=length))
+
+def make_pools(rng: random.Random, font_sets: int, feature_sets: int) -> dict:
+    """The distinct font lists and feature maps visitors draw from."""
+    return {
+        "fonts": [sorted(rng.sample(FONT_POOL, rng.randint(20, 60))) for _ in range(font_sets)],
+        "features": [{name: rng.random() < 0.6 for name in FEATURES} for _ in range(feature_sets)],
+    }
+
+def make_profile(rng: random.Random, visitor_id: str, pools: dict) -> dict:
+    """A profile shaped like what static/js/core-utils.js collects."""
+    ua = rng.choice(USER_AGENTS).format(v=rng.randint(100, 126))
+    profile = {
+        "visitor_id": visitor_id,
+        "visit_count": 1,
+        "navigator": {"ua": ua, "plat": "Win32", "lang": "en-US", "langs": ["en-US", "en"], "cookies": True, "online": True, "dnt": None, "java": False},
+        "display": {"w": rng.choice([1366, 1440, 1920, 2560]), "h": rng.choice([768, 900, 1080, 1440]), "cdepth": 24, "pdepth": 24, "dpr": rng.choice([1, 1.25, 2])},
+        "hardware": {"cores": rng.choice([2, 4, 8, 12, 16]), "mem": rng.choice([2, 4, 8]), "touch": 0, "touchable": False},
+        "canvas": {"hash": str(rng.getrandbits(32)), "dataURLLength": rng.randint(3000, 9000)},
+        "webgl": {"vendor": "WebKit", "renderer": f"ANGLE (Vendor {rng.randint(0, 4)}, GPU Model {rng.randint(0, 60)} Direct3D11)", "version": "WebGL 1.0", "maxTex": 16384},
+        "webgl_fingerprint": {"hash": _token(rng, 32), "extensions": [f"EXT_ext_{i}" for i in range(rng.randint(20, 35))]},
+        "audio": {"rate": 48000, "maxCh": 2, "hash": _token(rng, 24)},
+        "fonts": {"found": rng.choice(pools["fonts"]), "total": len(FONT_POOL)},
+        "features": rng.choice(pools["features"]),
+        "speechVoices": [{"name": f"Voice {i}", "lang": "en-US", "localService": True, "default": i == 0} for i in rng.sample(range(80), rng.randint(3, 25))],
+        "mediaDevices": [{"kind": "audioinput", "label": "", "groupId": _token(rng, 64), "deviceId": _token(rng, 64)} for _ in range(rng.randint(1, 4))],
+        "permissions": {name: rng.choice(["granted", "denied", "prompt"]) for name in ["geolocation", "notifications", "camera", "microphone", "clipboard-read"]},
+        "css": {"dark": rng.random() < 0.4, "reduced": False, "contrast": "no-preference"},
+        "storage": {"quota": rng.randint(10 ** 9, 10 ** 11), "usage": rng.randint(0, 10 ** 7)},
+        "localStorageData": {f"key_{i}": _token(rng, rng.randint(8, 120)) for i in range(rng.randint(0, 15))},
+        "sessionStorageData": {f"key_{i}": _token(rng, 24) for i in range(rng.randint(0, 5))},
+        "session": {"ref": "https://www.example.com/", "url": f"https://site.example/{_token(rng, 12)}", "proto": "https:", "host": "site.example", "hist": 2, "pageVisibility": "visible"},
+        "tz": {"tz": "Europe/Berlin", "offset": -60},
+        "loc": {
+            "tz": "Europe/Berlin",
+            "offset": -60,
+            "ipInfo": {"publicIP": f"203.0.113.{rng.randint(1, 254)}", "location": {"countryCode": "DE", "city": "Berlin", "lat": 52.52, "lon": 13.4}},
+            "gps": {"latitude": rng.uniform(-60, 60), "longitude": rng.uniform(-180, 180), "accuracy": rng.uniform(5, 100)},
+        },
+    }
+    refresh_volatile(profile, rng)
+    return profile
+
+def refresh_volatile(profile: dict, rng: random.Random):
+    """Fields that differ on every collection even for the same device."""
+    profile["collectedAt"] = datetime.utcnow().isoformat()
+    profile["collectDuration"] = rng.randint(150, 2500)
+    profile["sessionKey"] = _token(rng, 32)
+    profile["network"] = {"type": "4g", "downlink": round(rng.uniform(1, 50), 1), "rtt": rng.choice([50, 100, 150])}
+    profile["battery"] = {"level": round(rng.random(), 2), "charging": rng.random() < 0.5}
+
+def revisit(profile: dict, rng: random.Random, change_rate: float, pools: dict) -> dict:
+    profile = dict(profile)
+    profile["visit_count"] = profile["visit_count"] + 1
+    refresh_volatile(profile, rng)
+    if rng.random() < change_rate:
+        # An installed font or a browser update: the device moves to another common value
+        profile["fonts"] = dict(profile["fonts"], found=rng.choice(pools["fonts"]))
+        profile["features"] = rng.choice(pools["features"])
+    return profile
+
+def hot_fields(profile: dict) -> dict:
+    now = datetime.utcnow()
+    return {
+        **parse_user_agent(profile["navigator"]["ua"]).as_dict(),
+        **hot_location(profile),
+        **value_dictionary.ids(profile),
+        "created_at": now,
+        "last_seen": now,
+        "fingerprint_hash": "v1:" + "0" * 64,
+        "country": "DE",
+    }
+
+def bson_size(document: dict) -> int:
+    return len(bson.encode(document))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--visitors", type=int, default=2000)
+    parser.add_argument("--visits", type=int, default=20000)
+    parser.add_argument("--change-rate", type=float, default=0.05, help="Probability a returning visit changes the profile")
+    parser.add_argument("--codec", choices=["zlib", "zstd"], default="zlib")
+    parser.add_argument("--level", type=int, default=6)
+    parser.add_argument("--no-change-detection", action="store_true", help="Rewrite the hot fields on every visit and digest the raw profile")
+    parser.add_argument("--font-sets", type=int, default=2000, help="Distinct font lists across visitors")
+    parser.add_argument("--feature-sets", type=int, default=200, help="Distinct feature maps across visitors")
+    args = parser.parse_args()
+    if args.codec == "zstd" and zstandard is None:
+        parser.error("zstd needs the zstandard package")
+
+    rng = random.Random(42)
+    pools = make_pools(rng, args.font_sets, args.feature_sets)
+    profiles = {}
+    stored_digests = {}
+    inline_bytes = hot_bytes = cold_bytes = change_bytes = cold_writes = 0
+    compress_ms, decompress_ms = [], []
+    for visit in range(args.visits):
+        visitor_id = f"visitor-{rng.randrange(args.visitors)}"
+        previous = profiles.get(visitor_id)
+        profile = revisit(previous, rng, args.change_rate, pools) if previous else make_profile(rng, visitor_id, pools)
+        profiles[visitor_id] = profile
+
+        hot = hot_fields(profile)
+        inline_bytes += bson_size({"$set": {**hot, "profile": profile}, "$inc": {"visit_count": 1}})
+
+        payload = serialize(profile)
+        new_digest = digest(payload) if args.no_change_detection else profile_digest(profile)
+        if stored_digests.get(visitor_id) == new_digest:
+            hot_bytes += bson_size({"$set": hot, "$inc": {"visit_count": 1}})
+        else:
+            hot_bytes += bson_size({"$set": {**hot, "profile_digest": new_digest}, "$inc": {"visit_count": 1}})
+            if previous and not args.no_change_detection:
+                changed, removed = diff(normalize(previous), normalize(profile))
+                change_bytes += bson_size({"visitor_id": visitor_id, "at": datetime.utcnow(), "from_digest": stored_digests[visitor_id], "to_digest": new_digest,
+                                           "changes": [{"path": path, "value": value} for path, value in changed.items()], "removed": removed})
+            t0 = time.perf_counter()
+            data = compress(payload, args.codec, args.level)
+            compress_ms.append((time.perf_counter() - t0) * 1000)
+            cold_bytes += bson_size({"_id": visitor_id, "digest": new_digest, "codec": args.codec, "data": data,
+                                     "size": len(payload), "stored_size": len(data), "updated_at": datetime.utcnow()})
+            cold_writes += 1
+            stored_digests[visitor_id] = new_digest
+            t0 = time.perf_counter()
+            decompress(data, args.codec)
+            decompress_ms.append((time.perf_counter() - t0) * 1000)
+
+    inline_docs = [bson_size({**hot_fields(profile), "visitor_id": visitor_id, "visit_count": 1, "profile": profile}) for visitor_id, profile in profiles.items()]
+    hot_docs = [bson_size({**hot_fields(profile), "visitor_id": visitor_id, "visit_count": 1}) for visitor_id, profile in profiles.items()]
+    raw_sizes = [len(serialize(profile)) for profile in profiles.values()]
+    stored_sizes = [len(compress(serialize(profile), args.codec, args.level)) for profile in profiles.values()]
+    interned = [serialize(value_dictionary.intern(profile)) for profile in profiles.values()]
+    interned_sizes = [len(compress(payload, args.codec, args.level)) for payload in interned]
+    # What persist() would upsert: one entry per distinct value
+    entries = [{"_id": entry_id, "kind": kind, "value": value, "created_at": datetime.utcnow()}
+               for entry_id, (kind, value) in value_dictionary._pending.items()]
+    dictionary_bytes = sum(bson_size(entry) for entry in entries)
+
+    split_bytes = hot_bytes + cold_bytes + change_bytes
+    detection = "off" if args.no_change_detection else "on"
+    print(f"{args.visits} visits from {len(profiles)} visitors, change rate {args.change_rate:.0%}, {args.codec} level {args.level}, change detection {detection}")
+    print(f"{'write bytes/visit':<24} inline={inline_bytes / args.visits:9.0f}  split={split_bytes / args.visits:9.0f}  "
+          f"(hot {hot_bytes / args.visits:.0f} + cold {cold_bytes / args.visits:.0f} + changes {change_bytes / args.visits:.0f}; "
+          f"{split_bytes / inline_bytes:.1%} of inline)")
+    print(f"{'cold writes':<24} {cold_writes} ({cold_writes / args.visits:.1%} of visits)")
+    print(f"{'visitor_logs doc':<24} inline={statistics.mean(inline_docs):9.0f}B  hot={statistics.mean(hot_docs):9.0f}B  "
+          f"working set for {len(profiles)} visitors: {sum(inline_docs) / 2 ** 20:.1f} MiB -> {sum(hot_docs) / 2 ** 20:.2f} MiB")
+    print(f"{'profile':<24} raw={statistics.mean(raw_sizes):9.0f}B  compressed={statistics.mean(stored_sizes):9.0f}B  "
+          f"ratio={sum(raw_sizes) / sum(stored_sizes):.2f}x")
+    print(f"{'profile (interned)':<24} raw={statistics.mean(len(payload) for payload in interned):9.0f}B  "
+          f"compressed={statistics.mean(interned_sizes):9.0f}B  "
+          f"cold total {sum(stored_sizes) / 2 ** 20:.2f} MiB -> {(sum(interned_sizes) + dictionary_bytes) / 2 ** 20:.2f} MiB "
+          f"(incl. {len(entries)} dictionary entries, {dictionary_bytes / 2 ** 10:.0f} KiB)")
+    print(f"{'codec':<24} compress p50={statistics.median(compress_ms):.3f}ms  decompress p50={statistics.median(decompress_ms):.3f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Per-lookup latency of the local gazetteer reverse geocoder vs. the remote provider path.
+
+    python benchmarks/reverse_geocoder_benchmark.py                      # synthetic gazetteer
+    python benchmarks/reverse_geocoder_benchmark.py --gazetteer cities.csv
+    python benchmarks/reverse_geocoder_benchmark.py --remote 5           # also time 5 remote lookups (network)
+"""
+
+import argparse
+import asyncio
+import csv
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.reverse_geocoder import ReverseGeocoder  # noqa: E402
+
+def write_synthetic_gazetteer(path: str, places: int, seed: int = 42):
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(["city", "latitude", "longitude", "state", "country", "country_code"])
+        for i in range(places):
+            writer.writerow([f"City {i}", rng.uniform(-60, 70), rng.uniform(-180, 180), f"State {i % 500}", f"Country {i % 200}", f"C{i % 200}"])
+
+def summarize(label: str, samples_ms):
+    samples = sorted(samples_ms)
+    p95 = samples[int(len(samples) * 0.95) - 1] if len(samples) >= 20 else samples[-1]
+    print(f"{label:<28} n={len(samples):<7} mean={statistics.mean(samples):9.4f}ms  p50={statistics.median(samples):9.4f}ms  p95={p95:9.4f}ms")
+
+async def remote_samples(queries):
+    from app.core.http_client import http_client
+    from app.core.location_utils import get_location_from_coordinates
+    samples = []
+    try:
+        for lat, lon in queries:
+            start = time.perf_counter()
+            await get_location_from_coordinates(lat, lon, street_level=True)
+            samples.append((time.perf_counter() - start) * 1000)
+            await asyncio.sleep(1)  # Nominatim usage policy: max 1 request/second
+    finally:
+        await http_client.stop()
+    return samples
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gazetteer", help="Gazetteer CSV (defaults to a synthetic one)")
+    parser.add_argument("--places", type=int, default=150000, help="Synthetic gazetteer size")
+    parser.add_argument("--queries", type=int, default=5000)
+    parser.add_argument("--remote", type=int, default=0, help="Number of remote lookups to time")
+    args = parser.parse_args()
+
+    path = args.gazetteer
+    if not path:
+        path = os.path.join(tempfile.mkdtemp(), "gazetteer.csv")
+        write_synthetic_gazetteer(path, args.places)
+
+    geocoder = ReverseGeocoder()
+    geocoder.max_distance_km = float("inf")
+    start = time.perf_counter()
+    geocoder.load(path)
+    print(f"Loaded {len(geocoder.places)} places in {time.perf_counter() - start:.2f}s")
+
+    rng = random.Random(7)
+    queries = [(rng.uniform(-60, 70), rng.uniform(-180, 180)) for _ in range(args.queries)]
+
+    samples = []
+    for lat, lon in queries:
+        t0 = time.perf_counter()
+        geocoder.lookup(lat, lon)
+        samples.append((time.perf_counter() - t0) * 1000)
+    summarize("local lookup", samples)
+
+    t0 = time.perf_counter()
+    geocoder.lookup_batch(queries)
+    batch_ms = (time.perf_counter() - t0) * 1000
+    print(f"{'local batch':<28} n={len(queries):<7} total={batch_ms:.1f}ms  per lookup={batch_ms / len(queries):.4f}ms")
+
+    if args.remote:
+        summarize("remote providers", asyncio.run(remote_samples(queries[:args.remote])))
+
+if __name__ == "__main__":
+    main()
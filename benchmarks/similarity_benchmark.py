@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Recall and latency of the MinHash/LSH similar-device search vs. brute-force Jaccard on synthetic devices.
+
+    python benchmarks/similarity_benchmark.py
+    python benchmarks/similarity_benchmark.py --devices 50000 --queries 300 --bands 32 --num-perm 128
+
+The index here is an in-memory dict of band buckets built with the same MinHasher the
+service uses; in production the buckets live in Redis and add two round trips per query.
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.similarity import MinHasher, feature_set, jaccard  # noqa: E402
+
+FONT_POOL = [f"Font {i}" for i in range(400)]
+FEATURES = ["webp", "wasm", "worker", "sw", "ws", "rtc", "geo", "crypto", "notif", "vibrate", "bt", "usb", "indexedDB", "isPWA"]
+RENDERERS = [f"ANGLE (Vendor {i % 5}, GPU Model {i} Direct3D11)" for i in range(60)]
+TIMEZONES = ["Europe/Berlin", "America/New_York", "Asia/Kolkata", "Asia/Tokyo", "Europe/London", "America/Los_Angeles"]
+
+def base_config(rng: random.Random) -> dict:
+    return {
+        "fonts": {"found": rng.sample(FONT_POOL, rng.randint(20, 60))},
+        "features": {name: rng.random() < 0.6 for name in FEATURES},
+        "webgl": {"vendor": "WebKit", "renderer": rng.choice(RENDERERS), "maxTex": rng.choice([8192, 16384])},
+        "hardware": {"cores": rng.choice([2, 4, 8, 12, 16]), "mem": rng.choice([2, 4, 8]), "touch": 0},
+        "display": {"w": rng.choice([1366, 1440, 1920, 2560]), "h": rng.choice([768, 900, 1080, 1440]), "cdepth": 24, "dpr": rng.choice([1, 1.25, 2])},
+        "tz": {"tz": rng.choice(TIMEZONES)},
+        "speechVoices": [{"name": f"Voice {i}"} for i in rng.sample(range(80), rng.randint(3, 15))],
+        "canvas": {"hash": str(rng.getrandbits(32))},
+    }
+
+def perturb(config: dict, rng: random.Random, edits: int) -> dict:
+    """The same kind of device with a few fonts/features/voices changed."""
+    profile = {key: (dict(value) if isinstance(value, dict) else list(value)) for key, value in config.items()}
+    fonts = list(profile["fonts"]["found"])
+    for _ in range(edits):
+        choice = rng.random()
+        if choice < 0.4 and fonts:
+            fonts.pop(rng.randrange(len(fonts)))
+        elif choice < 0.8:
+            fonts.append(rng.choice(FONT_POOL))
+        else:
+            feature = rng.choice(FEATURES)
+            profile["features"] = dict(profile["features"], **{feature: not profile["features"][feature]})
+    profile["fonts"] = {"found": fonts}
+    return profile
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--devices", type=int, default=20000)
+    parser.add_argument("--configs", type=int, default=2000, help="Distinct base device configurations")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--num-perm", type=int, default=128)
+    parser.add_argument("--bands", type=int, default=32)
+    parser.add_argument("--threshold", type=float, default=0.5)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    configs = [base_config(rng) for _ in range(args.configs)]
+    devices = [perturb(rng.choice(configs), rng, rng.randint(0, 6)) for _ in range(args.devices)]
+
+    hasher = MinHasher(args.num_perm, args.bands)
+    start = time.perf_counter()
+    token_sets = [feature_set(device) for device in devices]
+    signatures = []
+    buckets = defaultdict(set)
+    for device_id, tokens in enumerate(token_sets):
+        signature = hasher.signature(tokens)
+        signatures.append(signature)
+        for band_key in hasher.band_keys(signature):
+            buckets[band_key].add(device_id)
+    build_s = time.perf_counter() - start
+    print(f"Indexed {len(devices)} devices in {build_s:.2f}s ({build_s / len(devices) * 1000:.3f}ms/device, {len(buckets)} buckets)")
+
+    recalls, lsh_ms, brute_ms, candidate_counts = [], [], [], []
+    for _ in range(args.queries):
+        query = feature_set(perturb(rng.choice(configs), rng, rng.randint(0, 6)))
+
+        t0 = time.perf_counter()
+        exact = sorted(((jaccard(query, tokens), device_id) for device_id, tokens in enumerate(token_sets)), reverse=True)
+        truth = {device_id for score, device_id in exact[:args.k] if score >= args.threshold}
+        brute_ms.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        signature = hasher.signature(query)
+        candidates = set()
+        for band_key in hasher.band_keys(signature):
+            candidates |= buckets.get(band_key, set())
+        scored = sorted(((hasher.similarity(signature, signatures[device_id]), device_id) for device_id in candidates), reverse=True)
+        found = {device_id for score, device_id in scored[:args.k] if score >= args.threshold}
+        lsh_ms.append((time.perf_counter() - t0) * 1000)
+        candidate_counts.append(len(candidates))
+
+        if truth:
+            recalls.append(len(found & truth) / len(truth))
+
+    print(f"{'brute force':<12} mean={statistics.mean(brute_ms):8.3f}ms  p50={statistics.median(brute_ms):8.3f}ms")
+    print(f"{'LSH':<12} mean={statistics.mean(lsh_ms):8.3f}ms  p50={statistics.median(lsh_ms):8.3f}ms  "
+          f"candidates={statistics.mean(candidate_counts):.0f} ({statistics.mean(candidate_counts) / len(devices):.2%} of devices)")
+    if recalls:
+        print(f"recall@{args.k} (exact Jaccard >= {args.threshold}): {statistics.mean(recalls):.3f} over {len(recalls)} queries")
+
+if __name__ == "__main__":
+    main()
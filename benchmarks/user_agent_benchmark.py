@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Per-request cost of the cached user-agent parser vs. the old substring-chain detect_browser.
+
+    python benchmarks/user_agent_benchmark.py
+    python benchmarks/user_agent_benchmark.py --requests 200000 --corpus uas.txt   # one UA per line
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core.user_agent import parse_user_agent  # noqa: E402
+
+# Real-world UA strings (desktop, mobile, tablet, webviews, bots)
+CORPUS = [
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36 Edg/124.0.2478.80",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36 OPR/109.0.0.0",
+    "Mozilla/5.0 (Windows NT 6.1; WOW64; Trident/7.0; rv:11.0) like Gecko",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4.1 Safari/605.1.15",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Macintosh; Intel Mac OS X 14.4; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:125.0) Gecko/20100101 Firefox/125.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chromium/122.0.6261.128 Chrome/122.0.6261.128 Safari/537.36",
+    "Mozilla/5.0 (X11; CrOS x86_64 14541.0.0) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4_1 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4.1 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) CriOS/124.0.6367.88 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) FxiOS/125.0 Mobile/15E148 Safari/605.1.15",
+    "Mozilla/5.0 (iPad; CPU OS 17_4 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.4 Mobile/15E148 Safari/604.1",
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 16_6 like Mac OS X) AppleWebKit/605.1.15 (KHTML, like Gecko) Mobile/15E148 Instagram 329.0.0.29.120",
+    "Mozilla/5.0 (Linux; Android 14; Pixel 8) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.6367.82 Mobile Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 13; SM-S918B) AppleWebKit/537.36 (KHTML, like Gecko) SamsungBrowser/24.0 Chrome/117.0.0.0 Mobile Safari/537.36",
+    "Mozilla/5.0 (Linux; Android 13; SM-X700) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Safari/537.36",
+    "Mozilla/5.0 (Android 14; Mobile; rv:125.0) Gecko/125.0 Firefox/125.0",
+    "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0.0.0 Mobile Safari/537.36 EdgA/124.0.2478.64",
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/124.0.0.0 Safari/537.36",
+    "curl/8.4.0",
+]
+
+def legacy_detect_browser(user_agent):
+    # The substring chain services.detect_browser used before the cached parser
+    if 'Edg/' in user_agent:
+        return 'Edge'
+    elif 'OPR/' in user_agent or 'Opera' in user_agent:
+        return 'Opera'
+    elif 'Chrome/' in user_agent and 'Chromium' not in user_agent:
+        return 'Chrome'
+    elif 'Firefox/' in user_agent:
+        return 'Firefox'
+    elif 'Safari/' in user_agent and 'Chrome/' not in user_agent:
+        return 'Safari'
+    elif 'Chromium' in user_agent:
+        return 'Chromium'
+    else:
+        return 'Other'
+
+def time_per_call(fn, stream):
+    start = time.perf_counter()
+    for user_agent in stream:
+        fn(user_agent)
+    return (time.perf_counter() - start) / len(stream) * 1_000_000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="File with one UA string per line (defaults to the built-in corpus)")
+    parser.add_argument("--requests", type=int, default=100000, help="Simulated requests drawn from the corpus")
+    parser.add_argument("--rounds", type=int, default=5)
+    args = parser.parse_args()
+
+    corpus = CORPUS
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as handle:
+            corpus = [line.strip() for line in handle if line.strip()]
+
+    # Traffic is heavily skewed towards a few UAs
+    rng = random.Random(42)
+    weights = [1 / (rank + 1) for rank in range(len(corpus))]
+    stream = rng.choices(corpus, weights=weights, k=args.requests)
+
+    uncached = parse_user_agent.__wrapped__
+    results = {"legacy detect_browser": [], "parser (uncached)": [], "parser (cached)": []}
+    for _ in range(args.rounds):
+        parse_user_agent.cache_clear()
+        results["legacy detect_browser"].append(time_per_call(legacy_detect_browser, stream))
+        results["parser (uncached)"].append(time_per_call(uncached, stream))
+        results["parser (cached)"].append(time_per_call(parse_user_agent, stream))
+
+    print(f"{len(stream)} requests over {len(corpus)} distinct UAs, {args.rounds} rounds")
+    for label, samples in results.items():
+        print(f"{label:<24} median={statistics.median(samples):7.3f}us/request  best={min(samples):7.3f}us/request")
+
+    if not args.corpus:
+        print()
+        for user_agent in CORPUS:
+            info = parse_user_agent(user_agent)
+            print(f"{legacy_detect_browser(user_agent):<9} -> {info.browser} {info.browser_version or ''} | "
+                  f"{info.os} {info.os_version or ''} | {info.device_type} | {info.engine}")
+
+if __name__ == "__main__":
+    main()
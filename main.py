@@ -9,9 +9,24 @@ from contextlib import asynccontextmanager
 # Import application components
 from app.config import settings
 from app.database import connect_to_mongo, close_mongo_connection, redis_client
+from app.database.indexes import index_manager
 from app.api import api_router
 from app.core import create_error_response
 from app.core.rate_limiter import limiter, custom_rate_limit_handler
+from app.core.http_client import http_client
+from app.core.ingest import ingest_queue
+from app.core.profile_store import profile_store
+from app.core.dictionary import value_dictionary
+from app.core.visit_events import visit_events
+from app.core.ip_geo import ip_geo
+from app.core.public_ip import public_ip
+from app.core.reverse_geocoder import reverse_geocoder
+from app.core.enrichment import geocode_enrichment
+from app.core.similarity import similarity_index
+from app.core.frequency import attribute_frequencies
+from app.core.cardinality import unique_counters
+from app.core.rollups import rollups
+from app.core.retention import retention_engine
 from slowapi.errors import RateLimitExceeded
 
 # Configure logging
@@ -28,7 +43,24 @@ async def lifespan(app: FastAPI):
     logger.info("Starting application...")
     try:
         await connect_to_mongo()
+        # Creates the time-series collection before the index registry could create it as a plain one
+        await visit_events.start()
+        await index_manager.start()
         await redis_client.connect()
+        await http_client.start()
+        await ip_geo.start()
+        await public_ip.start()
+        await reverse_geocoder.start()
+        await ingest_queue.start()
+        await profile_store.start()
+        # After profile_store, whose prepare hook decides which profiles changed
+        await value_dictionary.start()
+        await similarity_index.start()
+        await attribute_frequencies.start()
+        await unique_counters.start()
+        await rollups.start()
+        await geocode_enrichment.start()
+        await retention_engine.start()
         logger.info("Application startup completed successfully")
         yield
     except Exception as e:
@@ -37,8 +69,19 @@ async def lifespan(app: FastAPI):
     finally:
         # Shutdown
         logger.info("Shutting down application...")
+        await retention_engine.stop()
+        # Drain pending visitor writes while Mongo is still connected
+        await geocode_enrichment.stop()
+        await ingest_queue.stop()
+        await similarity_index.stop()
+        await visit_events.stop()
+        await unique_counters.stop()
+        await index_manager.stop()
         await close_mongo_connection()
         await redis_client.disconnect()
+        await http_client.stop()
+        await ip_geo.stop()
+        await public_ip.stop()
         logger.info("Application shutdown completed")
 
 def create_application() -> FastAPI:
@@ -0,0 +1,205 @@
+import os
+
+# Settings are read at import time; no server is contacted by these tests
+os.environ.setdefault("MONGODB_URL", "mongodb://localhost:27017")
+os.environ.setdefault("MONGODB_DATABASE", "bfp_test")
+os.environ.setdefault("API_BASE_URL1", "http://localhost")
+os.environ.setdefault("SECRET_KEY", "test-secret")
+
+from types import SimpleNamespace  # noqa: E402
+from typing import Any, Dict, List, Optional  # noqa: E402
+
+import pytest  # noqa: E402
+from pymongo.errors import BulkWriteError  # noqa: E402
+
+from app.database import connection  # noqa: E402
+from app.database.redis_client import redis_client  # noqa: E402
+
+_OPERATORS = {
+    "$in": lambda value, operand: value in operand,
+    "$lt": lambda value, operand: value is not None and value < operand,
+    "$gt": lambda value, operand: value is not None and value > operand,
+    "$gte": lambda value, operand: value is not None and value >= operand,
+}
+
+def _matches(document: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for name, condition in query.items():
+        if name == "$or":
+            if not any(_matches(document, branch) for branch in condition):
+                return False
+            continue
+        value = document.get(name)
+        if isinstance(condition, dict) and condition and all(operator in _OPERATORS for operator in condition):
+            if not all(_OPERATORS[operator](value, operand) for operator, operand in condition.items()):
+                return False
+        elif value != condition:
+            return False
+    return True
+
+class FakeCursor:
+    def __init__(self, documents: List[Dict[str, Any]]):
+        self.documents = documents
+
+    def sort(self, *args, **kwargs) -> "FakeCursor":
+        return self
+
+    def limit(self, count: int) -> "FakeCursor":
+        self.documents = self.documents[:count]
+        return self
+
+    async def to_list(self, length: Optional[int] = None) -> List[Dict[str, Any]]:
+        return list(self.documents)
+
+    def __aiter__(self):
+        self._iter = iter(self.documents)
+        return self
+
+    async def __anext__(self) -> Dict[str, Any]:
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+class FakeCollection:
+    """Just enough of a motor collection: stored documents, and the operations written to it."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.documents: List[Dict[str, Any]] = []
+        self.operations: List[Any] = []
+        # Indexes of bulk_write operations to report as write errors
+        self.fail_indexes: List[int] = []
+
+    def find(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None) -> FakeCursor:
+        documents = [document for document in self.documents if _matches(document, query or {})]
+        # Only exclusion projections are applied; inclusions return the whole document
+        excluded = [name for name, value in (projection or {}).items() if not value]
+        if excluded:
+            documents = [{name: value for name, value in document.items() if name not in excluded} for document in documents]
+        return FakeCursor(documents)
+
+    async def find_one(self, query: Optional[Dict[str, Any]] = None, projection: Optional[Dict[str, Any]] = None):
+        documents = await self.find(query).to_list()
+        return documents[0] if documents else None
+
+    async def insert_many(self, documents: List[Dict[str, Any]], ordered: bool = True):
+        self.documents.extend(documents)
+
+    async def update_one(self, query: Dict[str, Any], update: Dict[str, Any], upsert: bool = False):
+        """Applies top-level $set fields only."""
+        documents = await self.find(query).to_list()
+        if documents:
+            documents[0].update(update.get("$set", {}))
+        elif upsert:
+            self.documents.append({**query, **update.get("$set", {})})
+
+    async def delete_many(self, query: Dict[str, Any]) -> SimpleNamespace:
+        kept = [document for document in self.documents if not _matches(document, query)]
+        deleted, self.documents = len(self.documents) - len(kept), kept
+        return SimpleNamespace(deleted_count=deleted)
+
+    async def bulk_write(self, operations: List[Any], ordered: bool = True):
+        self.operations.extend(operations)
+        if self.fail_indexes:
+            errors = [{"index": index, "code": 11000, "errmsg": "E11000 duplicate key"} for index in self.fail_indexes]
+            raise BulkWriteError({"writeErrors": errors, "writeConcernErrors": [], "nInserted": 0,
+                                  "nUpserted": 0, "nMatched": len(operations) - len(errors), "nModified": 0,
+                                  "nRemoved": 0, "upserted": []})
+
+class FakeDatabase(dict):
+    def __missing__(self, name: str) -> FakeCollection:
+        collection = self[name] = FakeCollection(name)
+        return collection
+
+@pytest.fixture
+def fake_db(monkeypatch) -> FakeDatabase:
+    database = FakeDatabase()
+    monkeypatch.setattr(connection.database, "database", database)
+    return database
+
+class FakePipeline:
+    """Queues commands and runs them against the FakeRedis on execute."""
+
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.commands: List[Any] = []
+
+    async def __aenter__(self) -> "FakePipeline":
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __getattr__(self, name: str):
+        return lambda *args, **kwargs: self.commands.append((name, args, kwargs))
+
+    async def execute(self) -> List[Any]:
+        commands, self.commands = self.commands, []
+        return [await getattr(self.redis, name)(*args, **kwargs) for name, args, kwargs in commands]
+
+class FakeRedis:
+    """Just enough of an aioredis client for the RedisClient methods: strings, sets, HyperLogLogs (as exact sets) and expiries."""
+
+    def __init__(self):
+        self.values: Dict[str, Any] = {}
+        self.expiries: Dict[str, int] = {}
+        self.commands: List[str] = []
+
+    def pipeline(self, transaction: bool = True) -> FakePipeline:
+        return FakePipeline(self)
+
+    async def mget(self, keys: List[str]) -> List[Optional[str]]:
+        self.commands.append("mget")
+        return [self.values.get(key) for key in keys]
+
+    async def set(self, key: str, value: str, nx: bool = False, px: Optional[int] = None) -> bool:
+        if nx and key in self.values:
+            return False
+        self.values[key] = value
+        return True
+
+    async def setex(self, key: str, ttl: int, value: str) -> bool:
+        self.values[key] = value
+        self.expiries[key] = ttl
+        return True
+
+    async def expire(self, key: str, ttl: int) -> bool:
+        self.commands.append("expire")
+        if key not in self.values:
+            return False
+        self.expiries[key] = ttl
+        return True
+
+    async def sadd(self, key: str, *members: str) -> int:
+        self.commands.append("sadd")
+        self.values.setdefault(key, set()).update(members)
+        return len(members)
+
+    async def srem(self, key: str, *members: str) -> int:
+        self.values.get(key, set()).difference_update(members)
+        return len(members)
+
+    async def smembers(self, key: str) -> set:
+        return set(self.values.get(key, set()))
+
+    async def srandmember(self, key: str, count: int) -> List[str]:
+        self.commands.append("srandmember")
+        return sorted(self.values.get(key, set()))[:count]
+
+    async def pfadd(self, key: str, *elements: str) -> int:
+        return await self.sadd(key, *elements)
+
+    async def pfcount(self, *keys: str) -> int:
+        return len(set().union(*(self.values.get(key, set()) for key in keys)))
+
+    async def eval(self, script: str, numkeys: int, key: str, token: str) -> int:
+        if self.values.get(key) != token:
+            return 0
+        del self.values[key]
+        return 1
+
+@pytest.fixture
+def fake_redis(monkeypatch) -> FakeRedis:
+    redis = FakeRedis()
+    monkeypatch.setattr(redis_client, "redis", redis)
+    return redis
@@ -0,0 +1,22 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.config import settings
+from app.core.access import require_api_key
+
+def status_for(api_key):
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(require_api_key(api_key))
+    return error.value.status_code
+
+def test_routes_are_disabled_without_a_configured_key(monkeypatch):
+    monkeypatch.setattr(settings, "fingerprint_api_key", None)
+    assert status_for("anything") == 404
+
+def test_only_the_configured_key_is_accepted(monkeypatch):
+    monkeypatch.setattr(settings, "fingerprint_api_key", "s3cret")
+    assert status_for(None) == 401
+    assert status_for("wrong") == 401
+    assert asyncio.run(require_api_key("s3cret")) is None
@@ -0,0 +1,52 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from app.core.cardinality import DAY, HOUR, CardinalityCounters, floor_to
+from app.core.ingest import IngestItem, IngestQueue
+from app.core.visit_events import VisitEventLog
+
+def visit_item(visitor_id: str, at: datetime) -> IngestItem:
+    visit = {"at": at, "visitor_id": visitor_id, "ip": "203.0.113.7", "fingerprint_hash": f"v1:{visitor_id}", "browser": "Firefox"}
+    return IngestItem(filter={"visitor_id": visitor_id}, set_fields={"last_seen": at}, inc={"visit_count": 1}, profile={}, visits=[visit])
+
+def test_only_applied_visits_are_counted_and_recorded(fake_db):
+    counters, events = CardinalityCounters(prefix="test"), VisitEventLog()
+    queue = IngestQueue()
+    queue.add_flush_hook(counters.on_flush)
+    queue.add_flush_hook(events.on_flush)
+    fake_db["visitor_logs"].fail_indexes = [1]
+    now = datetime(2026, 1, 1, 12)
+    asyncio.run(queue._flush([visit_item("v1", now), visit_item("v2", now)]))
+    assert counters.stats()["observed"] == 1
+    assert [event["visitor_id"] for event in events._pending] == ["v1"]
+
+def test_coalesced_visits_are_each_recorded(fake_db):
+    events = VisitEventLog()
+    queue = IngestQueue()
+    queue.add_flush_hook(events.on_flush)
+    now = datetime(2026, 1, 1, 12)
+    asyncio.run(queue._flush([visit_item("v1", now), visit_item("v1", now + timedelta(minutes=1))]))
+    assert len(fake_db["visitor_logs"].operations) == 1
+    assert [event["ts"] for event in events._pending] == [now, now + timedelta(minutes=1)]
+
+def test_counts_merge_the_covering_buckets(fake_redis):
+    counters = CardinalityCounters(prefix="test")
+    hour = floor_to(datetime.utcnow(), HOUR) - timedelta(hours=3)
+    counters.observe("v1", country="DE", at=hour)
+    counters.observe("v2", country="FR", at=hour)
+    counters.observe("v1", country="DE", at=hour + timedelta(hours=1))
+    asyncio.run(counters.flush())
+    result = asyncio.run(counters.count("visitors", "all", None, hour, hour + timedelta(hours=2)))
+    assert result["count"] == 2 and result["buckets"] == 2
+    series = asyncio.run(counters.series("visitors", "country", "DE", hour, hour + timedelta(hours=2), granularity=HOUR))
+    assert [point["count"] for point in series] == [1, 1]
+    breakdown = asyncio.run(counters.breakdown("visitors", "country", hour, hour + timedelta(hours=2)))
+    assert breakdown["total"] == 2
+    assert breakdown["values"] == [{"value": "FR", "count": 1}, {"value": "DE", "count": 1}]
+
+def test_whole_days_use_day_buckets():
+    counters = CardinalityCounters(prefix="test")
+    day = floor_to(datetime.utcnow(), DAY) - timedelta(days=2)
+    buckets, widened = counters.range_buckets(day - timedelta(hours=2), day + timedelta(days=1))
+    assert [granularity for granularity, _ in buckets] == [HOUR, HOUR, DAY]
+    assert not widened
@@ -0,0 +1,46 @@
+import asyncio
+
+from app.core.dictionary import REFERENCE_REFRESH, value_dictionary, value_id
+from app.core.ingest import IngestItem
+
+def test_flush_stores_values_of_unchanged_profiles_not_known_yet(fake_db):
+    profile = {"navigator": {"ua": "Mozilla/5.0 (dictionary test)"}}
+    item = IngestItem(filter={"visitor_id": "v1"}, set_fields=value_dictionary.ids(profile), profile=profile)
+    item.profile_changed = False
+    asyncio.run(value_dictionary.on_flush([item]))
+    operations = fake_db["profile_dictionary"].operations
+    assert [operation._filter for operation in operations] == [{"_id": f"ua:{value_id(profile['navigator']['ua'])}"}]
+    # Known now, so the next visit writes nothing
+    asyncio.run(value_dictionary.on_flush([item]))
+    assert len(operations) == 1
+
+def test_flush_moves_visitor_counts_to_the_new_id(fake_db):
+    profile = {"navigator": {"ua": "Mozilla/5.0 (dictionary count test)"}}
+    item = IngestItem(filter={"visitor_id": "v1"}, set_fields=value_dictionary.ids(profile), profile=profile)
+    item.previous = {"ua_id": 7}
+    asyncio.run(value_dictionary.on_flush([item]))
+    increments = {operation._filter["_id"]: operation._doc["$inc"]["visitors"] for operation in fake_db["profile_dictionary"].operations}
+    assert increments == {f"ua:{value_id(profile['navigator']['ua'])}": 1, "ua:7": -1}
+
+def test_unread_visits_leave_visitor_counts_alone(fake_db):
+    profile = {"navigator": {"ua": "Mozilla/5.0 (dictionary count test)"}}
+    value_dictionary.register(profile)
+    item = IngestItem(filter={"visitor_id": "v1"}, set_fields=value_dictionary.ids(profile), profile=profile)
+    item.profile_changed = False
+    asyncio.run(value_dictionary.on_flush([item]))
+    assert all("$inc" not in operation._doc for operation in fake_db["profile_dictionary"].operations)
+
+def test_flush_refreshes_references_that_are_due(fake_db):
+    profile = {"navigator": {"ua": "Mozilla/5.0 (dictionary reference test)"}}
+    item = IngestItem(filter={"visitor_id": "v1"}, set_fields=value_dictionary.ids(profile), profile=profile)
+    item.profile_changed = False
+    asyncio.run(value_dictionary.on_flush([item]))
+    asyncio.run(value_dictionary.on_flush([item]))
+    assert len(fake_db["profile_dictionary"].operations) == 1
+    entry_id = f"ua:{value_id(profile['navigator']['ua'])}"
+    value_dictionary._referenced[entry_id] -= REFERENCE_REFRESH
+    asyncio.run(value_dictionary.on_flush([item]))
+    operations = fake_db["profile_dictionary"].operations
+    assert len(operations) == 2
+    # An upsert, so an entry pruned meanwhile is stored again
+    assert operations[-1]._upsert and "referenced_at" in operations[-1]._doc["$max"]
@@ -0,0 +1,124 @@
+import asyncio
+
+from app.core.ingest import IngestItem, IngestQueue
+
+def make_queue(policy: str = "block", max_size: int = 100, batch_size: int = 100, flush_interval: float = 0.05) -> IngestQueue:
+    queue = IngestQueue()
+    queue.overflow_policy = policy
+    queue.max_size = max_size
+    queue.batch_size = batch_size
+    queue.flush_interval = flush_interval
+    return queue
+
+def visit(visitor_id: str, **fields) -> IngestItem:
+    return IngestItem(filter={"visitor_id": visitor_id}, set_fields=dict(fields), inc={"visit_count": 1})
+
+def test_coalesces_writes_for_the_same_document(fake_db):
+    async def run():
+        queue = make_queue()
+        seen = []
+
+        async def hook(items):
+            seen.extend(items)
+
+        queue.add_flush_hook(hook)
+        await queue.start()
+        await queue.submit(visit("v1", browser="Firefox"))
+        await queue.submit(visit("v1", browser="Chrome"))
+        await queue.submit(visit("v2", browser="Safari"))
+        await queue.stop()
+        return queue, seen
+
+    queue, seen = asyncio.run(run())
+    operations = fake_db["visitor_logs"].operations
+    assert len(operations) == 2
+    first = next(op for op in operations if op._filter == {"visitor_id": "v1"})
+    assert first._doc == {"$set": {"browser": "Chrome"}, "$inc": {"visit_count": 2}}
+    assert queue.stats()["coalesced"] == 1
+    assert len(seen) == 2
+
+def test_coalescing_folds_patches_into_pending_subdocuments(fake_db):
+    item = IngestItem(filter={"visitor_id": "v1"}, set_fields={"location": {"latitude": 52.52}})
+    item.merge(IngestItem(filter={"visitor_id": "v1"}, set_fields={"location.address": "Berlin"}, upsert=False))
+    assert item.set_fields == {"location": {"latitude": 52.52, "address": "Berlin"}}
+    assert item.upsert
+
+def test_stop_drains_queued_items(fake_db):
+    async def run():
+        queue = make_queue(batch_size=2, flush_interval=60)
+        await queue.start()
+        for index in range(5):
+            await queue.submit(visit(f"v{index}"))
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(run())
+    assert len(fake_db["visitor_logs"].operations) == 5
+    assert not queue.running
+
+def _overflow(fake_db, policy: str):
+    """Submit four visits while the first flush is stuck, with room for two in the queue."""
+    async def run():
+        queue = make_queue(policy=policy, max_size=2, batch_size=1)
+        release = asyncio.Event()
+        collection = fake_db["visitor_logs"]
+        write = collection.bulk_write
+
+        async def slow_write(operations, ordered=True):
+            await release.wait()
+            await write(operations, ordered=ordered)
+
+        collection.bulk_write = slow_write
+        await queue.start()
+        submits = []
+        for index in range(4):
+            submits.append(asyncio.create_task(queue.submit(visit(f"v{index}"))))
+            # Let the flusher pick up the first item before the queue fills
+            await asyncio.sleep(0.01)
+        release.set()
+        results = await asyncio.gather(*submits)
+        await queue.stop()
+        return queue, results
+
+    return asyncio.run(run())
+
+def test_drop_newest_rejects_items_when_full(fake_db):
+    queue, results = _overflow(fake_db, "drop_newest")
+    assert results == [True, True, True, False]
+    assert queue.stats()["dropped"] == 1
+    written = [op._filter["visitor_id"] for op in fake_db["visitor_logs"].operations]
+    assert written == ["v0", "v1", "v2"]
+
+def test_drop_oldest_evicts_the_head_of_the_queue(fake_db):
+    queue, results = _overflow(fake_db, "drop_oldest")
+    assert results == [True, True, True, True]
+    assert queue.stats()["dropped"] == 1
+    written = [op._filter["visitor_id"] for op in fake_db["visitor_logs"].operations]
+    assert written == ["v0", "v2", "v3"]
+
+def test_inline_policy_writes_overflow_directly(fake_db):
+    queue, results = _overflow(fake_db, "inline")
+    assert all(results)
+    assert queue.stats()["inline_writes"] == 1
+    assert len(fake_db["visitor_logs"].operations) == 4
+
+def test_partial_bulk_write_failure_still_runs_hooks_for_applied_writes(fake_db):
+    async def run():
+        queue = make_queue()
+        seen = []
+
+        async def hook(items):
+            seen.extend(item.filter["visitor_id"] for item in items)
+
+        queue.add_flush_hook(hook)
+        fake_db["visitor_logs"].fail_indexes = [1]
+        ok = await queue._flush([visit("v0"), visit("v1"), visit("v2")])
+        return queue, seen, ok
+
+    queue, seen, ok = asyncio.run(run())
+    assert not ok
+    assert seen == ["v0", "v2"]
+    stats = queue.stats()
+    assert stats["partial_batches"] == 1
+    assert stats["failed_operations"] == 1
+    assert stats["hook_errors"] == 0
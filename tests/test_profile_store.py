@@ -0,0 +1,79 @@
+import asyncio
+from datetime import datetime
+
+from app.config import settings
+from app.core.ingest import IngestItem, IngestQueue
+from app.core.profile_store import profile_digest, profile_store
+
+PROFILE = {"navigator": {"ua": "Mozilla/5.0 (X11; Linux x86_64)"}, "fonts": {"found": ["Arial", "Verdana"]}, "collectedAt": 1}
+
+def visit(profile: dict, **fields) -> IngestItem:
+    now = datetime(2026, 1, 1)
+    set_fields = {"created_at": now, "last_seen": now, "profile_digest": profile_digest(profile), **fields}
+    if not profile_store.enabled:
+        set_fields["profile"] = profile
+    return IngestItem(filter={"visitor_id": "v1"}, set_fields=set_fields, inc={"visit_count": 1}, profile=profile)
+
+def store_visitor(fake_db, **fields):
+    fake_db["visitor_logs"].documents.append({"visitor_id": "v1", "profile_digest": profile_digest(PROFILE), **fields})
+
+def flush(fake_db, *items: IngestItem) -> dict:
+    """The update written for v1 when the items are flushed together through change detection."""
+    queue = IngestQueue()
+    queue.add_prepare_hook(profile_store.prepare)
+    asyncio.run(queue._flush(list(items)))
+    return fake_db["visitor_logs"].operations[-1]._doc
+
+def test_unchanged_profile_still_writes_a_new_fingerprint_hash(fake_db):
+    store_visitor(fake_db, fingerprint_hash="v1:aaaa")
+    item = visit(dict(PROFILE, collectedAt=2), fingerprint_hash="v2:bbbb")
+    update = flush(fake_db, item)
+    assert not item.profile_changed
+    assert update["$set"]["fingerprint_hash"] == "v2:bbbb"
+    assert "profile_digest" not in update["$set"]
+    assert update["$inc"] == {"visit_count": 1}
+
+def test_unchanged_profile_keeps_a_coalesced_address_patch(fake_db):
+    store_visitor(fake_db)
+    patch = IngestItem(filter={"visitor_id": "v1"}, set_fields={"location.address": "Berlin"}, upsert=False)
+    update = flush(fake_db, visit(dict(PROFILE), **{"location.latitude": 52.52}), patch)
+    assert update["$set"]["location.address"] == "Berlin"
+    assert update["$set"]["location.latitude"] == 52.52
+
+def test_unchanged_profile_without_dictionary_ids_is_stored_again(fake_db):
+    store_visitor(fake_db)
+    item = visit(dict(PROFILE), ua_id=1, fonts_id=2)
+    update = flush(fake_db, item)
+    assert item.profile_changed
+    assert "profile" not in update["$set"]
+    assert update["$set"]["ua_id"] == 1
+
+def test_changed_inline_profile_writes_its_per_visit_paths(fake_db, monkeypatch):
+    monkeypatch.setattr(settings, "profile_cold_storage", False)
+    store_visitor(fake_db, profile=PROFILE)
+    profile = dict(PROFILE, fonts={"found": ["Arial"]}, collectedAt=2)
+    update = flush(fake_db, visit(profile))
+    assert update["$set"]["profile.fonts.found"] == ["Arial"]
+    assert update["$set"]["profile.collectedAt"] == 2
+    assert "profile" not in update["$set"]
+
+def test_unchanged_inline_profile_keeps_a_coalesced_address_patch(fake_db, monkeypatch):
+    monkeypatch.setattr(settings, "profile_cold_storage", False)
+    profile = dict(PROFILE, loc={"gps": {"latitude": 52.52, "longitude": 13.4}})
+    fake_db["visitor_logs"].documents.append({"visitor_id": "v1", "profile_digest": profile_digest(profile), "profile": profile})
+    patch = IngestItem(filter={"visitor_id": "v1"}, set_fields={"profile.loc.gps.address": "Berlin"}, upsert=False)
+    update = flush(fake_db, visit(profile), patch)
+    assert update["$set"]["profile.loc.gps.address"] == "Berlin"
+    assert "profile" not in update["$set"]
+
+def test_load_carries_the_hot_address_into_the_cold_profile(fake_db, monkeypatch):
+    profile = dict(PROFILE, loc={"gps": {"latitude": 52.52, "longitude": 13.4}})
+
+    async def get(key):
+        return profile
+
+    monkeypatch.setattr(profile_store, "get", get)
+    loaded = asyncio.run(profile_store.load({"visitor_id": "v1", "location": {"address": "Berlin"}}))
+    assert loaded["loc"]["gps"] == {"latitude": 52.52, "longitude": 13.4, "address": "Berlin"}
+    assert "address" not in profile["loc"]["gps"]
+    assert asyncio.run(profile_store.load({"visitor_id": "v1"})) is profile
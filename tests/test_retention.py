@@ -0,0 +1,94 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from app.config import settings
+from app.core.dictionary import value_id
+from app.core.profile_store import profile_digest, profile_store
+from app.core.retention import LOCK_KEY, STRIPPED_FIELDS, RetentionEngine, anonymize_profile, anonymize_update, pseudonym
+
+UA = "Mozilla/5.0 (X11; Linux x86_64; retention test)"
+CUTOFF = datetime(2026, 1, 10)
+
+def aged(number: int, **fields) -> dict:
+    return {"_id": number, "visitor_id": f"v{number}", "created_at": datetime(2026, 1, 1) + timedelta(hours=number), **fields}
+
+def cold_profile() -> dict:
+    return {
+        "navigator": {"ua": UA},
+        "localStorageData": {"token": "secret"},
+        "session": {"url": "https://example.com/account?id=42", "host": "example.com"},
+        "loc": {"gps": {"latitude": 52.520008, "longitude": 13.404954, "address": "Berlin", "accuracy": 12}},
+    }
+
+def test_anonymize_update_strips_and_pseudonymizes():
+    document = {
+        "browser_version": "120.0.6099",
+        "location": {"latitude": 52.520008, "longitude": 13.404954},
+        "profile": {"navigator": {"ua": UA}, "loc": {"ipInfo": {"publicIP": "203.0.113.7", "location": {"countryCode": "DE"}}}},
+    }
+    update = anonymize_update(document)
+    assert set(STRIPPED_FIELDS) <= set(update["$unset"])
+    assert "profile_digest" in update["$unset"]
+    assert update["$set"]["profile.navigator.ua"] == pseudonym(UA) != UA
+    assert update["$set"]["browser_version"] == "120"
+    assert update["$set"]["location.latitude"] == 52.5
+    assert update["$set"]["profile.loc.ipInfo"] == {"ip_hash": pseudonym("203.0.113.7"), "country": "DE"}
+    assert not set(update["$set"]) & set(update["$unset"])
+
+def test_pseudonyms_are_keyed_with_the_secret(monkeypatch):
+    first = pseudonym("203.0.113.7")
+    assert pseudonym("203.0.113.7") == first
+    monkeypatch.setattr(settings, "secret_key", "another-secret")
+    assert pseudonym("203.0.113.7") != first
+
+def test_anonymize_profile_leaves_the_input_alone():
+    profile = cold_profile()
+    anonymized = anonymize_profile(profile)
+    assert anonymized["navigator"]["ua"] == pseudonym(UA)
+    assert "localStorageData" not in anonymized
+    assert anonymized["session"] == {"host": "example.com"}
+    assert anonymized["loc"]["gps"] == {"latitude": 52.5, "longitude": 13.4}
+    assert profile == cold_profile()
+
+def test_anonymize_resumes_after_the_checkpoint(fake_db, monkeypatch):
+    monkeypatch.setattr(settings, "retention_batch_size", 2)
+    monkeypatch.setattr(settings, "retention_batch_pause", 0)
+    fake_db["visitor_logs"].documents.extend([aged(1), aged(2), aged(3), aged(4, created_at=CUTOFF + timedelta(days=1))])
+
+    async def anonymize_profiles(self, documents, cutoff):
+        pass
+
+    monkeypatch.setattr(RetentionEngine, "_anonymize_profiles", anonymize_profiles)
+    asyncio.run(RetentionEngine().anonymize(CUTOFF, max_batches=1))
+    checkpoint = fake_db["job_checkpoints"].documents[0]
+    assert (checkpoint["created_at"], checkpoint["doc_id"]) == (aged(2)["created_at"], 2)
+    # After a restart, the next run picks up behind the second document and stops at the cutoff
+    asyncio.run(RetentionEngine().anonymize(CUTOFF))
+    filters = [operation._filter for operation in fake_db["visitor_logs"].operations]
+    assert [operation["_id"] for operation in filters] == [1, 2, 3]
+    assert filters[0]["created_at"] == aged(1)["created_at"]
+
+def test_cold_profiles_are_anonymized_unless_rewritten(fake_db):
+    profile = cold_profile()
+    fake_db["visitor_profiles"].documents.extend([profile_store.encode("v1", profile), profile_store.encode("v2", profile)])
+    # v2 came back after the batch was read
+    fake_db["visitor_logs"].documents.extend([aged(1), aged(2, created_at=CUTOFF + timedelta(days=1))])
+    asyncio.run(RetentionEngine()._anonymize_profiles([aged(1), aged(2)], CUTOFF))
+    replaced = fake_db["visitor_profiles"].operations
+    assert [operation._filter for operation in replaced] == [{"_id": "v1", "digest": profile_digest(profile)}]
+    stored = profile_store.decode(replaced[0]._doc)
+    assert "localStorageData" not in stored and "address" not in stored["loc"]["gps"]
+    # The pseudonymized user agent is kept inline rather than added to the dictionary
+    assert stored["navigator"]["ua"] == pseudonym(UA)
+    entries = [operation._filter["_id"] for operation in fake_db["profile_dictionary"].operations]
+    assert f"ua:{value_id(pseudonym(UA))}" not in entries
+
+def test_run_is_skipped_while_another_worker_holds_the_lock(fake_db, fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "data_retention_days", 0)
+    monkeypatch.setattr(settings, "anonymize_after_days", 0)
+    fake_redis.values[LOCK_KEY] = "other-worker"
+    assert "skipped" in asyncio.run(RetentionEngine().run_once())
+    del fake_redis.values[LOCK_KEY]
+    assert asyncio.run(RetentionEngine().run_once()) == {"anonymized": 0, "deleted": 0, "pruned_values": 0}
+    # Released afterwards
+    assert LOCK_KEY not in fake_redis.values
@@ -0,0 +1,48 @@
+import asyncio
+from datetime import datetime, timedelta
+
+from app.config import settings
+from app.core.ingest import IngestItem
+from app.core.rollups import DAY, HOUR, MINUTE, RollupStore, _doc_id
+
+def visit(visitor_id: str, at: datetime, visits: int = 1, **fields) -> IngestItem:
+    return IngestItem(filter={"visitor_id": visitor_id}, set_fields={"created_at": at, **fields},
+                      inc={"visit_count": visits}, profile={})
+
+def test_flush_increments_every_granularity_and_dimension(fake_db):
+    store = RollupStore()
+    at = datetime(2026, 1, 1, 10, 30, 15)
+    patch = IngestItem(filter={"visitor_id": "v1"}, set_fields={"location.address": "Berlin"}, upsert=False)
+    asyncio.run(store.on_flush([visit("v1", at, visits=2, browser="Firefox"), visit("v2", at, browser="Chrome.Mobile"), patch]))
+    operations = {operation._filter["_id"]: operation._doc for operation in fake_db["visit_rollups"].operations}
+    # 3 granularities x (all + 4 dimensions)
+    assert len(operations) == 15
+    assert operations[_doc_id(MINUTE, datetime(2026, 1, 1, 10, 30), "all")]["$inc"] == {"total": 3}
+    browsers = operations[_doc_id(DAY, datetime(2026, 1, 1), "browser")]["$inc"]
+    assert browsers == {"total": 3, "counts.Firefox": 2, "counts.Chrome．Mobile": 1}
+    assert all(operation._upsert for operation in fake_db["visit_rollups"].operations)
+
+def test_cover_uses_the_coarsest_buckets_that_fit():
+    store = RollupStore()
+    day = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    cells, widened = store.cover(day - timedelta(minutes=90), day + timedelta(days=1, minutes=2))
+    assert [granularity for granularity, _ in cells] == [MINUTE] * 30 + [HOUR, DAY, MINUTE, MINUTE]
+    assert not widened
+
+def test_backfill_skips_days_whose_events_have_expired(monkeypatch):
+    monkeypatch.setattr(settings, "visit_events_ttl", 2 * 86400)
+    store = RollupStore()
+    rebuilt = []
+
+    async def backfill_day(day, source):
+        rebuilt.append(day)
+        return 1
+
+    monkeypatch.setattr(store, "_backfill_day", backfill_day)
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    result = asyncio.run(store.backfill(today - timedelta(days=5), today + timedelta(days=1)))
+    assert result["skipped_days"] == 3
+    assert sorted(rebuilt) == [today - timedelta(days=2), today - timedelta(days=1), today]
+    # Other sources keep their own history
+    result = asyncio.run(store.backfill(today - timedelta(days=5), today, source="visit_archive"))
+    assert result["skipped_days"] == 0
@@ -0,0 +1,56 @@
+import asyncio
+
+from app.config import settings
+from app.core.ingest import IngestItem
+from app.core.similarity import MinHasher, SimilarityIndex, feature_set
+
+def profile(*voices: str) -> dict:
+    return {"features": {"webgl": True, "touch": False}, "speechVoices": list(voices), "navigator": {"plat": "Linux x86_64"}}
+
+def visit(visitor_id: str, collected: dict, changed: bool = True) -> IngestItem:
+    item = IngestItem(filter={"visitor_id": visitor_id}, set_fields={}, profile=collected)
+    item.profile_changed = changed
+    return item
+
+def test_signatures_agree_with_jaccard_and_round_trip():
+    hasher = MinHasher(128, 32)
+    a, b = feature_set(profile("Anna", "Daniel")), feature_set(profile("Anna", "Karen"))
+    signature = hasher.signature(a)
+    assert (hasher.decode(hasher.encode(signature)) == signature).all()
+    assert hasher.similarity(signature, hasher.signature(a)) == 1.0
+    assert 0.0 < hasher.similarity(signature, hasher.signature(b)) < 1.0
+    assert len(hasher.band_keys(signature)) == 32
+
+def test_changed_profiles_are_counted_in_the_background(fake_db, fake_redis):
+    index = SimilarityIndex(prefix="test")
+    asyncio.run(index.on_flush([visit("v1", profile("Anna", "Daniel")), visit("v2", profile("Anna", "Daniel"))]))
+    # Indexed during the flush, counted only once the background queue runs
+    assert not fake_db["visitor_logs"].operations
+    asyncio.run(index.flush())
+    counts = {op._filter["visitor_id"]: op._doc["$set"]["similar_fingerprints"] for op in fake_db["visitor_logs"].operations}
+    assert counts == {"v1": 1, "v2": 1}
+    assert not any(op._upsert for op in fake_db["visitor_logs"].operations)
+
+def test_unchanged_profiles_only_refresh_expiry(fake_db, fake_redis):
+    index = SimilarityIndex(prefix="test")
+    asyncio.run(index.on_flush([visit("v1", profile("Anna"))]))
+    asyncio.run(index.flush())
+    fake_redis.commands.clear()
+    fake_redis.expiries.clear()
+    asyncio.run(index.on_flush([visit("v1", profile("Anna"), changed=False)]))
+    asyncio.run(index.flush())
+    assert "sadd" not in fake_redis.commands and "srandmember" not in fake_redis.commands
+    assert len(fake_redis.expiries) == 1 + index.hasher.bands
+    assert len(fake_db["visitor_logs"].operations) == 1
+
+def test_query_compares_at_most_max_candidates(fake_redis, monkeypatch):
+    monkeypatch.setattr(settings, "similarity_max_candidates", 2)
+    index = SimilarityIndex(prefix="test")
+    close = profile("Anna", "Daniel", "Karen")
+    asyncio.run(index.add("close", close))
+    for number in range(4):
+        asyncio.run(index.add(f"far{number}", profile("Anna", f"Voice {number}")))
+    results = asyncio.run(index.similar_to_profile(close, threshold=0.0))
+    assert index.stats()["capped_queries"] == 1
+    assert len(results) == 2
+    assert results[0] == ("close", 1.0)
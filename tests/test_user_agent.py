@@ -0,0 +1,25 @@
+import pytest
+
+from app.core.user_agent import parse_user_agent
+
+@pytest.mark.parametrize("user_agent", [
+    "Mozilla/5.0 (compatible; Googlebot/2.1; +http://www.google.com/bot.html)",
+    "Mozilla/5.0 (compatible; bingbot/2.0; +http://www.bing.com/bingbot.htm)",
+    "AdsBot-Google (+http://www.google.com/adsbot.html)",
+    "Slackbot-LinkExpanding 1.0 (+https://api.slack.com/robots)",
+    "Mozilla/5.0 (compatible; Discordbot/2.0; +https://discordapp.com)",
+    "Mozilla/5.0 (compatible; AhrefsBot/7.0; +http://ahrefs.com/robot/)",
+    "my-monitoring-bot",
+    "curl/8.4.0",
+    "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) HeadlessChrome/120.0.0.0 Safari/537.36",
+])
+def test_bots(user_agent):
+    assert parse_user_agent(user_agent).device_type == "bot"
+
+@pytest.mark.parametrize("user_agent, device_type", [
+    ("Mozilla/5.0 (Linux; Android 13; CUBOT X30) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36", "mobile"),
+    ("Mozilla/5.0 (Linux; Android 12; CUBOT TAB 10) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36", "tablet"),
+    ("Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36", "desktop"),
+])
+def test_devices_with_bot_in_their_name(user_agent, device_type):
+    assert parse_user_agent(user_agent).device_type == device_type
@@ -0,0 +1,22 @@
+from datetime import datetime
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+from app.core.utils import decode_cursor, encode_cursor
+
+def test_cursor_round_trip_keeps_types():
+    position = {"f": "created_at", "o": -1, "v": datetime(2026, 1, 1), "id": ObjectId()}
+    assert decode_cursor(encode_cursor(position)) == position
+
+def test_cursor_with_null_value():
+    position = {"f": "created_at", "o": 1, "v": None, "id": ObjectId()}
+    assert decode_cursor(encode_cursor(position)) == position
+
+@pytest.mark.parametrize("value", [{"$ne": None}, [1, 2], {"$where": "1"}])
+def test_cursor_rejects_non_scalar_positions(value):
+    with pytest.raises(HTTPException) as raised:
+        decode_cursor(encode_cursor({"f": "n", "o": 1, "v": value, "id": "x"}))
+    assert raised.value.status_code == 400
+    with pytest.raises(HTTPException):
+        decode_cursor(encode_cursor({"f": "n", "o": 1, "v": 1, "id": value}))
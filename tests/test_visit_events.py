@@ -0,0 +1,43 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.config import settings
+from app.core.visit_events import VisitEventLog, events_ttl
+
+START = datetime(2026, 1, 1)
+
+def test_events_expire_with_the_anonymization_window_by_default(monkeypatch):
+    monkeypatch.setattr(settings, "visit_events_ttl", None)
+    monkeypatch.setattr(settings, "anonymize_after_days", 7)
+    assert events_ttl() == 7 * 86400
+    monkeypatch.setattr(settings, "anonymize_after_days", 0)
+    monkeypatch.setattr(settings, "data_retention_days", 30)
+    assert events_ttl() == 30 * 86400
+    monkeypatch.setattr(settings, "visit_events_ttl", 0)
+    assert events_ttl() is None
+
+def test_record_buffers_a_slim_event_until_flushed(fake_db):
+    log = VisitEventLog()
+    log.record("v1", ip="203.0.113.7", fingerprint_hash="v1:aaaa", latitude=52.52, longitude=13.4, browser="Firefox", at=START)
+    assert not fake_db["visit_events"].documents
+    asyncio.run(log.flush())
+    event = fake_db["visit_events"].documents[0]
+    assert event["visitor_id"] == "v1" and event["ts"] == START
+    assert event["cell"] == "u33db"
+    assert "os" not in event
+
+def test_queries_never_return_the_ip(fake_db):
+    log = VisitEventLog()
+    fake_db["visit_events"].documents.append({"_id": 1, "ts": START, "visitor_id": "v1", "ip": "203.0.113.7", "browser": "Firefox"})
+    events = asyncio.run(log.timeline("v1"))
+    assert events == [{"ts": START, "visitor_id": "v1", "browser": "Firefox"}]
+    with pytest.raises(ValueError):
+        asyncio.run(log.scan(START, START + timedelta(days=1), {"ip": "203.0.113.7"}))
+    with pytest.raises(ValueError):
+        asyncio.run(log.histogram(START, START + timedelta(days=1), by="ip"))
+
+def test_range_scans_reject_an_empty_range(fake_db):
+    with pytest.raises(ValueError):
+        asyncio.run(VisitEventLog().scan(START, START))